@@ -1,5 +1,6 @@
 import frappe
 from datetime import datetime, timedelta
+from petcare.utils.hook_gating import depends_on
 from .call_task_utils import create_call_task, populate_call_history, populate_voxbay_calls, update_customer_data_collection
 
 @frappe.whitelist()
@@ -110,9 +111,10 @@ def create_followup_from_next_date(call_task_name):
     populate_voxbay_calls(new_task_name)
     return {"created": True, "task": new_task_name} 
 
+@depends_on("notes", "date", "customer")
 def on_update(doc, method=None):
     """
-    Sync notes to customer data collection on every update/save.
+    Sync notes to customer data collection when the notes (or their date or customer) change.
     """
     if doc.notes:
         update_customer_data_collection(doc.customer, doc.date, doc.notes) 
\ No newline at end of file
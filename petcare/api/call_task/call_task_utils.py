@@ -1,10 +1,11 @@
 import frappe
 from datetime import datetime
 from typing import List, Dict, Optional
+from petcare.utils.service_days import days_since_filter, days_since_order, add_days_since
 
 def get_customers_for_followup(limit: int = None) -> List[Dict]:
     """
-    Get customers who have custom_days_since_last_service >= 30, sorted by days in descending order.
+    Get customers whose last service was 30 or more days ago, sorted by days in descending order.
     
     Args:
         limit: Optional limit on number of customers to return
@@ -12,47 +13,28 @@ def get_customers_for_followup(limit: int = None) -> List[Dict]:
     Returns:
         List of customer dictionaries with required fields
     """
-    customers = frappe.get_all(
-        "Customer",
-        filters={
-            "disabled": 0,
-            "custom_days_since_last_service": [">=", 30]
-        },
-        fields=[
-            "name",
-            "customer_name",
-            "custom_days_since_last_service"
-        ],
-        order_by="custom_days_since_last_service desc"
-    )
-    
-    if limit:
-        customers = customers[:limit]
-        
-    return customers
+    return get_customers_for_followup_ordered(limit, order="desc")
 
 def get_customers_for_followup_ordered(limit: int = None, order: str = "desc") -> List[Dict]:
     """
     Get customers for followup in specified order.
     order: "desc" for descending, "asc" for ascending
     """
-    order_by = "custom_days_since_last_service desc" if order == "desc" else "custom_days_since_last_service asc"
     customers = frappe.get_all(
         "Customer",
         filters={
             "disabled": 0,
-            "custom_days_since_last_service": [">=", 30]
+            **days_since_filter(">=", 30)
         },
         fields=[
             "name",
             "customer_name",
-            "custom_days_since_last_service"
+            "custom_latest_completed_service_date"
         ],
-        order_by=order_by
+        order_by=days_since_order(order),
+        limit=limit
     )
-    if limit:
-        customers = customers[:limit]
-    return customers
+    return add_days_since(customers)
 
 def check_existing_task(customer: str, task_type: str) -> bool:
     """
@@ -140,8 +122,13 @@ def update_customer_data_collection(customer: str, date: str, notes: str):
     # Add the new note
     lines.append(f"{date} - {notes}")
 
+    # Nothing to save when the note for this date is already there
+    data_collection = "\n".join(lines)
+    if data_collection == existing:
+        return
+
     # Save back
-    customer_doc.custom_data_collection = "\n".join(lines)
+    customer_doc.custom_data_collection = data_collection
     customer_doc.save(ignore_permissions=True)
     frappe.db.commit()
 
@@ -1,299 +1,332 @@
 # File: handle_voxbay_event.py
 
 import frappe
-from frappe import _
+import hmac
 import json
-from datetime import datetime
-import os
+import logging
+import time
+from functools import lru_cache
+from frappe.utils import get_datetime
+from petcare.utils.config import get_default_phone_country_code, is_voxbay_customer_creation_deferred
+from petcare.utils.idempotency import find_or_create_locked, insert_or_get_existing
+from petcare.utils.locks import LockNotAcquiredError, named_lock
+from petcare.utils.phone import normalize_phone, phone_variants
+
+API_KEY_FILE = "/home/frappe-user/frappe-bench/keys/voxbay_config.json"
+REQUIRED_FIELDS = ["caller_number", "receiver_number", "start_time", "call_type", "call_status"]
+CALL_LOG_SAVEPOINT = "voxbay_call_log_insert"
+# The webhook does not wait for another request creating the same customer: it
+# defers the linking to a job, which waits
+CUSTOMER_LOCK_TIMEOUT = 0
+CUSTOMER_JOB_LOCK_TIMEOUT = 60
+
+# Set the "voxbay" logger to DEBUG (bench set-log-level) to also log payloads
+logger = frappe.logger("voxbay", allow_site=True)
+
+@lru_cache(maxsize=1)
+def read_api_key_file():
+    with open(API_KEY_FILE, 'r') as f:
+        return json.load(f).get('api_key')
 
 def load_api_key():
-    """Load API key from configuration file"""
-    config_path = "/home/frappe-user/frappe-bench/keys/voxbay_config.json"
+    """
+    API key from site config "voxbay_api_key", else the key file, which is
+    read once per worker. Restart the workers after rotating the key.
+    """
+    if frappe.conf.get("voxbay_api_key"):
+        return frappe.conf.get("voxbay_api_key")
     try:
-        with open(config_path, 'r') as f:
-            config = json.load(f)
-            return config.get('api_key')
+        return read_api_key_file()
     except Exception as e:
-        frappe.logger().error(f"Error loading API key: {str(e)}")
+        # Failures are not cached, so a key file added later is picked up
+        logger.error(f"Error loading API key: {str(e)}")
         return None
 
-class DateTimeEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.strftime('%Y-%m-%d %H:%M:%S')
-        return super().default(obj)
+def authenticate():
+    """
+    Check the request's X-Api-Key header against the Voxbay API key.
+
+    Returns:
+        dict: A 401 error response, or None if the key is valid
+    """
+    api_key = frappe.get_request_header('X-Api-Key')
+    if not api_key:
+        log_event(logging.WARNING, "voxbay_unauthorized", reason="missing_api_key")
+        return error_response("Unauthorized", "API key is required", 401)
+
+    valid_api_key = load_api_key()
+    if not valid_api_key or not hmac.compare_digest(str(api_key), str(valid_api_key)):
+        log_event(logging.WARNING, "voxbay_unauthorized", reason="invalid_api_key")
+        return error_response("Unauthorized", "Invalid API key", 401)
+    return None
+
+def log_event(level, event, **fields):
+    """Log one structured line, only if the logger is enabled for the level."""
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps({"event": event, **fields}, default=str))
 
 def format_phone_number(number):
-    """Format phone number to ensure it has + prefix"""
+    """
+    Format a phone number as "+<country code><national number>", the form
+    customers are matched on, so a bare national number gets the default
+    country code rather than just a "+".
+    """
     if not number:
         return number
-    
-    # Remove any spaces or special characters except +
-    cleaned_number = ''.join(char for char in str(number) if char.isdigit() or char == '+')
-    
-    # Add + if it's not there
-    if not cleaned_number.startswith('+'):
-        cleaned_number = '+' + cleaned_number
-        
-    return cleaned_number
+    return normalize_phone(number, get_default_phone_country_code())
 
-@frappe.whitelist(allow_guest=True)
-def handle_voxbay_event():
-    from frappe.utils import get_datetime
-    from frappe.model.document import get_controller
-    import traceback
+def error_response(error, details, status_code=None):
+    if status_code:
+        frappe.local.response.http_status_code = status_code
+    return {"message": "Error", "error": error, "details": details}
+
+def parse_event(data):
+    """
+    Validate a Voxbay event and build the Voxbay Call Log fields from it.
+
+    Returns:
+        tuple: (call log fields, None) or (None, (error, details))
+    """
+    missing_fields = [field for field in REQUIRED_FIELDS if not data.get(field)]
+    if missing_fields:
+        return None, (f"Missing required fields: {missing_fields}",
+                      f"Required fields missing: {', '.join(missing_fields)}")
+
+    caller = format_phone_number(data.get("caller_number"))
+    receiver = format_phone_number(data.get("receiver_number"))
+    if not caller or not receiver:
+        return None, ("Invalid phone number format", "Phone numbers must be valid")
 
     try:
-        print("\n=== Starting Voxbay Event Processing ===")
-        print(f"Request Method: {frappe.local.request.method}")
-        print(f"Request Headers: {dict(frappe.local.request.headers)}")
-        
-        # Validate API key
-        api_key = frappe.get_request_header('X-Api-Key')
-        if not api_key:
-            error_msg = "Missing API key in request headers"
-            print(f"ERROR: {error_msg}")
-            frappe.logger().error(error_msg)
-            return {"message": "Error", "error": "Unauthorized", "details": "API key is required"}, 401
-
-        valid_api_key = load_api_key()
-        if not valid_api_key or api_key != valid_api_key:
-            error_msg = "Invalid API key"
-            print(f"ERROR: {error_msg}")
-            frappe.logger().error(error_msg)
-            return {"message": "Error", "error": "Unauthorized", "details": "Invalid API key"}, 401
-
-        print("✓ API key validated")
-        
-        # Log the incoming request details
-        frappe.logger().info("=== Starting Voxbay Event Processing ===")
-        frappe.logger().info(f"Request Method: {frappe.local.request.method}")
-        frappe.logger().info(f"Request Headers: {dict(frappe.local.request.headers)}")
-        
-        data = frappe.local.form_dict
-        print(f"Received Voxbay data: {json.dumps(data, indent=2)}")
-        frappe.logger().info(f"Received Voxbay data: {json.dumps(data)}")
-
-        # Check if Voxbay Call Log doctype exists
-        if not frappe.db.exists("DocType", "Voxbay Call Log"):
-            error_msg = "Voxbay Call Log doctype does not exist"
-            print(f"ERROR: {error_msg}")
-            frappe.logger().error(error_msg)
-            return {"message": "Error", "error": error_msg, "details": "Voxbay Call Log doctype not found in the system"}
-        print("✓ Voxbay Call Log doctype exists")
-
-        # Validate required fields
-        required_fields = ["caller_number", "receiver_number", "start_time", "call_type", "call_status"]
-        missing_fields = [field for field in required_fields if not data.get(field)]
-        if missing_fields:
-            error_msg = f"Missing required fields: {missing_fields}"
-            print(f"ERROR: {error_msg}")
-            frappe.logger().error(error_msg)
-            return {"message": "Error", "error": error_msg, "details": f"Required fields missing: {', '.join(missing_fields)}"}
-        print("✓ All required fields present")
-
-        # Format phone numbers
-        caller = format_phone_number(data.get("caller_number"))
-        receiver = format_phone_number(data.get("receiver_number"))
-        
-        if not caller or not receiver:
-            error_msg = "Invalid phone number format"
-            print(f"ERROR: {error_msg}")
-            frappe.logger().error(error_msg)
-            return {"message": "Error", "error": error_msg, "details": "Phone numbers must be valid"}
-        
-        print(f"✓ Formatted caller number: {caller}")
-        print(f"✓ Formatted receiver number: {receiver}")
-
-        # Validate datetime format
-        try:
-            start_time = get_datetime(data.get("start_time"))
-            print(f"✓ Parsed start_time: {start_time}")
-            frappe.logger().info(f"Parsed start_time: {start_time}")
-        except Exception as e:
-            error_msg = f"Invalid start_time format: {str(e)}"
-            print(f"ERROR: {error_msg}")
-            frappe.logger().error(error_msg)
-            return {"message": "Error", "error": error_msg, "details": f"Start time format error: {str(e)}"}
+        start_time = get_datetime(data.get("start_time"))
+    except Exception as e:
+        return None, (f"Invalid start_time format: {str(e)}", f"Start time format error: {str(e)}")
+    try:
+        end_time = get_datetime(data.get("end_time")) if data.get("end_time") else None
+    except Exception as e:
+        return None, (f"Invalid end_time format: {str(e)}", f"End time format error: {str(e)}")
 
-        try:
-            end_time = get_datetime(data.get("end_time")) if data.get("end_time") else None
-            print(f"✓ Parsed end_time: {end_time}")
-            frappe.logger().info(f"Parsed end_time: {end_time}")
-        except Exception as e:
-            error_msg = f"Invalid end_time format: {str(e)}"
-            print(f"ERROR: {error_msg}")
-            frappe.logger().error(error_msg)
-            return {"message": "Error", "error": error_msg, "details": f"End time format error: {str(e)}"}
-
-        # Extract and validate other fields
-        direction = data.get("call_type")
-        status = data.get("call_status")
-        duration = data.get("duration")
-        recording_url = data.get("recording_url")
-        call_id = data.get("call_id")
-
-        print(f"\nProcessing call from {caller} to {receiver}")
-        frappe.logger().info(f"Processing call from {caller} to {receiver}")
-        if call_id:
-            print(f"Call ID: {call_id}")
-            frappe.logger().info(f"Call ID: {call_id}")
-
-        # Validate call type
-        if direction.lower() not in ["incoming", "outgoing"]:
-            error_msg = f"Invalid call_type: {direction}. Must be 'incoming' or 'outgoing'"
-            print(f"ERROR: {error_msg}")
-            frappe.logger().error(error_msg)
-            return {"message": "Error", "error": error_msg, "details": "Call type must be either 'incoming' or 'outgoing'"}
-        print(f"✓ Valid call type: {direction}")
-
-        # Map direction to ERPNext format
-        call_type = "Incoming" if direction.lower() == "incoming" else "Outgoing"
-
-        # Determine which number to use for customer lookup
-        customer_number = caller if call_type == "Incoming" else receiver
-        print(f"\nSearching for customer with number: {customer_number}")
-        frappe.logger().info(f"Searching for customer with number: {customer_number}")
-        
-        # First try to find customer by mobile_no
-        customer = frappe.db.get_value("Customer", {"mobile_no": ["like", f"%{customer_number}%"]})
-        
-        if not customer:
-            print("Searching in Contact records...")
-            # If not found in Customer, try to find in Contact records
-            contacts = frappe.get_all(
-                "Contact",
-                filters={
-                    "mobile_no": ["like", f"%{customer_number}%"],
-                    "is_primary_contact": 1
-                },
-                fields=["name"]
-            )
-            
-            if contacts:
-                contact_name = contacts[0].name
-                # Get linked customer from Dynamic Link table
-                customer_link = frappe.get_all(
-                    "Dynamic Link",
-                    filters={
-                        "parent": contact_name,
-                        "parenttype": "Contact",
-                        "link_doctype": "Customer"
-                    },
-                    fields=["link_name"]
-                )
-                
-                if customer_link:
-                    customer = customer_link[0].link_name
-                    print(f"Found customer through Contact: {customer}")
-                else:
-                    # If still not found, create a new customer
-                    print("No existing customer found, creating new customer...")
-                    customer = create_new_customer(customer_number)
-            else:
-                # If no contact found, create a new customer
-                print("No existing customer found, creating new customer...")
-                customer = create_new_customer(customer_number)
+    direction = str(data.get("call_type"))
+    if direction.lower() not in ["incoming", "outgoing"]:
+        return None, (f"Invalid call_type: {direction}. Must be 'incoming' or 'outgoing'",
+                      "Call type must be either 'incoming' or 'outgoing'")
 
-        if not customer:
-            error_msg = f"Could not find or create customer for number: {customer_number}"
-            print(f"ERROR: {error_msg}")
-            frappe.logger().warn(error_msg)
-            return {"message": "Error", "error": error_msg, "details": "Failed to find or create customer"}
+    # Map direction to ERPNext format
+    call_type = "Incoming" if direction.lower() == "incoming" else "Outgoing"
+    recording_url = data.get("recording_url")
+    doc_data = {
+        "from": caller,
+        "to": receiver,
+        "start_time": start_time,
+        "end_time": end_time,
+        "type": call_type,
+        "status": data.get("call_status"),
+        "duration": data.get("duration"),
+        "medium": "Voxbay",
+        "recording_url": recording_url,
+        "recording_html": f'<audio controls src="{recording_url}"></audio>' if recording_url else "",
+        "agent_number": data.get("agent_number"),
+        "button_pressed": data.get("button_pressed")
+    }
+    if data.get("call_id"):
+        doc_data["call_id"] = data.get("call_id")
+    return doc_data, None
+
+def get_customer_number(doc_data):
+    """The customer's side of the call: the caller for incoming calls, else the receiver."""
+    return doc_data["from"] if doc_data["type"] == "Incoming" else doc_data["to"]
 
-        print(f"✓ Found/created customer: {customer}")
-        frappe.logger().info(f"Found/created customer: {customer}")
+def find_customer(number):
+    """
+    Find the customer for a phone number with indexed equality lookups: the
+    Customer's normalized mobile, then a primary Contact's phone numbers.
+    The oldest match wins, as in the bulk importer's find_customers.
+    """
+    country_code = get_default_phone_country_code()
+    normalized = normalize_phone(number, country_code)
+    if not normalized:
+        return None
+
+    customer = frappe.db.get_value("Customer", {"custom_normalized_mobile": normalized}, order_by="creation asc")
+    if customer:
+        return customer
+
+    customer = frappe.db.sql("""
+        SELECT link.link_name
+        FROM `tabContact Phone` phone
+        JOIN `tabContact` contact ON contact.name = phone.parent
+        JOIN `tabDynamic Link` link ON link.parent = contact.name
+            AND link.parenttype = 'Contact' AND link.link_doctype = 'Customer'
+        WHERE phone.parenttype = 'Contact' AND phone.phone IN %s AND contact.is_primary_contact = 1
+        ORDER BY contact.creation
+        LIMIT 1
+    """, (tuple(phone_variants(normalized, country_code)),))
+    return customer[0][0] if customer else None
+
+def insert_call_log(doc):
+    """
+    Insert a call log, relying on the unique index on call_id: if a concurrent
+    delivery of the same event inserted it first, return that log instead.
 
-        # Check for duplicate logs using call_id
+    Returns:
+        tuple: (call log name, True if this call inserted it)
+    """
+    def insert():
+        frappe.db.savepoint(CALL_LOG_SAVEPOINT)
+        doc.insert(ignore_permissions=True)
+        return doc.name
+
+    def get_existing():
+        frappe.db.rollback(save_point=CALL_LOG_SAVEPOINT)
+        # Drop the "already exists" message Frappe queued for the response
+        frappe.clear_messages()
+        if not doc.get("call_id"):
+            return None
+        # A locking read sees the other transaction's committed row
+        return frappe.db.get_value("Voxbay Call Log", {"call_id": doc.call_id}, "name", for_update=True)
+
+    return insert_or_get_existing(insert, get_existing, (frappe.DuplicateEntryError, frappe.UniqueValidationError))
+
+@frappe.whitelist(allow_guest=True)
+def handle_voxbay_event():
+    started = time.perf_counter()
+    try:
+        error = authenticate()
+        if error:
+            return error
+
+        data = frappe.local.form_dict
+        log_event(logging.DEBUG, "voxbay_payload", payload=data)
+
+        doc_data, error = parse_event(data)
+        if error:
+            log_event(logging.WARNING, "voxbay_rejected", call_id=data.get("call_id"), error=error[0])
+            return error_response(*error)
+
+        call_id = doc_data.get("call_id")
+        # Cheap check for retries of an already logged event; concurrent ones are caught on insert
         if call_id:
-            print(f"\nChecking for duplicate using call_id: {call_id}")
             existing_call = frappe.db.exists("Voxbay Call Log", {"call_id": call_id})
-            
             if existing_call:
-                print(f"✓ Duplicate found - existing call log: {existing_call}")
-                frappe.logger().info(f"Duplicate Call Log found with call_id {call_id}: {existing_call}")
+                log_event(logging.INFO, "voxbay_duplicate", call_id=call_id, call_log=existing_call)
                 return {"message": "Success", "status": "duplicate", "existing_log": existing_call}
-            
-            print("No duplicate found, proceeding with creation")
 
-        # Create the Voxbay Call Log with detailed logging
-        print("\nCreating new Voxbay Call Log document...")
-        frappe.logger().info("Creating new Voxbay Call Log document")
+        customer_number = get_customer_number(doc_data)
+        customer = find_customer(customer_number)
+        deferred = False
+        if not customer:
+            if is_voxbay_customer_creation_deferred():
+                deferred = True
+            else:
+                try:
+                    customer, _ = create_customer_once(customer_number)
+                except LockNotAcquiredError:
+                    # Another request is still creating it; link the customer in the background
+                    deferred = True
+                if not customer and not deferred:
+                    log_event(logging.WARNING, "voxbay_no_customer", call_id=call_id, number=customer_number)
+                    return error_response(f"Could not find or create customer for number: {customer_number}",
+                                          "Failed to find or create customer")
+
         doc = frappe.new_doc("Voxbay Call Log")
-        doc_data = {
-            "from": caller,
-            "to": receiver,
-            "start_time": start_time,
-            "end_time": end_time,
-            "type": call_type,
-            "status": status,
-            "duration": duration,
-            "customer": customer,
-            "medium": "Voxbay",
-            "recording_url": recording_url,
-            "recording_html": f'<audio controls src="{recording_url}"></audio>' if recording_url else "",
-            "agent_number": data.get("agent_number"),
-            "button_pressed": data.get("button_pressed")
-        }
-        
-        # Add call_id if provided
-        if call_id:
-            doc_data["call_id"] = call_id
-            
         doc.update(doc_data)
-
-        # Log the document data before insertion
-        doc_dict = doc.as_dict()
-        # Convert datetime objects to strings for JSON serialization
-        if doc_dict.get('start_time'):
-            doc_dict['start_time'] = doc_dict['start_time'].strftime('%Y-%m-%d %H:%M:%S')
-        if doc_dict.get('end_time'):
-            doc_dict['end_time'] = doc_dict['end_time'].strftime('%Y-%m-%d %H:%M:%S')
-            
-        print(f"Voxbay Call Log data to be inserted: {json.dumps(doc_dict, indent=2)}")
-        frappe.logger().info(f"Voxbay Call Log data to be inserted: {json.dumps(doc_dict)}")
-
+        doc.customer = customer
+        # Logged without a customer until link_call_log_customer runs
+        doc.flags.ignore_mandatory = deferred
         try:
-            print("\nAttempting to insert document...")
-            doc.insert(ignore_permissions=True)
-            frappe.db.commit()
-            success_msg = f"✓ Voxbay Call log created successfully: {doc.name}"
-            print(success_msg)
-            frappe.logger().info(success_msg)
-            return {"message": "Success", "call_log": doc.name}
+            call_log, created = insert_call_log(doc)
         except Exception as e:
-            error_msg = f"Error inserting Voxbay Call Log: {str(e)}"
-            print(f"ERROR: {error_msg}")
-            print(f"Traceback: {traceback.format_exc()}")
-            frappe.logger().error(error_msg)
             frappe.log_error(frappe.get_traceback(), "Voxbay Call Log Insert Error")
-            return {"message": "Error", "error": error_msg, "details": str(e), "traceback": traceback.format_exc()}
+            return error_response(f"Error inserting Voxbay Call Log: {str(e)}", str(e))
+
+        if not created:
+            frappe.db.commit()
+            log_event(logging.INFO, "voxbay_duplicate", call_id=call_id, call_log=call_log, concurrent=True)
+            return {"message": "Success", "status": "duplicate", "existing_log": call_log}
+
+        if deferred:
+            frappe.enqueue(
+                "petcare.api.handle_voxbay_event.link_call_log_customer",
+                queue="short",
+                enqueue_after_commit=True,
+                call_log=doc.name
+            )
+        frappe.db.commit()
+
+        log_event(logging.INFO, "voxbay_call_logged", call_id=call_id, call_log=doc.name, customer=customer,
+                  ms=round((time.perf_counter() - started) * 1000, 1))
+        return {"message": "Success", "call_log": doc.name}
 
     except Exception as e:
-        error_msg = f"Error processing Voxbay event: {str(e)}"
-        print(f"ERROR: {error_msg}")
-        print(f"Traceback: {traceback.format_exc()}")
-        frappe.logger().error(error_msg)
         frappe.log_error(frappe.get_traceback(), "Voxbay Call Event Error")
-        return {"message": "Error", "error": error_msg, "details": str(e), "traceback": traceback.format_exc()}
+        return error_response(f"Error processing Voxbay event: {str(e)}", str(e))
+
+def link_call_log_customer(call_log):
+    """
+    Background job for a call logged without a customer: find or create the
+    customer for the call's number and link it.
+    """
+    doc_data = frappe.db.get_value("Voxbay Call Log", call_log, ["customer", "type", "from", "to"], as_dict=True)
+    if not doc_data or doc_data.customer:
+        return
+
+    customer_number = get_customer_number(doc_data)
+    customer, created = create_customer_once(customer_number, timeout=CUSTOMER_JOB_LOCK_TIMEOUT)
+    if not customer:
+        log_event(logging.WARNING, "voxbay_no_customer", call_log=call_log, number=customer_number)
+        return
+    frappe.db.set_value("Voxbay Call Log", call_log, "customer", customer)
+    frappe.db.commit()
+    log_event(logging.INFO, "voxbay_customer_linked", call_log=call_log, customer=customer, created=created)
+
+def create_customer_once(phone_number, timeout=CUSTOMER_LOCK_TIMEOUT):
+    """
+    Create a customer for an unknown number unless another request already has.
+
+    Creation is serialized per normalized number with a named lock, held until
+    the new customer is committed, so near-simultaneous calls from a new
+    number create one customer. A unique index on the normalized number is
+    not used because existing customers may already share numbers.
+    Commits the current transaction.
+
+    Returns:
+        tuple: (customer or None, True if this call created it)
+
+    Raises:
+        LockNotAcquiredError: If another request holds the number's lock after `timeout` seconds
+    """
+    normalized = normalize_phone(phone_number, get_default_phone_country_code())
+    if not normalized:
+        return None, False
+
+    def find():
+        # Ends this transaction's snapshot, so a customer committed by the
+        # lock's previous holder is visible
+        frappe.db.commit()
+        return find_customer(normalized)
+
+    def create():
+        customer = create_new_customer(phone_number)
+        frappe.db.commit()
+        return customer
+
+    customer, created = find_or_create_locked(named_lock(f"voxbay_customer:{normalized}", timeout), find, create)
+    return customer, bool(created and customer)
 
 def create_new_customer(phone_number):
     """Create a new customer with the given phone number"""
     try:
         # Format the phone number before creating customer
         formatted_number = format_phone_number(phone_number)
-        
+
         # Create new customer
         customer = frappe.new_doc("Customer")
         customer.customer_name = f"Customer {formatted_number}"
         customer.customer_type = "Individual"
         customer.mobile_no = formatted_number
         customer.insert(ignore_permissions=True)
-        frappe.db.commit()
         return customer.name
     except Exception as e:
-        error_msg = f"Error creating new customer: {str(e)}"
-        print(f"ERROR: {error_msg}")
-        print(f"Traceback: {traceback.format_exc()}")
-        frappe.logger().error(error_msg)
+        frappe.log_error(frappe.get_traceback(), "Voxbay Customer Creation Error")
+        log_event(logging.ERROR, "voxbay_customer_creation_failed", number=phone_number, error=str(e))
         return None
@@ -0,0 +1,169 @@
+import frappe
+from frappe.utils import getdate, today, cint
+from datetime import datetime, time as dt_time, timedelta
+from petcare.utils.helpers import extract_coordinates_from_url
+from petcare.utils.route_optimizer import build_duration_matrix, solve_route
+
+# Set up logger
+logger = frappe.logger("route_planning", allow_site=True, file_count=50)
+
+SERVICE_MINUTES_PER_PET = 60
+DEFAULT_WINDOW_MINUTES = 60  # used when a request has a start time but no end time
+
+
+def to_seconds(value):
+    """
+    Convert a Time/Datetime field value to seconds since midnight.
+
+    Service Request times come back as timedelta, time, datetime or string
+    depending on the field type and how they were set.
+    """
+    if value in (None, ""):
+        return None
+    if isinstance(value, timedelta):
+        return value.total_seconds() % 86400
+    if isinstance(value, datetime):
+        value = value.time()
+    if isinstance(value, str):
+        value = frappe.utils.get_datetime(value).time() if " " in value.strip() else frappe.utils.get_time(value)
+    if isinstance(value, dt_time):
+        return value.hour * 3600 + value.minute * 60 + value.second
+    return None
+
+
+def format_seconds(seconds):
+    """Format seconds since midnight as HH:MM."""
+    if seconds is None:
+        return None
+    seconds = int(seconds) % 86400
+    return f"{seconds // 3600:02d}:{(seconds % 3600) // 60:02d}"
+
+
+def get_scheduled_requests(date, truckstore=None):
+    """
+    Fetch a day's scheduled requests, with the customer's stored coordinates
+    for requests whose map link cannot be resolved.
+    """
+    conditions = ["sr.scheduled_date = %(date)s", "sr.status = 'Scheduled'"]
+    if truckstore:
+        conditions.append("sr.assigned_truckstore = %(truckstore)s")
+
+    return frappe.db.sql(f"""
+        SELECT
+            sr.name, sr.customer, sr.customer_name, sr.territory, sr.total_pets,
+            sr.assigned_truckstore, sr.assigned_truckstore_google_map_location,
+            sr.google_maps_link, sr.scheduled_date_start, sr.scheduled_date_end,
+            c.custom_latitude AS latitude, c.custom_longitude AS longitude
+        FROM `tabService Request` sr
+        LEFT JOIN `tabCustomer` c ON c.name = sr.customer
+        WHERE {" AND ".join(conditions)}
+        ORDER BY sr.assigned_truckstore, sr.scheduled_date_start
+    """, {"date": date, "truckstore": truckstore}, as_dict=True)
+
+
+def plan_truckstore_route(truckstore, requests):
+    """
+    Order one truckstore's requests for the day.
+
+    Returns:
+        dict: Ordered stops with ETA, waiting and lateness, plus route totals
+    """
+    truck_location = extract_coordinates_from_url(requests[0].assigned_truckstore_google_map_location)
+    if not truck_location:
+        return {"truckstore": truckstore, "error": "Truckstore location could not be resolved", "stops": []}
+
+    stops, unplaced = [], []
+    for request in requests:
+        # The request's own map link, as for travel quotes; the Customer's
+        # stored coordinates can be stale and only place stops without one
+        location = extract_coordinates_from_url(request.google_maps_link)
+        if not location and request.latitude and request.longitude:
+            location = f"{request.latitude},{request.longitude}"
+        if location:
+            stops.append((request, location))
+        else:
+            unplaced.append(request.name)
+
+    locations = [truck_location] + [location for _, location in stops]
+    durations, distances, estimated_legs = build_duration_matrix(truckstore, locations)
+
+    windows = [None]
+    service_seconds = [0]
+    for request, _ in stops:
+        start = to_seconds(request.scheduled_date_start)
+        end = to_seconds(request.scheduled_date_end)
+        if start is not None and (end is None or end <= start):
+            end = start + DEFAULT_WINDOW_MINUTES * 60
+        windows.append((start, end) if start is not None else None)
+        service_seconds.append(max(1, cint(request.total_pets)) * SERVICE_MINUTES_PER_PET * 60)
+
+    result = solve_route(durations, windows, service_seconds)
+
+    ordered = []
+    previous = 0
+    total_distance = 0
+    for position, stop in enumerate(result["stops"], start=1):
+        request, _ = stops[stop["node"] - 1]
+        leg_distance = distances[previous][stop["node"]]
+        total_distance += leg_distance
+        ordered.append({
+            "sequence": position,
+            "service_request": request.name,
+            "customer": request.customer,
+            "customer_name": request.customer_name,
+            "territory": request.territory,
+            "window_start": format_seconds(windows[stop["node"]][0]) if windows[stop["node"]] else None,
+            "window_end": format_seconds(windows[stop["node"]][1]) if windows[stop["node"]] else None,
+            "eta": format_seconds(stop["arrival"]),
+            "service_start": format_seconds(stop["start"]),
+            "wait_minutes": round((stop["start"] - stop["arrival"]) / 60),
+            "late_minutes": round(stop["late_seconds"] / 60),
+            "leg_km": round(leg_distance / 1000, 1)
+        })
+        previous = stop["node"]
+    total_distance += distances[previous][0] if ordered else 0
+
+    return {
+        "truckstore": truckstore,
+        "departure": format_seconds(result["departure"]),
+        "stops": ordered,
+        "unplaced": unplaced,
+        "total_km": round(total_distance / 1000, 1),
+        "estimated_legs": estimated_legs,
+        "solve_ms": round(result["solve_ms"], 2)
+    }
+
+
+@frappe.whitelist()
+def get_daily_routes(date=None, truckstore=None):
+    """
+    Plan the visiting order of every truckstore's scheduled requests for a day.
+
+    Args:
+        date (str, optional): Scheduled date, defaults to today
+        truckstore (str, optional): Only plan this truckstore
+
+    Returns:
+        list: One route per truckstore
+    """
+    date = getdate(date or today())
+    requests = get_scheduled_requests(date, truckstore)
+
+    by_truckstore = {}
+    for request in requests:
+        by_truckstore.setdefault(request.assigned_truckstore or "Unassigned", []).append(request)
+
+    routes = []
+    for name, truckstore_requests in by_truckstore.items():
+        if name == "Unassigned":
+            routes.append({
+                "truckstore": name,
+                "stops": [],
+                "unplaced": [request.name for request in truckstore_requests],
+                "error": "No truckstore assigned"
+            })
+            continue
+        routes.append(plan_truckstore_route(name, truckstore_requests))
+
+    logger.info(f"Planned {len(routes)} route(s) for {date} covering {len(requests)} request(s)")
+    return routes
@@ -1,7 +1,14 @@
-from petcare.utils.directions import calculate_round_trip, calculate_bearings_from_center
+from petcare.utils.directions import (
+    calculate_initial_compass_bearing, get_compass_direction, DistanceMatrixClient, get_distance_matrix
+)
 from petcare.utils.helpers import extract_coordinates_from_url
 from petcare.utils.config import get_google_maps_api_key
+from petcare.utils.travel_estimator import (
+    get_round_trip, estimate_round_trip, parse_coordinates, get_cached_legs, cache_leg, normalize_location
+)
 import frappe
+import json
+import time
 from frappe.utils import nowdate, getdate
 from erpnext.accounts.doctype.sales_invoice.sales_invoice import SalesInvoice
 import math
@@ -10,6 +17,113 @@ import math
 frappe.utils.logger.set_log_level("DEBUG")
 logger = frappe.logger("service_request_api", allow_site=True, file_count=50)
 
+# Keys of the calculate_service_distance result that the bulk calculation
+# stores on the Service Request, under the same fieldnames
+TRAVEL_COST_FIELDS = [
+    "distance_km",
+    "duration_minutes",
+    "direction",
+    "chargeable_kms",
+    "traveling_cost",
+    "traveling_cost_after_GST",
+    "final_traveling_cost"
+]
+
+def get_service_locations(doc):
+    """
+    Resolve the truck/store and customer coordinates for a Service Request
+    from their map links.
+
+    Returns:
+        tuple: (truck_location, customer_location) as "lat,lng" strings
+    """
+    customer_location = extract_coordinates_from_url(doc.google_maps_link)
+    truck_location = extract_coordinates_from_url(doc.assigned_truckstore_google_map_location)
+
+    return truck_location, customer_location
+
+def get_direction(truck_location, customer_location):
+    """Compass direction of the customer as seen from the truck/store."""
+    truck = parse_coordinates(truck_location)
+    customer = parse_coordinates(customer_location)
+    if not truck or not customer:
+        return None
+    bearing = calculate_initial_compass_bearing(truck[0], truck[1], customer[0], customer[1])
+    return get_compass_direction(bearing)
+
+def calculate_travel_cost(total_distance_meters, total_duration_seconds, cost_per_km=None, free_distance_threshold_km=None):
+    """
+    Apply the Petcare Settings tariff to a round trip.
+
+    Args:
+        total_distance_meters (float): Round trip distance
+        total_duration_seconds (float): Round trip duration
+        cost_per_km (float, optional): Overrides Petcare Settings, used by bulk callers
+        free_distance_threshold_km (float, optional): Overrides Petcare Settings
+
+    Returns:
+        dict: Distance, duration and the chargeable/GST/rounded travel cost
+    """
+    if cost_per_km is None or free_distance_threshold_km is None:
+        cost_per_km, free_distance_threshold_km = get_travel_tariff()
+
+    # Calculate total distance in KM
+    total_travel_kms = total_distance_meters / 1000
+    logger.debug(f"Total Travel KMs: {total_travel_kms}")
+    # Calculate traveling cost based on the free distance threshold
+    chargeable_kms = round(max(0, total_travel_kms - free_distance_threshold_km),0)  # KMs above the free limit
+    # Calculate the traveling cost
+    traveling_cost = chargeable_kms * cost_per_km
+
+    # Round the traveling cost to the nearest upper multiple of 50
+    traveling_cost = math.ceil(traveling_cost / 50) * 50
+
+    # Round total travel duration (no decimals)
+    total_duration_minutes = round(total_duration_seconds / 60)
+
+    logger.debug(f"Chargeable KMs: {chargeable_kms}")
+    logger.debug(f"Traveling Cost: {traveling_cost}")
+
+    # Add 18% GST to traveling cost
+    traveling_cost_after_GST = traveling_cost * 1.18
+    logger.debug(f"Traveling Cost After GST: {traveling_cost_after_GST}")
+
+    # Round traveling cost after GST to the nearest 50
+    final_traveling_cost = math.ceil(traveling_cost_after_GST / 50) * 50
+    logger.debug(f"Final Traveling Cost (Rounded to 50): {final_traveling_cost}")
+
+    # Format the duration into hours and minutes
+    hours = total_duration_minutes // 60
+    minutes = total_duration_minutes % 60
+    duration_hours_and_minutes = f"{hours} hour{'s' if hours != 1 else ''} and {minutes} minute{'s' if minutes != 1 else ''}"
+
+    return {
+        "distance_km": total_distance_meters / 1000,
+        "duration_minutes": total_duration_minutes,
+        "duration_hours_and_minutes": duration_hours_and_minutes,
+        "traveling_cost": traveling_cost,
+        "chargeable_kms": chargeable_kms,
+        "traveling_cost_after_GST": traveling_cost_after_GST,
+        "final_traveling_cost": final_traveling_cost
+    }
+
+def get_travel_tariff():
+    """
+    Fetch cost per km and free km limit from Petcare Settings.
+
+    Returns:
+        tuple: (cost_per_km, free_distance_threshold_km)
+    """
+    cost_per_km = frappe.db.get_single_value("Petcare Settings", "cost_per_km")
+    free_distance_threshold_km = frappe.db.get_single_value("Petcare Settings", "free_distance_threshold_km")
+    logger.debug(f"Cost Per KM: {cost_per_km}")
+    logger.debug(f"Free KM Limit: {free_distance_threshold_km}")
+
+    if not cost_per_km or not free_distance_threshold_km:
+        frappe.throw("Cost Per KM or Free KM Limit is not defined in Petcare Settings.")
+
+    return cost_per_km, free_distance_threshold_km
+
 @frappe.whitelist()
 def calculate_service_distance(service_request_name):
     try:
@@ -20,96 +134,247 @@ def calculate_service_distance(service_request_name):
         doc = frappe.get_doc("Service Request", service_request_name)
         api_key = get_google_maps_api_key()
         
-        
-        customer_location = extract_coordinates_from_url(doc.google_maps_link)
-        truck_location = extract_coordinates_from_url(doc.assigned_truckstore_google_map_location)
-        print(f"Customer Location: {customer_location}")
-        print(f"Truck Location: {truck_location}")
+        truck_location, customer_location = get_service_locations(doc)
         # Log input data
-        logger.debug(f"Customer Locationn: {customer_location}")
+        logger.debug(f"Customer Location: {customer_location}")
         logger.debug(f"Truck Location: {truck_location}")
 
         if not customer_location or not truck_location:
             logger.error("Both customer and truck/store locations must be provided.")
             frappe.throw("Both customer and truck/store locations must be provided.")
         
-        # Calculate round trip distance
+        # Calculate round trip distance, reusing legs already in the Travel Leg Cache
         locations = [truck_location, customer_location, truck_location]
-        result = calculate_round_trip(api_key, locations)
+        result = get_round_trip(api_key, doc.assigned_truckstore, locations)
         
         # Log calculation results
         logger.debug(f"API Result: {result}")
         
-        result = calculate_round_trip(api_key, locations)
-        
-        # Calculate bearings and directions
-        bearings = calculate_bearings_from_center(api_key, truck_location, [customer_location])
-        logger.debug(f"Bearings: {bearings}")
-        
-        # Extract only the direction
-        direction = bearings[0]["direction"] if bearings else None
-        
-        # Log extracted direction
+        # The bearing is computed from the coordinates we already have,
+        # no need to geocode them again
+        direction = get_direction(truck_location, customer_location)
         logger.debug(f"Extracted Direction: {direction}")
 
-        if direction:
-            direction = direction.strip()
-        
-        logger.debug(f"Extracted Direction no quotes: {direction}")
-        
-        # Fetch cost per km and free km limit
-        cost_per_km = frappe.db.get_single_value("Petcare Settings", "cost_per_km")
-        free_distance_threshold_km = frappe.db.get_single_value("Petcare Settings", "free_distance_threshold_km")
-        logger.debug(f"Cost Per KM: {cost_per_km}")
-        logger.debug(f"Free KM Limit: {free_distance_threshold_km}")
-
-        if not cost_per_km or not free_distance_threshold_km:
-            frappe.throw("Cost Per KM or Free KM Limit is not defined in Petcare Settings.")
-
-        # Calculate total distance in KM
-        total_travel_kms = result["total_distance_meters"] / 1000
-        logger.debug(f"Total Travel KMs: {total_travel_kms}")
-        # Calculate traveling cost based on the free distance threshold
-        chargeable_kms = round(max(0, total_travel_kms - free_distance_threshold_km),0)  # KMs above the free limit
-        # Calculate the traveling cost
-        traveling_cost = chargeable_kms * cost_per_km
-
-        # Round the traveling cost to the nearest upper multiple of 50
-        traveling_cost = math.ceil(traveling_cost / 50) * 50
-        
-        # Round total travel duration (no decimals)
-        total_duration_minutes = round(result["total_duration_seconds"] / 60)
-        
-        logger.debug(f"Chargeable KMs: {chargeable_kms}")
-        logger.debug(f"Traveling Cost: {traveling_cost}")
-        
-        # Add 18% GST to traveling cost
-        traveling_cost_after_GST = traveling_cost * 1.18
-        logger.debug(f"Traveling Cost After GST: {traveling_cost_after_GST}")
-
-        # Round traveling cost after GST to the nearest 50
-        final_traveling_cost = math.ceil(traveling_cost_after_GST / 50) * 50
-        logger.debug(f"Final Traveling Cost (Rounded to 50): {final_traveling_cost}")
-        
-        # Format the duration into hours and minutes
-        hours = total_duration_minutes // 60
-        minutes = total_duration_minutes % 60
-        duration_hours_and_minutes = f"{hours} hour{'s' if hours != 1 else ''} and {minutes} minute{'s' if minutes != 1 else ''}"
-        
-        return {
-            "distance_km": result["total_distance_meters"] / 1000,
-            "duration_minutes": total_duration_minutes,
-            "duration_hours_and_minutes": duration_hours_and_minutes,  
-            "direction": direction,
-            "traveling_cost": traveling_cost,
-            "chargeable_kms": chargeable_kms,
-            "traveling_cost_after_GST": traveling_cost_after_GST,
-            "final_traveling_cost": final_traveling_cost
-        }
+        response = calculate_travel_cost(result["total_distance_meters"], result["total_duration_seconds"])
+        response["direction"] = direction
+        return response
 
     except Exception as e:
         logger.exception(f"Error in calculate_service_distance: {e}")
         frappe.log_error(frappe.get_traceback(), "Service Distance Calculation Error")
         raise e
 
+@frappe.whitelist()
+def estimate_service_distance(service_request_name, refine=1):
+    """
+    Instant travel quote that works without the Google Directions API.
+
+    Road distance is predicted from the haversine distance using the
+    truckstore's calibrated road factor. If any leg had to be estimated and
+    `refine` is set, the exact calculation is queued in the background and
+    its result is pushed to the user as a `service_distance_refined` event.
+
+    Returns:
+        dict: Same keys as calculate_service_distance plus low/high bounds,
+              `is_estimate` and `refinement_queued`
+    """
+    doc = frappe.get_doc("Service Request", service_request_name)
+    truck_location, customer_location = get_service_locations(doc)
+    if not customer_location or not truck_location:
+        frappe.throw("Both customer and truck/store locations must be provided.")
+
+    locations = [truck_location, customer_location, truck_location]
+    estimate = estimate_round_trip(doc.assigned_truckstore, locations)
+    cost_per_km, free_distance_threshold_km = get_travel_tariff()
+
+    response = calculate_travel_cost(
+        estimate["total_distance_meters"], estimate["total_duration_seconds"],
+        cost_per_km, free_distance_threshold_km
+    )
+    low = calculate_travel_cost(
+        estimate["total_distance_meters_low"], estimate["total_duration_seconds_low"],
+        cost_per_km, free_distance_threshold_km
+    )
+    high = calculate_travel_cost(
+        estimate["total_distance_meters_high"], estimate["total_duration_seconds_high"],
+        cost_per_km, free_distance_threshold_km
+    )
+    response.update({
+        "direction": get_direction(truck_location, customer_location),
+        "distance_km_low": low["distance_km"],
+        "distance_km_high": high["distance_km"],
+        "duration_minutes_low": low["duration_minutes"],
+        "duration_minutes_high": high["duration_minutes"],
+        "final_traveling_cost_low": low["final_traveling_cost"],
+        "final_traveling_cost_high": high["final_traveling_cost"],
+        "calibration_samples": estimate["calibration_samples"],
+        "is_estimate": bool(estimate["estimated_legs"]),
+        "refinement_queued": False
+    })
+
+    if estimate["estimated_legs"] and frappe.utils.cint(refine):
+        frappe.enqueue(
+            "petcare.api.service_request.refine_service_distance",
+            queue="short",
+            job_id=f"refine_service_distance::{service_request_name}",
+            deduplicate=True,
+            service_request_name=service_request_name,
+            user=frappe.session.user
+        )
+        response["refinement_queued"] = True
+
+    return response
+
+def refine_service_distance(service_request_name, user=None):
+    """
+    Background job: run the exact Directions calculation, which also caches the
+    legs for future estimates, and notify the user who asked for the quote.
+    """
+    result = calculate_service_distance(service_request_name)
+    frappe.db.commit()
+    frappe.publish_realtime(
+        "service_distance_refined",
+        {"service_request": service_request_name, **result},
+        user=user
+    )
+    return result
+
+def get_travel_requests(date=None, service_requests=None):
+    """
+    Fetch the requests for a bulk travel calculation in one query.
+    """
+    conditions = ["status != 'Cancelled'"]
+    if service_requests:
+        conditions.append("name IN %(names)s")
+    else:
+        conditions.append("scheduled_date = %(date)s")
+
+    return frappe.db.sql(f"""
+        SELECT
+            name, customer, assigned_truckstore, assigned_truckstore_google_map_location, google_maps_link
+        FROM `tabService Request`
+        WHERE {" AND ".join(conditions)}
+    """, {"date": getdate(date or nowdate()), "names": tuple(service_requests or [""])}, as_dict=True)
+
+def calculate_service_distances_bulk(date=None, service_requests=None, client=None, write_back=True):
+    """
+    Compute travel cost for a whole day's schedule (or a list of requests).
+
+    Requests are grouped by truckstore. Legs missing from the Travel Leg Cache
+    are fetched with batched Distance Matrix requests (truckstore to every
+    customer, and every customer back to the truckstore) instead of one
+    Directions call per leg. All results are written back in one transaction.
+
+    Args:
+        date (str, optional): Scheduled date, defaults to today
+        service_requests (list, optional): Explicit Service Request names instead of a date
+        client (optional): Object with a `distance_matrix(origins, destinations)`
+                           method; defaults to the Google Distance Matrix API
+        write_back (bool): Store results on the Service Requests
+
+    Returns:
+        dict: Per-request results, failures and run statistics
+    """
+    started = time.perf_counter()
+    if write_back:
+        # Fail before spending any API requests on results that cannot be stored
+        meta = frappe.get_meta("Service Request")
+        missing = [field for field in TRAVEL_COST_FIELDS if not meta.has_field(field)]
+        if missing:
+            frappe.throw(f"Service Request is missing the travel cost field(s): {', '.join(missing)}")
+    requests = get_travel_requests(date, service_requests)
+    cost_per_km, free_distance_threshold_km = get_travel_tariff()
+    client = client or DistanceMatrixClient(get_google_maps_api_key())
+
+    # Resolve locations and group requests by truckstore
+    groups = {}
+    results, failed = {}, {}
+    truck_locations = {}
+    for request in requests:
+        map_link = request.assigned_truckstore_google_map_location
+        if map_link not in truck_locations:
+            truck_locations[map_link] = normalize_location(extract_coordinates_from_url(map_link))
+        truck_location = truck_locations[map_link]
+        customer_location = normalize_location(extract_coordinates_from_url(request.google_maps_link))
+        if not truck_location or not customer_location:
+            failed[request.name] = "Both customer and truck/store locations must be provided."
+            continue
+        group = groups.setdefault((request.assigned_truckstore, truck_location), [])
+        group.append((request, customer_location))
+
+    fetched_legs = 0
+    for (truckstore, truck_location), group in groups.items():
+        customers = list({location for _, location in group})
+        legs = get_cached_legs([truck_location] + customers)
+
+        outbound = [c for c in customers if (truck_location, c) not in legs]
+        inbound = [c for c in customers if (c, truck_location) not in legs]
+        new_legs = {}
+        if outbound:
+            new_legs.update(get_distance_matrix(client, [truck_location], outbound))
+        if inbound:
+            new_legs.update(get_distance_matrix(client, inbound, [truck_location]))
+        for (origin, destination), leg in new_legs.items():
+            cache_leg(truckstore, origin, destination, leg, source="Distance Matrix")
+        legs.update(new_legs)
+        fetched_legs += len(new_legs)
+
+        for request, customer_location in group:
+            there = legs.get((truck_location, customer_location))
+            back = legs.get((customer_location, truck_location))
+            if not there or not back:
+                failed[request.name] = "No route found between truck/store and customer."
+                continue
+            result = calculate_travel_cost(
+                there["distance_meters"] + back["distance_meters"],
+                there["duration_seconds"] + back["duration_seconds"],
+                cost_per_km, free_distance_threshold_km
+            )
+            result["direction"] = get_direction(truck_location, customer_location)
+            results[request.name] = result
+
+    if write_back and results:
+        try:
+            for name, result in results.items():
+                frappe.db.set_value(
+                    "Service Request", name,
+                    {field: result[field] for field in TRAVEL_COST_FIELDS},
+                    update_modified=False
+                )
+            frappe.db.commit()
+        except Exception:
+            frappe.db.rollback()
+            raise
+
+    summary = {
+        "results": results,
+        "failed": failed,
+        "requests": len(requests),
+        "truckstores": len(groups),
+        "fetched_legs": fetched_legs,
+        "api_requests": getattr(client, "request_count", None),
+        "seconds": round(time.perf_counter() - started, 3)
+    }
+    logger.info(
+        f"Bulk travel cost: {len(results)} computed, {len(failed)} failed, "
+        f"{fetched_legs} legs fetched in {summary['api_requests']} request(s), {summary['seconds']}s"
+    )
+    return summary
+
+@frappe.whitelist()
+def calculate_service_distances(date=None, service_requests=None):
+    """
+    API endpoint for the bulk travel-cost calculation.
 
+    Args:
+        date (str, optional): Scheduled date, defaults to today
+        service_requests (str|list, optional): JSON list of Service Request names
+    """
+    if isinstance(service_requests, str):
+        service_requests = json.loads(service_requests)
+    if service_requests:
+        for name in service_requests:
+            frappe.has_permission("Service Request", "write", name, throw=True)
+    else:
+        frappe.has_permission("Service Request", "write", throw=True)
+    return calculate_service_distances_bulk(date=date, service_requests=service_requests)
@@ -0,0 +1,205 @@
+# Copyright (c) 2026, sj and Contributors
+# See license.txt
+
+import threading
+from unittest.mock import patch
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from petcare.api import handle_voxbay_event
+from petcare.api.handle_voxbay_event import create_customer_once, get_customer_number, insert_call_log, parse_event
+from petcare.utils.locks import LockNotAcquiredError, named_lock
+
+PARALLEL_WEBHOOKS = 8
+CALL_ID = "test-voxbay-concurrency"
+NEW_NUMBERS = ["+919847099001", "+919847099002"]
+NATIONAL_CALL_IDS = ["test-voxbay-national-1", "test-voxbay-national-2"]
+KNOWN_NUMBER = "+919847099003"
+
+
+def run_in_site_threads(count, target):
+	"""
+	Run target(index) in `count` threads at once, each with its own site
+	connection, as concurrent web requests would.
+
+	Returns:
+		list: Each call's return value, or the exception it raised
+	"""
+	site, sites_path = frappe.local.site, frappe.local.sites_path
+	barrier = threading.Barrier(count)
+	results = [None] * count
+
+	def run(index):
+		frappe.init(site=site, sites_path=sites_path)
+		frappe.connect()
+		try:
+			barrier.wait()
+			results[index] = target(index)
+			frappe.db.commit()
+		except Exception as e:
+			frappe.db.rollback()
+			results[index] = e
+		finally:
+			frappe.destroy()
+
+	threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	return results
+
+
+class TestVoxbayCallLogInsert(FrappeTestCase):
+	"""Parallel identical webhooks on separate connections against the site database."""
+
+	def setUp(self):
+		if not frappe.db.table_exists("Voxbay Call Log"):
+			self.skipTest("Voxbay Call Log is not installed on this site")
+		self.delete_call_logs()
+
+	def tearDown(self):
+		self.delete_call_logs()
+
+	def delete_call_logs(self):
+		frappe.db.delete("Voxbay Call Log", {"call_id": CALL_ID})
+		frappe.db.commit()
+
+	def test_parallel_identical_webhooks_create_one_row(self):
+		doc_data, error = parse_event(frappe._dict({
+			"call_id": CALL_ID,
+			"caller_number": "+919847000001",
+			"receiver_number": "+914842000000",
+			"call_type": "incoming",
+			"call_status": "ANSWERED",
+			"start_time": "2026-01-01 10:00:00",
+		}))
+		self.assertIsNone(error)
+
+		def insert(index):
+			doc = frappe.new_doc("Voxbay Call Log")
+			doc.update(doc_data)
+			doc.flags.ignore_mandatory = True
+			doc.flags.ignore_links = True
+			return insert_call_log(doc)
+
+		results = run_in_site_threads(PARALLEL_WEBHOOKS, insert)
+		errors = [result for result in results if isinstance(result, Exception)]
+		self.assertEqual(errors, [])
+
+		# End this connection's snapshot to see the threads' commits
+		frappe.db.rollback()
+		names = frappe.get_all("Voxbay Call Log", filters={"call_id": CALL_ID}, pluck="name")
+		self.assertEqual(len(names), 1)
+		self.assertEqual(sum(created for _, created in results), 1)
+		self.assertEqual({name for name, _ in results}, set(names))
+
+
+class TestCreateCustomerOnce(FrappeTestCase):
+	"""Near-simultaneous calls from new numbers, each on its own site connection."""
+
+	def setUp(self):
+		self.delete_customers()
+
+	def tearDown(self):
+		self.delete_customers()
+
+	def delete_customers(self):
+		for customer in frappe.get_all("Customer", filters={"custom_normalized_mobile": ["in", NEW_NUMBERS]}, pluck="name"):
+			frappe.delete_doc("Customer", customer, ignore_permissions=True, force=True)
+		frappe.db.commit()
+
+	def test_parallel_calls_create_one_customer_per_number(self):
+		calls = []
+		for index in range(PARALLEL_WEBHOOKS):
+			for number in NEW_NUMBERS:
+				# Half without the country code, as some callers arrive; the
+				# number is taken from the parsed event, as the webhook does
+				doc_data, error = parse_event(frappe._dict({
+					"caller_number": number if index % 2 else number[3:],
+					"receiver_number": "+914842000000",
+					"call_type": "incoming",
+					"call_status": "ANSWERED",
+					"start_time": "2026-01-01 10:00:00",
+				}))
+				self.assertIsNone(error)
+				calls.append((number, get_customer_number(doc_data)))
+		results = run_in_site_threads(len(calls), lambda index: create_customer_once(calls[index][1], timeout=30))
+		errors = [result for result in results if isinstance(result, Exception)]
+		self.assertEqual(errors, [])
+
+		frappe.db.rollback()
+		for number in NEW_NUMBERS:
+			customers = frappe.get_all("Customer", filters={"custom_normalized_mobile": number}, pluck="name")
+			self.assertEqual(len(customers), 1)
+			self.assertEqual(frappe.db.get_value("Customer", customers[0], "mobile_no"), number)
+			number_results = [result for (call_number, _), result in zip(calls, results) if call_number == number]
+			self.assertEqual({customer for customer, _ in number_results}, set(customers))
+			self.assertEqual(sum(created for _, created in number_results), 1)
+
+	def test_busy_number_is_not_waited_for(self):
+		with named_lock(f"voxbay_customer:{NEW_NUMBERS[0]}"):
+			results = run_in_site_threads(1, lambda index: create_customer_once(NEW_NUMBERS[0], timeout=0))
+		self.assertIsInstance(results[0], LockNotAcquiredError)
+		frappe.db.rollback()
+		self.assertFalse(frappe.db.exists("Customer", {"custom_normalized_mobile": NEW_NUMBERS[0]}))
+
+
+class TestNationalNumbers(FrappeTestCase):
+	"""Callers sent as bare 10-digit numbers, through the whole webhook."""
+
+	def setUp(self):
+		if not frappe.db.table_exists("Voxbay Call Log"):
+			self.skipTest("Voxbay Call Log is not installed on this site")
+		self.cleanup()
+		self.customer = frappe.get_doc({
+			"doctype": "Customer",
+			"customer_name": "_Test Voxbay National",
+			"customer_type": "Individual",
+			"mobile_no": KNOWN_NUMBER,
+		}).insert(ignore_permissions=True).name
+		frappe.db.commit()
+
+	def tearDown(self):
+		self.cleanup()
+
+	def cleanup(self):
+		frappe.db.delete("Voxbay Call Log", {"call_id": ["in", NATIONAL_CALL_IDS]})
+		for customer in frappe.get_all(
+			"Customer", filters={"custom_normalized_mobile": ["in", [KNOWN_NUMBER, NEW_NUMBERS[0]]]}, pluck="name"
+		):
+			frappe.delete_doc("Customer", customer, ignore_permissions=True, force=True)
+		# What a 10-digit caller used to be stored as
+		for customer in frappe.get_all(
+			"Customer", filters={"mobile_no": ["in", ["+" + KNOWN_NUMBER[3:], "+" + NEW_NUMBERS[0][3:]]]}, pluck="name"
+		):
+			frappe.delete_doc("Customer", customer, ignore_permissions=True, force=True)
+		frappe.db.commit()
+
+	def send(self, call_id, caller_number):
+		frappe.local.form_dict = frappe._dict({
+			"call_id": call_id,
+			"caller_number": caller_number,
+			"receiver_number": "04842000000",
+			"call_type": "incoming",
+			"call_status": "ANSWERED",
+			"start_time": "2026-01-01 10:00:00",
+		})
+		with patch.object(handle_voxbay_event, "authenticate", return_value=None), \
+				patch.object(handle_voxbay_event, "is_voxbay_customer_creation_deferred", return_value=False):
+			response = handle_voxbay_event.handle_voxbay_event()
+		self.assertEqual(response.get("message"), "Success", response)
+		return frappe.get_doc("Voxbay Call Log", response["call_log"])
+
+	def test_matches_existing_customer(self):
+		call_log = self.send(NATIONAL_CALL_IDS[0], KNOWN_NUMBER[3:])
+		self.assertEqual(call_log.get("from"), KNOWN_NUMBER)
+		self.assertEqual(call_log.customer, self.customer)
+		self.assertEqual(frappe.db.count("Customer", {"customer_name": ["like", f"Customer %{KNOWN_NUMBER[3:]}"]}), 0)
+
+	def test_new_customer_gets_the_country_code(self):
+		call_log = self.send(NATIONAL_CALL_IDS[1], NEW_NUMBERS[0][3:])
+		customer = frappe.db.get_value(
+			"Customer", call_log.customer, ["mobile_no", "custom_normalized_mobile"], as_dict=True
+		)
+		self.assertEqual(customer.mobile_no, NEW_NUMBERS[0])
+		self.assertEqual(customer.custom_normalized_mobile, NEW_NUMBERS[0])
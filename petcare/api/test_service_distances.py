@@ -0,0 +1,92 @@
+# Copyright (c) 2026, sj and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, nowdate
+from petcare.api.service_request import TRAVEL_COST_FIELDS, calculate_service_distances_bulk
+from petcare.utils.test_directions import LocalDistanceMatrixClient
+from petcare.utils.travel_estimator import normalize_location
+
+TRUCKSTORE_LOCATION = "10.0159,76.3419"
+CUSTOMER_LOCATIONS = ["10.0321,76.3012", "9.9816,76.2999", "10.0543,76.3521"]
+COST_PER_KM = 20
+FREE_DISTANCE_THRESHOLD_KM = 5
+
+
+class TestCalculateServiceDistancesBulk(FrappeTestCase):
+	"""Bulk travel cost for one day's schedule, with the local stand-in for Google."""
+
+	def setUp(self):
+		meta = frappe.get_meta("Service Request")
+		missing = [field for field in TRAVEL_COST_FIELDS if not meta.has_field(field)]
+		if missing:
+			self.skipTest(f"Service Request has no {', '.join(missing)} on this site")
+
+		# The bulk run commits, so everything it touches is restored in tearDown
+		self.tariff = frappe.db.get_value(
+			"Petcare Settings", None, ["cost_per_km", "free_distance_threshold_km"]
+		)
+		frappe.db.set_single_value("Petcare Settings", {
+			"cost_per_km": COST_PER_KM,
+			"free_distance_threshold_km": FREE_DISTANCE_THRESHOLD_KM,
+		})
+		self.date = add_days(nowdate(), 3650)
+		self.requests = []
+		for location in CUSTOMER_LOCATIONS:
+			doc = frappe.get_doc({
+				"doctype": "Service Request",
+				"scheduled_date": self.date,
+				"assigned_truckstore_google_map_location": f"https://www.google.com/maps?q={TRUCKSTORE_LOCATION}",
+				"google_maps_link": f"https://www.google.com/maps?q={location}",
+			})
+			doc.flags.ignore_mandatory = True
+			doc.flags.ignore_links = True
+			doc.flags.ignore_validate = True
+			doc.insert(ignore_permissions=True)
+			self.requests.append(doc.name)
+		self.delete_legs()
+		frappe.db.commit()
+
+	def tearDown(self):
+		for name in self.requests:
+			frappe.delete_doc("Service Request", name, ignore_permissions=True, force=True)
+		self.delete_legs()
+		frappe.db.set_single_value("Petcare Settings", {
+			"cost_per_km": self.tariff[0],
+			"free_distance_threshold_km": self.tariff[1],
+		})
+		frappe.db.commit()
+
+	def delete_legs(self):
+		locations = [normalize_location(location) for location in [TRUCKSTORE_LOCATION] + CUSTOMER_LOCATIONS]
+		frappe.db.delete("Travel Leg Cache", {"origin": ["in", locations], "destination": ["in", locations]})
+
+	def test_computes_and_stores_a_day(self):
+		client = LocalDistanceMatrixClient()
+		summary = calculate_service_distances_bulk(date=self.date, client=client)
+
+		self.assertEqual(summary["failed"], {})
+		self.assertEqual(set(summary["results"]), set(self.requests))
+		# One request out and one back for the whole truckstore
+		self.assertEqual(len(client.requests), 2)
+		self.assertEqual(summary["fetched_legs"], 2 * len(CUSTOMER_LOCATIONS))
+
+		for name, result in summary["results"].items():
+			self.assertGreater(result["distance_km"], 0)
+			self.assertEqual(result["chargeable_kms"], round(max(0, result["distance_km"] - FREE_DISTANCE_THRESHOLD_KM)))
+			self.assertEqual(result["final_traveling_cost"] % 50, 0)
+			stored = frappe.db.get_value("Service Request", name, TRAVEL_COST_FIELDS, as_dict=True)
+			self.assertAlmostEqual(stored.distance_km, result["distance_km"], places=2)
+			self.assertEqual(stored.final_traveling_cost, result["final_traveling_cost"])
+			self.assertEqual(stored.direction, result["direction"])
+
+		# The second run is answered from the Travel Leg Cache
+		client = LocalDistanceMatrixClient()
+		again = calculate_service_distances_bulk(service_requests=self.requests, client=client)
+		self.assertEqual(client.requests, [])
+		self.assertEqual(again["fetched_legs"], 0)
+		for name, result in again["results"].items():
+			# Cached legs are stored in whole meters and seconds
+			self.assertAlmostEqual(result["distance_km"], summary["results"][name]["distance_km"], places=2)
+			self.assertEqual(result["direction"], summary["results"][name]["direction"])
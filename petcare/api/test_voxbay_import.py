@@ -0,0 +1,147 @@
+# Copyright (c) 2026, sj and Contributors
+# See license.txt
+
+import json
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from petcare.api.voxbay_import import find_customers, ingest_events, load_events
+
+KNOWN_NUMBER = "+919847088001"
+CONTACT_NUMBER = "+919847088002"
+NEW_NUMBER = "+919847088003"
+UNKNOWN_NUMBER = "+919847088004"
+RECEIVER_NUMBER = "+914842000000"
+CALL_IDS = ["test-voxbay-import-1", "test-voxbay-import-2", "test-voxbay-import-3", "test-voxbay-import-4"]
+
+
+def make_event(call_id, caller_number, **fields):
+	return {
+		"call_id": call_id,
+		"caller_number": caller_number,
+		"receiver_number": RECEIVER_NUMBER,
+		"call_type": "incoming",
+		"call_status": "ANSWERED",
+		"start_time": "2026-01-01 10:00:00",
+		**fields,
+	}
+
+
+class TestLoadEvents(FrappeTestCase):
+	def test_json_array(self):
+		events = [make_event("a", KNOWN_NUMBER), make_event("b", KNOWN_NUMBER)]
+		self.assertEqual(load_events(json.dumps(events)), events)
+
+	def test_json_object_and_dict(self):
+		event = make_event("a", KNOWN_NUMBER)
+		self.assertEqual(load_events(json.dumps(event)), [event])
+		self.assertEqual(load_events(event), [event])
+
+	def test_csv_drops_empty_cells(self):
+		text = "\ufeffcall_id,caller_number,end_time\na,+919847088001,\nb,,2026-01-01 10:05:00\n"
+		self.assertEqual(load_events(text.encode("utf-8")), [
+			{"call_id": "a", "caller_number": "+919847088001"},
+			{"call_id": "b", "end_time": "2026-01-01 10:05:00"},
+		])
+
+
+class TestFindCustomers(FrappeTestCase):
+	def setUp(self):
+		self.customer = make_customer(KNOWN_NUMBER)
+		self.contact_customer = make_customer(None, "_Test Voxbay Import Contact")
+		frappe.get_doc({
+			"doctype": "Contact",
+			"first_name": "_Test Voxbay Import",
+			"is_primary_contact": 1,
+			"phone_nos": [{"phone": CONTACT_NUMBER, "is_primary_phone": 1}],
+			"links": [{"link_doctype": "Customer", "link_name": self.contact_customer}],
+		}).insert(ignore_permissions=True)
+
+	def tearDown(self):
+		frappe.db.rollback()
+
+	def test_matches_mobile_then_primary_contact(self):
+		customers = find_customers([KNOWN_NUMBER[3:], CONTACT_NUMBER, UNKNOWN_NUMBER, "", "not a number"])
+		self.assertEqual(customers, {KNOWN_NUMBER: self.customer, CONTACT_NUMBER: self.contact_customer})
+
+
+class TestIngestEvents(FrappeTestCase):
+	"""Ingestion commits per chunk, so everything it creates is deleted in tearDown."""
+
+	def setUp(self):
+		if not frappe.db.table_exists("Voxbay Call Log"):
+			self.skipTest("Voxbay Call Log is not installed on this site")
+		self.cleanup()
+		self.customer = make_customer(KNOWN_NUMBER)
+		frappe.db.commit()
+
+	def tearDown(self):
+		self.cleanup()
+
+	def cleanup(self):
+		frappe.db.delete("Voxbay Call Log", {"call_id": ["in", CALL_IDS]})
+		for customer in frappe.get_all(
+			"Customer", filters={"custom_normalized_mobile": ["in", [KNOWN_NUMBER, NEW_NUMBER, UNKNOWN_NUMBER]]}, pluck="name"
+		):
+			frappe.delete_doc("Customer", customer, ignore_permissions=True, force=True)
+		# The malformed form bare national numbers used to be stored in
+		for customer in frappe.get_all(
+			"Customer", filters={"mobile_no": ["in", ["+" + NEW_NUMBER[3:], "+" + UNKNOWN_NUMBER[3:]]]}, pluck="name"
+		):
+			frappe.delete_doc("Customer", customer, ignore_permissions=True, force=True)
+		frappe.db.commit()
+
+	def test_duplicates_and_rejections(self):
+		report = ingest_events([make_event(CALL_IDS[1], KNOWN_NUMBER)], create_customers=False)
+		self.assertEqual(report["ingested"], 1)
+
+		report = ingest_events([
+			make_event(CALL_IDS[0], KNOWN_NUMBER),
+			# Repeated within the batch
+			make_event(CALL_IDS[0], KNOWN_NUMBER),
+			# Already logged by the first import
+			make_event(CALL_IDS[1], KNOWN_NUMBER),
+			make_event(CALL_IDS[2], KNOWN_NUMBER, call_status=""),
+			"not an event",
+			make_event(CALL_IDS[3], UNKNOWN_NUMBER),
+		], chunk_size=2, create_customers=False)
+
+		self.assertEqual(
+			{key: report[key] for key in ("received", "ingested", "duplicates", "rejected", "customers_created")},
+			{"received": 6, "ingested": 1, "duplicates": 2, "rejected": 3, "customers_created": 0},
+		)
+		rejections = {rejection["index"]: rejection for rejection in report["rejections"]}
+		self.assertEqual(sorted(rejections), [3, 4, 5])
+		self.assertIn("call_status", rejections[3]["error"])
+		self.assertEqual(rejections[3]["call_id"], CALL_IDS[2])
+		self.assertEqual(rejections[4]["error"], "Event must be an object")
+		self.assertIsNone(rejections[4]["call_id"])
+		self.assertIn("Could not find or create customer", rejections[5]["error"])
+
+		logs = frappe.get_all("Voxbay Call Log", filters={"call_id": ["in", CALL_IDS]}, fields=["call_id", "customer"])
+		self.assertEqual(sorted((log.call_id, log.customer) for log in logs), [
+			(CALL_IDS[0], self.customer), (CALL_IDS[1], self.customer),
+		])
+
+	def test_creates_each_unknown_customer_once(self):
+		# The same caller with and without the country code
+		report = ingest_events([
+			make_event(CALL_IDS[0], NEW_NUMBER),
+			make_event(CALL_IDS[1], NEW_NUMBER[3:]),
+		], chunk_size=1)
+
+		self.assertEqual(report["ingested"], 2)
+		self.assertEqual(report["customers_created"], 1)
+		customers = frappe.get_all("Customer", filters={"custom_normalized_mobile": NEW_NUMBER}, pluck="name")
+		self.assertEqual(len(customers), 1)
+		self.assertFalse(frappe.db.exists("Customer", {"mobile_no": "+" + NEW_NUMBER[3:]}))
+		logs = frappe.get_all("Voxbay Call Log", filters={"call_id": ["in", CALL_IDS]}, fields=["from", "customer"])
+		self.assertEqual({(log["from"], log.customer) for log in logs}, {(NEW_NUMBER, customers[0])})
+
+
+def make_customer(mobile_no, customer_name="_Test Voxbay Import"):
+	return frappe.get_doc({
+		"doctype": "Customer",
+		"customer_name": customer_name,
+		"customer_type": "Individual",
+		"mobile_no": mobile_no,
+	}).insert(ignore_permissions=True).name
@@ -0,0 +1,268 @@
+"""
+Bulk ingestion of Voxbay call events, for backfilling missed webhooks and
+importing historical call records.
+
+Events are the same dicts the webhook receives, as a JSON array or a CSV
+with those field names as headers. Each batch is validated up front,
+call_ids that are already logged are skipped with one query, customers are
+resolved with set-based phone lookups (and unknown ones created) before
+anything is inserted, and the call logs are inserted in chunks of one
+transaction each.
+"""
+
+import csv
+import io
+import json
+import logging
+import time
+import frappe
+from typing import Dict, Iterable, List
+from petcare.api.handle_voxbay_event import (
+    CALL_LOG_SAVEPOINT,
+    CUSTOMER_JOB_LOCK_TIMEOUT,
+    authenticate,
+    create_customer_once,
+    error_response,
+    get_customer_number,
+    insert_call_log,
+    log_event,
+    parse_event,
+)
+from petcare.utils.config import get_default_phone_country_code
+from petcare.utils.locks import LockNotAcquiredError
+from petcare.utils.phone import normalize_phone, phone_variants
+
+DEFAULT_CHUNK_SIZE = 200
+# Rejected events listed in the report; the rest are only counted
+MAX_REPORTED_REJECTIONS = 100
+
+
+def load_events(events) -> List[Dict]:
+    """
+    Events from a list, or from JSON or CSV text.
+
+    Empty CSV cells are treated as missing fields.
+    """
+    if isinstance(events, (bytes, bytearray)):
+        events = events.decode("utf-8-sig")
+    if isinstance(events, str):
+        text = events.strip()
+        if text.startswith("[") or text.startswith("{"):
+            events = json.loads(text)
+        else:
+            events = [
+                {field: value for field, value in row.items() if field and value not in ("", None)}
+                for row in csv.DictReader(io.StringIO(text))
+            ]
+    if isinstance(events, dict):
+        events = [events]
+    return list(events)
+
+
+def find_customers(numbers: Iterable[str]) -> Dict[str, str]:
+    """
+    Customers for many phone numbers at once, matched like find_customer: by
+    the Customer's normalized mobile, then by a primary Contact's phone.
+
+    Returns:
+        Dict: {normalized number: customer} for the numbers that matched
+    """
+    country_code = get_default_phone_country_code()
+    normalized = {normalize_phone(number, country_code) for number in numbers} - {None, ""}
+    if not normalized:
+        return {}
+
+    # Oldest first, so the original customer wins over later duplicates
+    customers = {}
+    for number, customer in frappe.db.sql("""
+        SELECT custom_normalized_mobile, name FROM `tabCustomer`
+        WHERE custom_normalized_mobile IN %s
+        ORDER BY creation
+    """, (tuple(normalized),)):
+        customers.setdefault(number, customer)
+
+    variants = {
+        variant: number
+        for number in normalized - set(customers)
+        for variant in phone_variants(number, country_code)
+    }
+    if variants:
+        for phone, customer in frappe.db.sql("""
+            SELECT phone.phone, link.link_name
+            FROM `tabContact Phone` phone
+            JOIN `tabContact` contact ON contact.name = phone.parent
+            JOIN `tabDynamic Link` link ON link.parent = contact.name
+                AND link.parenttype = 'Contact' AND link.link_doctype = 'Customer'
+            WHERE phone.parenttype = 'Contact' AND phone.phone IN %s AND contact.is_primary_contact = 1
+            ORDER BY contact.creation
+        """, (tuple(variants),)):
+            customers.setdefault(variants[phone], customer)
+    return customers
+
+
+def get_logged_call_ids(call_ids: Iterable[str]) -> set:
+    """The call_ids among these that already have a Voxbay Call Log."""
+    call_ids = tuple(set(call_ids))
+    if not call_ids:
+        return set()
+    return set(frappe.db.sql_list(
+        "SELECT call_id FROM `tabVoxbay Call Log` WHERE call_id IN %s", (call_ids,)
+    ))
+
+
+def ingest_events(events, chunk_size: int = DEFAULT_CHUNK_SIZE, create_customers: bool = True) -> Dict:
+    """
+    Validate, deduplicate and insert Voxbay events in chunked transactions.
+
+    Args:
+        events (list | str): Events, or their JSON or CSV
+        chunk_size (int): Call logs inserted per transaction
+        create_customers (bool): Create customers for unknown numbers, as the webhook does
+            (always immediately, whatever voxbay_defer_customer_creation says)
+
+    Returns:
+        Dict: Counts of ingested, duplicate and rejected events, the first
+        rejections, and the throughput achieved
+    """
+    started = time.perf_counter()
+    events = load_events(events)
+    chunk_size = max(int(chunk_size), 1)
+    country_code = get_default_phone_country_code()
+    report = {"received": len(events), "ingested": 0, "duplicates": 0, "rejected": 0,
+              "customers_created": 0, "rejections": []}
+
+    def reject(index, event, error):
+        report["rejected"] += 1
+        if len(report["rejections"]) < MAX_REPORTED_REJECTIONS:
+            call_id = event.get("call_id") if isinstance(event, dict) else None
+            report["rejections"].append({"index": index, "call_id": call_id, "error": error})
+
+    parsed = []
+    for index, event in enumerate(events):
+        if not isinstance(event, dict):
+            reject(index, event, "Event must be an object")
+            continue
+        doc_data, error = parse_event(frappe._dict(event))
+        if error:
+            reject(index, event, error[0])
+            continue
+        parsed.append((index, doc_data, normalize_phone(get_customer_number(doc_data), country_code)))
+
+    # Already logged, or repeated earlier in this batch
+    seen = get_logged_call_ids(doc_data["call_id"] for _, doc_data, _ in parsed if doc_data.get("call_id"))
+    pending = []
+    for index, doc_data, number in parsed:
+        call_id = doc_data.get("call_id")
+        if call_id in seen:
+            report["duplicates"] += 1
+            continue
+        if call_id:
+            seen.add(call_id)
+        pending.append((index, doc_data, number))
+
+    customers = find_customers(number for _, _, number in pending)
+    if create_customers:
+        # Before any call log is inserted, as each creation commits
+        unknown = {number: get_customer_number(doc_data)
+                   for _, doc_data, number in pending if number and number not in customers}
+        for number, phone_number in unknown.items():
+            try:
+                customer, created = create_customer_once(phone_number, timeout=CUSTOMER_JOB_LOCK_TIMEOUT)
+            except LockNotAcquiredError:
+                continue
+            if customer:
+                customers[number] = customer
+                report["customers_created"] += created
+
+    for start in range(0, len(pending), chunk_size):
+        for index, doc_data, number in pending[start:start + chunk_size]:
+            customer = customers.get(number)
+            if not customer:
+                reject(index, doc_data, f"Could not find or create customer for number: {get_customer_number(doc_data)}")
+                continue
+
+            doc = frappe.new_doc("Voxbay Call Log")
+            doc.update(doc_data)
+            doc.customer = customer
+            try:
+                call_log, created = insert_call_log(doc)
+            except Exception as e:
+                frappe.db.rollback(save_point=CALL_LOG_SAVEPOINT)
+                reject(index, doc_data, f"Error inserting Voxbay Call Log: {str(e)}")
+                continue
+            if created:
+                report["ingested"] += 1
+            else:
+                # Logged by the webhook while this import was running
+                report["duplicates"] += 1
+        frappe.db.commit()
+
+    seconds = time.perf_counter() - started
+    report["seconds"] = round(seconds, 2)
+    report["events_per_second"] = round(len(events) / seconds, 1) if seconds else 0
+    log_event(logging.INFO, "voxbay_bulk_ingested",
+              **{key: value for key, value in report.items() if key != "rejections"})
+    return report
+
+
+@frappe.whitelist(allow_guest=True)
+def ingest_voxbay_events():
+    """
+    Bulk counterpart of handle_voxbay_event, authenticated with the same
+    X-Api-Key header. The body is a JSON array of events (or {"events": [...]})
+    or CSV text.
+    """
+    error = authenticate()
+    if error:
+        return error
+
+    form = frappe.local.form_dict
+    events = form.get("events")
+    if events is None:
+        events = frappe.request.get_data(as_text=True) if frappe.request else None
+    if not events:
+        return error_response("No events", "The request must contain a JSON array or CSV of events", 400)
+
+    try:
+        events = load_events(events)
+    except Exception as e:
+        return error_response(f"Could not read events: {str(e)}", str(e), 400)
+
+    try:
+        return {"message": "Success", **ingest_events(
+            events,
+            chunk_size=form.get("chunk_size") or DEFAULT_CHUNK_SIZE,
+            create_customers=frappe.utils.cint(form.get("create_customers", 1)),
+        )}
+    except Exception as e:
+        frappe.db.rollback()
+        frappe.log_error(frappe.get_traceback(), "Voxbay Bulk Ingestion Error")
+        return error_response(f"Error ingesting Voxbay events: {str(e)}", str(e))
+
+
+def import_voxbay_events(path, chunk_size=DEFAULT_CHUNK_SIZE, create_customers=True):
+    """
+    Import a JSON or CSV file of Voxbay events from the command line.
+
+    Args:
+        path (str): File of events
+        chunk_size (int): Call logs inserted per transaction
+        create_customers (bool): Create customers for unknown numbers
+    """
+    with open(path, "rb") as f:
+        report = ingest_events(f.read(), chunk_size=chunk_size, create_customers=create_customers)
+
+    print(f"\nReceived: {report['received']}")
+    print(f"✓ Ingested: {report['ingested']}")
+    print(f"Duplicates: {report['duplicates']}")
+    print(f"✗ Rejected: {report['rejected']}")
+    print(f"Customers created: {report['customers_created']}")
+    print(f"Throughput: {report['events_per_second']} events/s in {report['seconds']}s")
+    for rejection in report["rejections"]:
+        print(f"  #{rejection['index']} ({rejection['call_id']}): {rejection['error']}")
+    return report
+
+# Usage Instructions:
+# bench --site <site> execute petcare.api.voxbay_import.import_voxbay_events --kwargs '{"path": "/path/to/calls.csv"}'
+# curl -X POST https://<site>/api/method/petcare.api.voxbay_import.ingest_voxbay_events \
+#     -H "X-Api-Key: <key>" -H "Content-Type: application/json" -d '{"events": [...]}'
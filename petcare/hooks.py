@@ -42,36 +42,52 @@ for job in jobs:
 
 doc_events = {}
 override_whitelisted_methods = {}
-override_doctype_class = {}
+override_doctype_class = {
+    "Customer": "petcare.overrides.customer.PetcareCustomer"
+}
 
 scheduler_events = {
     "cron": {
         "0 4 * * *": [  # This cron expression runs the task every day at 4:00 AM
             "petcare.scripts.generate_recurring_service_requests.generate_recurring_service_requests"
         ],
-        "0 3 * * *": [
-            "petcare.scripts.update_customer_service_details.update_customer_service_details"
+        "0 3 * * *": [  # Service details, tags, follow-up buckets and loyalty balance
+            "petcare.scripts.nightly_pipeline.run_nightly_pipeline"
         ]
     }
 }
 
 doc_events = {
     "Service Request": {
-        "on_update": "petcare.scripts.service_request_hooks.update_latest_completed_service",
-        "on_submit": "petcare.scripts.loyalty.update_loyalty_totals",
+        "on_update": [
+            "petcare.scripts.service_request_hooks.mark_customer_for_recompute",
+            "petcare.scripts.spending_percentiles.update_spending_snapshot"
+        ],
+        "before_submit": "petcare.scripts.loyalty.update_loyalty_totals",
         "before_save": "petcare.scripts.loyalty.update_loyalty_totals",
+        "on_trash": [
+            "petcare.scripts.loyalty.reverse_loyalty_entries",
+            "petcare.scripts.service_request_hooks.mark_customer_for_recompute"
+        ],
     },
     "Customer": {
-        "before_save": "petcare.scripts.update_customer_coordinates.update_single_customer_coordinates"
+        "before_save": "petcare.scripts.update_customer_coordinates.update_single_customer_coordinates",
+        "onload": "petcare.scripts.generate_loyalty_message.refresh_loyalty_message"
     },
     "Call Task": {
         "on_update": "petcare.api.call_task.call_task.on_update"
+    },
+    "Service Repeat": {
+        "before_save": "petcare.scripts.generate_recurring_service_requests.set_next_due_date"
     }
 }
 
 permission_query_conditions = {
     "Contact": "petcare.scripts.contact_permissions.get_contact_permission_query"
 }
+
+# Ledger entries outlive the Service Requests they were posted for
+ignore_links_on_delete = ["Loyalty Ledger Entry"]
     
 has_whitelisted_web_request = True
 
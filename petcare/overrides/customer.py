@@ -0,0 +1,17 @@
+from erpnext.selling.doctype.customer.customer import Customer
+from petcare.utils.config import get_default_phone_country_code
+from petcare.utils.phone import normalize_phone
+from petcare.utils.service_days import days_since
+
+
+class PetcareCustomer(Customer):
+    """Customer with the days since the last service derived on read."""
+
+    @property
+    def custom_days_since_last_service(self):
+        return days_since(self.custom_latest_completed_service_date)
+
+    def validate(self):
+        super().validate()
+        # Indexed key for exact caller lookups
+        self.custom_normalized_mobile = normalize_phone(self.mobile_no, get_default_phone_country_code())
@@ -0,0 +1,40 @@
+import frappe
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+from petcare.utils.config import get_default_phone_country_code
+from petcare.utils.phone import normalize_phone
+
+CHUNK_SIZE = 5000
+
+
+def execute():
+    """
+    Add the indexed normalized mobile number used to match callers to customers,
+    backfill it, and index Contact Phone numbers for the Contact fallback.
+    """
+    create_custom_fields({
+        "Customer": [
+            {
+                "fieldname": "custom_normalized_mobile",
+                "label": "Normalized Mobile",
+                "fieldtype": "Data",
+                "insert_after": "mobile_no",
+                "read_only": 1,
+                "hidden": 1,
+                "search_index": 1,
+                "description": "Mobile number as +<country code><number>, for exact caller lookups"
+            }
+        ]
+    }, update=True)
+    frappe.db.add_index("Contact Phone", ["phone"])
+
+    country_code = get_default_phone_country_code()
+    customers = frappe.db.sql("""
+        SELECT name, mobile_no FROM `tabCustomer` WHERE IFNULL(mobile_no, '') != ''
+    """)
+    for start in range(0, len(customers), CHUNK_SIZE):
+        chunk = [(name, normalize_phone(mobile_no, country_code)) for name, mobile_no in customers[start:start + CHUNK_SIZE]]
+        frappe.db.sql(f"""
+            UPDATE `tabCustomer`
+            SET custom_normalized_mobile = CASE name {" ".join(["WHEN %s THEN %s"] * len(chunk))} END
+            WHERE name IN %s
+        """, [value for row in chunk for value in row] + [tuple(name for name, _ in chunk)])
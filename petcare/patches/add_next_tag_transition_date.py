@@ -0,0 +1,18 @@
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+
+
+def execute():
+    """Add the date on which a customer's time-based tags next change."""
+    create_custom_fields({
+        "Customer": [
+            {
+                "fieldname": "custom_next_tag_transition_date",
+                "label": "Next Tag Transition Date",
+                "fieldtype": "Date",
+                "insert_after": "custom_tag_descriptions",
+                "read_only": 1,
+                "search_index": 1,
+                "description": "Date on which a time-based tag (Recently Active, Inactive, Frequent, Loyal) next flips"
+            }
+        ]
+    }, update=True)
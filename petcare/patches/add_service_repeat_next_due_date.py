@@ -0,0 +1,37 @@
+import frappe
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+from frappe.utils import nowdate
+from petcare.utils.recurrence import next_occurrence
+
+
+def execute():
+    """Add the next due date and custom recurrence rule to Service Repeat, and backfill the due dates."""
+    create_custom_fields({
+        "Service Repeat": [
+            {
+                "fieldname": "custom_recurrence_rule",
+                "label": "Recurrence Rule",
+                "fieldtype": "Data",
+                "insert_after": "recurrence_frequency",
+                "description": "Optional RRULE for custom schedules, e.g. FREQ=MONTHLY;BYDAY=1SA. Overrides the frequency when set"
+            },
+            {
+                "fieldname": "custom_next_due_date",
+                "label": "Next Due Date",
+                "fieldtype": "Date",
+                "insert_after": "generation_window_days",
+                "read_only": 1,
+                "search_index": 1,
+                "description": "First occurrence not yet generated as a Service Request"
+            }
+        ]
+    }, update=True)
+
+    today = nowdate()
+    for repeat in frappe.get_all("Service Repeat",
+        filters={"status": "Active", "start_date": ["is", "set"]},
+        fields=["name", "start_date", "recurrence_frequency", "custom_recurrence_rule"]
+    ):
+        frappe.db.set_value("Service Repeat", repeat.name, "custom_next_due_date", next_occurrence(
+            repeat.start_date, repeat.recurrence_frequency, today, repeat.custom_recurrence_rule
+        ), update_modified=False)
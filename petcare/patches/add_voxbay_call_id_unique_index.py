@@ -0,0 +1,45 @@
+import frappe
+
+DOCTYPE = "Voxbay Call Log"
+
+
+def execute():
+    """
+    Make Voxbay Call Log's call_id unique, so concurrent deliveries of the same
+    Voxbay event cannot both insert a row. Empty call_ids become NULL and
+    repeated ones are cleared on all but the earliest row first.
+    """
+    if not frappe.db.table_exists(DOCTYPE) or not frappe.db.has_column(DOCTYPE, "call_id"):
+        return
+
+    frappe.db.sql(f"UPDATE `tab{DOCTYPE}` SET call_id = NULL WHERE call_id = ''")
+    duplicates = frappe.db.sql(f"""
+        SELECT log.name, log.call_id
+        FROM `tab{DOCTYPE}` log
+        JOIN (
+            SELECT call_id, MIN(creation) AS first_creation, MIN(name) AS first_name
+            FROM `tab{DOCTYPE}`
+            WHERE call_id IS NOT NULL
+            GROUP BY call_id
+            HAVING COUNT(*) > 1
+        ) first ON first.call_id = log.call_id
+        WHERE log.creation > first.first_creation
+            OR (log.creation = first.first_creation AND log.name != first.first_name)
+    """)
+    if duplicates:
+        frappe.db.sql(f"UPDATE `tab{DOCTYPE}` SET call_id = NULL WHERE name IN %s",
+                      (tuple(name for name, _ in duplicates),))
+        frappe.log_error(
+            "\n".join(f"{name}: {call_id}" for name, call_id in duplicates),
+            "Voxbay Call Log duplicate call_ids cleared"
+        )
+
+    # Keep the field definition in step, or a later schema sync would drop the index
+    if frappe.db.exists("Custom Field", {"dt": DOCTYPE, "fieldname": "call_id"}):
+        frappe.db.set_value("Custom Field", {"dt": DOCTYPE, "fieldname": "call_id"}, "unique", 1)
+    else:
+        frappe.db.set_value("DocField", {"parent": DOCTYPE, "fieldname": "call_id"}, "unique", 1)
+    frappe.clear_cache(doctype=DOCTYPE)
+
+    # Named like the index Frappe creates for a unique field
+    frappe.db.add_unique(DOCTYPE, ["call_id"], constraint_name="call_id")
@@ -0,0 +1,70 @@
+import frappe
+from frappe.custom.doctype.custom_field.custom_field import create_custom_fields
+from frappe.utils import now_datetime
+
+CHUNK_SIZE = 5000
+
+
+def execute():
+    """
+    Add the customer's lifetime loyalty points and open the Loyalty Ledger with one
+    Earn and one Redeem entry per completed Service Request, in completion order.
+    """
+    create_custom_fields({
+        "Customer": [
+            {
+                "fieldname": "custom_lifetime_loyalty_points",
+                "label": "Lifetime Loyalty Points",
+                "fieldtype": "Int",
+                "insert_after": "custom_loyalty_points_balance",
+                "read_only": 1
+            }
+        ]
+    }, update=True)
+
+    if frappe.db.count("Loyalty Ledger Entry"):
+        return
+
+    requests = frappe.db.sql("""
+        SELECT name, customer, completed_date,
+            COALESCE(loyalty_points_earned, 0) AS earned, COALESCE(loyalty_points_redeemed, 0) AS redeemed
+        FROM `tabService Request`
+        WHERE status = 'Completed' AND customer IS NOT NULL
+        ORDER BY customer, completed_date, creation
+    """, as_dict=True)
+
+    now = now_datetime()
+    fields = [
+        "name", "customer", "service_request", "entry_type", "posting_date", "points_earned",
+        "points_redeemed", "balance_after", "lifetime_after", "creation", "modified", "owner",
+        "modified_by", "docstatus"
+    ]
+    values = []
+    totals = {}
+    for sr in requests:
+        balance, lifetime = totals.get(sr.customer, (0, 0))
+        for entry_type, earned, redeemed in (("Earn", sr.earned, 0), ("Redeem", 0, sr.redeemed)):
+            if not earned and not redeemed:
+                continue
+            balance += earned - redeemed
+            lifetime += earned
+            values.append((
+                frappe.generate_hash(length=10), sr.customer, sr.name, entry_type, sr.completed_date,
+                earned, redeemed, balance, lifetime, now, now, "Administrator", "Administrator", 0
+            ))
+        totals[sr.customer] = (balance, lifetime)
+
+    if values:
+        frappe.db.bulk_insert("Loyalty Ledger Entry", fields, values, chunk_size=CHUNK_SIZE)
+
+    customers = list(totals.items())
+    for start in range(0, len(customers), CHUNK_SIZE):
+        chunk = customers[start:start + CHUNK_SIZE]
+        frappe.db.sql(f"""
+            UPDATE `tabCustomer`
+            SET custom_loyalty_points_balance = CASE name {" ".join(["WHEN %s THEN %s"] * len(chunk))} END,
+                custom_lifetime_loyalty_points = CASE name {" ".join(["WHEN %s THEN %s"] * len(chunk))} END
+            WHERE name IN %s
+        """, [value for customer, (balance, _) in chunk for value in (customer, balance)]
+            + [value for customer, (_, lifetime) in chunk for value in (customer, lifetime)]
+            + [tuple(customer for customer, _ in chunk)])
@@ -0,0 +1,18 @@
+import frappe
+
+
+def execute():
+    """
+    Stop storing custom_days_since_last_service. The field becomes virtual,
+    computed from custom_latest_completed_service_date by PetcareCustomer.
+    """
+    custom_field = frappe.db.get_value(
+        "Custom Field", {"dt": "Customer", "fieldname": "custom_days_since_last_service"}
+    )
+    if custom_field:
+        frappe.db.set_value("Custom Field", custom_field, {"is_virtual": 1, "read_only": 1})
+
+    if frappe.db.has_column("Customer", "custom_days_since_last_service"):
+        frappe.db.sql_ddl("ALTER TABLE `tabCustomer` DROP COLUMN `custom_days_since_last_service`")
+
+    frappe.clear_cache(doctype="Customer")
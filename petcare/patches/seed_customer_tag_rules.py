@@ -0,0 +1,34 @@
+import frappe
+
+
+# The built-in tag logic of CustomerTagManager.determine_customer_tags, as rules
+DEFAULT_RULES = [
+    ("First-Time Customer", "Completed Services", "=", "Value", 1, None),
+    ("Repeat Customer", "Completed Services", ">", "Value", 1, None),
+    ("High-Value Customer", "Total Spent", ">", "Spending Percentile", 50, None),
+    ("VIP Customer", "Total Spent", ">", "Spending Percentile", 90, None),
+    ("Inactive Customer", "Days Since Last Service", ">", "Value", 180, None),
+    ("Recently Active", "Days Since Last Service", "<=", "Value", 30, None),
+    ("Frequent Customer", "Services In Window", ">=", "Value", 3, 90),
+    ("Loyal Customer", "Services In Window", ">=", "Value", 4, 365),
+    ("Multiple Pets Owner", "Pet Count", ">", "Value", 1, None),
+]
+
+
+def execute():
+    """Seed Customer Tag Rules equivalent to the built-in tag logic."""
+    if frappe.db.count("Customer Tag Rule"):
+        return
+
+    for sequence, (tag, metric, operator, threshold_type, threshold, window_days) in enumerate(DEFAULT_RULES, start=1):
+        frappe.get_doc({
+            "doctype": "Customer Tag Rule",
+            "tag": tag,
+            "enabled": 1,
+            "sequence": sequence * 10,
+            "metric": metric,
+            "operator": operator,
+            "threshold_type": threshold_type,
+            "threshold": threshold,
+            "window_days": window_days,
+        }).insert(ignore_permissions=True, ignore_links=True)
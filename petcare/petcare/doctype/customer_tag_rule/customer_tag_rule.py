@@ -0,0 +1,17 @@
+# Copyright (c) 2026, sj and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from petcare.scripts.customer_tag_rules import WINDOW_METRICS, THRESHOLD_PERCENTILE
+
+
+class CustomerTagRule(Document):
+	def validate(self):
+		if self.metric in WINDOW_METRICS and (self.window_days or 0) <= 0:
+			frappe.throw(f"Window (Days) must be greater than zero for {self.metric}")
+		if self.threshold_type == THRESHOLD_PERCENTILE:
+			if self.metric != "Total Spent":
+				frappe.throw("Spending Percentile thresholds only apply to Total Spent")
+			if not 0 <= (self.threshold or 0) <= 100:
+				frappe.throw("Spending Percentile must be between 0 and 100")
@@ -0,0 +1,13 @@
+# Copyright (c) 2026, sj and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class LoyaltyLedgerEntry(Document):
+	"""Append-only: corrections are posted as Adjustment entries, never edits."""
+
+	def validate(self):
+		if not self.is_new():
+			frappe.throw("Loyalty Ledger Entries cannot be edited; post an Adjustment instead")
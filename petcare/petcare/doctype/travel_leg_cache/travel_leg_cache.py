@@ -0,0 +1,12 @@
+# Copyright (c) 2026, sj and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from petcare.utils.travel_estimator import clear_estimator_cache
+
+
+class TravelLegCache(Document):
+	def after_insert(self):
+		# Once committed, so a refit cannot cache an estimator without this leg
+		frappe.db.after_commit.add(clear_estimator_cache)
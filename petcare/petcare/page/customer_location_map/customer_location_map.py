@@ -3,6 +3,7 @@ from frappe import _
 import requests
 import json
 import os
+from petcare.utils.service_days import add_days_since
 
 SITE_CONFIG_PATH = "/home/frappe-user/frappe-bench/sites/erp.masterpet.co.in/site_config.json"
 
@@ -215,12 +216,14 @@ def get_customer_locations(lead_statuses=None):
             fields=[
                 "name", "customer_name", "mobile_no", "territory",
                 "custom_latitude as latitude", "custom_longitude as longitude",
-                "custom_days_since_last_service", "custom_total_pets",
+                "custom_latest_completed_service_date", "custom_total_pets",
                 "custom_living_space", "custom_parking", "custom_electricity",
                 "custom_water_", "custom_lead_status"
             ]
         )
 
+        add_days_since(customers)
+
         return {
             "customers": customers,
             "failed": []
@@ -69,6 +69,12 @@ frappe.pages['groomer-driver-dashboard'].on_page_load = function(wrapper) {
                     <!-- Service requests will be loaded here -->
                 </div>
             </div>
+            <div class="routes-list">
+                <h5 class="routes-title">Planned Routes</h5>
+                <div class="routes-container">
+                    <!-- Optimized routes will be loaded here -->
+                </div>
+            </div>
         </div>
     `);
     
@@ -211,6 +217,43 @@ frappe.pages['groomer-driver-dashboard'].on_page_load = function(wrapper) {
                 font-size: 24px;
                 font-weight: 600;
             }
+            .routes-list {
+                padding: 15px;
+                max-width: 1200px;
+                margin: 0 auto;
+            }
+            .routes-title {
+                font-weight: 600;
+                color: var(--gray-800);
+                margin-bottom: 12px;
+            }
+            .route-card {
+                border-radius: 12px;
+                padding: 20px;
+                margin-bottom: 15px;
+                background: white;
+                box-shadow: 0 1px 3px rgba(0,0,0,0.1);
+            }
+            .route-summary {
+                color: var(--gray-600);
+                font-size: 13px;
+                margin-bottom: 10px;
+            }
+            .route-stop {
+                display: flex;
+                gap: 12px;
+                padding: 6px 0;
+                border-bottom: 1px solid var(--gray-100);
+                font-size: 14px;
+            }
+            .route-stop .sequence {
+                font-weight: 600;
+                width: 24px;
+            }
+            .route-stop .late {
+                color: #C62828;
+                font-weight: 500;
+            }
         </style>
     `);
 
@@ -273,6 +316,9 @@ function loadServiceRequests(status, selected_date) {
         }
     });
 
+    // Load the optimized visiting order for the day
+    loadDailyRoutes(selected_date);
+
     // Load service requests
     frappe.call({
         method: 'petcare.petcare.page.groomer_driver_dashboard.groomer_driver_dashboard.get_service_requests',
@@ -337,6 +383,57 @@ function displayServiceRequests(requests) {
     requestsContainer.html(requestsHtml);
 }
 
+function loadDailyRoutes(selected_date) {
+    const routesContainer = $('.routes-container');
+    routesContainer.html('<div class="text-muted">Planning routes...</div>');
+
+    frappe.call({
+        method: 'petcare.api.route_planning.get_daily_routes',
+        args: {
+            date: selected_date
+        },
+        callback: function(response) {
+            displayDailyRoutes(response.message || []);
+        },
+        error: function(err) {
+            console.error('Error planning routes:', err);
+            routesContainer.html('<div class="text-muted">Could not plan routes</div>');
+        }
+    });
+}
+
+function displayDailyRoutes(routes) {
+    const routesContainer = $('.routes-container');
+
+    if (!routes.length) {
+        routesContainer.html('<div class="text-muted">No scheduled requests to route</div>');
+        return;
+    }
+
+    const escape = frappe.utils.escape_html;
+    const routesHtml = routes.map(route => `
+        <div class="route-card">
+            <div class="customer-name">${escape(route.truckstore)}</div>
+            <div class="route-summary">
+                ${route.error ? escape(route.error) : `Leave at ${route.departure} • ${route.total_km} km • ${route.stops.length} stops`}
+                ${route.estimated_legs ? ' • some legs estimated' : ''}
+            </div>
+            ${route.stops.map(stop => `
+                <div class="route-stop">
+                    <span class="sequence">${stop.sequence}</span>
+                    <span class="flex-grow-1">${escape(stop.customer_name || stop.customer)}${stop.territory ? ` (${escape(stop.territory)})` : ''}</span>
+                    <span>ETA ${stop.eta}</span>
+                    <span>${stop.window_start ? `Window ${stop.window_start}-${stop.window_end}` : ''}</span>
+                    ${stop.late_minutes ? `<span class="late">${stop.late_minutes} min late</span>` : ''}
+                </div>
+            `).join('')}
+            ${route.unplaced && route.unplaced.length ? `<div class="text-muted mt-2">Missing location: ${escape(route.unplaced.join(', '))}</div>` : ''}
+        </div>
+    `).join('');
+
+    routesContainer.html(routesHtml);
+}
+
 function updateMetrics(metrics) {
     $('#scheduled-total').text(format_currency(metrics.scheduled_total));
     $('#completed-total').text(format_currency(metrics.completed_total));
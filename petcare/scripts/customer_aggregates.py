@@ -0,0 +1,31 @@
+"""
+Per-customer columns shared by the nightly customer pipeline.
+
+Both the tag engine's aggregate query and the compiled tag-rule query can
+select these alongside the tag inputs, so one pass over the Service Request
+history also feeds the service-details stage. Every query using them joins
+completed Service Requests as `sr` onto Customer as `c`.
+"""
+
+import numpy as np
+from typing import Dict, List
+
+# Paid services are the ones that count for tagging
+PAID = "sr.amount_after_discount > 0"
+
+SHARED_COLUMNS = [
+    "COUNT(sr.name) AS completed_count",
+    "MAX(sr.completed_date) AS latest_completed",
+    "c.custom_latest_completed_service_date AS stored_latest_completed",
+    "c.custom_lead_status AS stored_lead_status",
+]
+
+
+def shared_arrays(rows: List[Dict]) -> Dict[str, np.ndarray]:
+    """Column arrays for the shared columns, kept as Python values for writing back."""
+    return {
+        "completed_count": np.array([row.completed_count for row in rows], dtype=np.int64),
+        "latest_completed": np.array([row.latest_completed for row in rows], dtype=object),
+        "stored_latest_completed": np.array([row.stored_latest_completed for row in rows], dtype=object),
+        "stored_lead_status": np.array([row.stored_lead_status for row in rows], dtype=object),
+    }
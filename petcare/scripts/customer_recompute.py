@@ -0,0 +1,153 @@
+"""
+Coalesced, after-commit recomputation of customer-level values.
+
+Service Request hooks only mark the request's customer dirty. When the
+transaction commits, the marked customers are added to a shared set and one
+background job is queued; the job drains the set in batches and recomputes
+the latest completed service, lead status, loyalty balance and tags with
+set-based statements. A bulk edit of many requests for one customer costs
+one recomputation, and nothing is committed from inside a save.
+"""
+
+import frappe
+import redis
+from typing import Dict, Iterable, List, Optional
+from petcare.scripts.customer_tag_engine import CustomerTagEngine
+from petcare.scripts.loyalty import LEDGER_DOCTYPE
+from petcare.scripts.update_customer_service_details import CustomerServiceManager
+
+DIRTY_CUSTOMERS_KEY = "dirty_customers"
+SCHEDULED_KEY = "dirty_customers_scheduled"
+# A queued job clears the flag when it starts; the expiry only covers a lost job
+SCHEDULED_TTL_SECONDS = 600
+BATCH_SIZE = 500
+
+logger = frappe.logger("customer_recompute", allow_site=True)
+
+
+def mark_customer_dirty(customer: str) -> None:
+    """
+    Queue a customer for recomputation once the current transaction commits.
+    Nothing is queued if it rolls back.
+    """
+    if not customer:
+        return
+    if frappe.flags.dirty_customers is None:
+        frappe.flags.dirty_customers = set()
+        frappe.db.after_commit.add(schedule_dirty_customers)
+        frappe.db.after_rollback.add(discard_dirty_customers)
+    frappe.flags.dirty_customers.add(customer)
+
+
+def discard_dirty_customers() -> None:
+    frappe.flags.dirty_customers = None
+
+
+def schedule_dirty_customers() -> None:
+    """
+    After commit: add the marked customers to the shared set and queue the
+    recomputation job, unless one is already queued.
+    """
+    customers = frappe.flags.dirty_customers
+    frappe.flags.dirty_customers = None
+    if not customers:
+        return
+
+    cache = frappe.cache()
+    cache.sadd(DIRTY_CUSTOMERS_KEY, *customers)
+    if cache.set(cache.make_key(SCHEDULED_KEY), 1, nx=True, ex=SCHEDULED_TTL_SECONDS):
+        frappe.enqueue("petcare.scripts.customer_recompute.recompute_dirty_customers", queue="short")
+
+
+def update_loyalty_balances(customers: Optional[List[str]] = None) -> int:
+    """
+    Set the customers' loyalty balance and lifetime points from their ledger
+    entries, writing only the customers whose stored values differ.
+
+    Args:
+        customers (list): Customers to update; None for every customer
+
+    Returns:
+        int: Number of customers written
+    """
+    if customers is not None and not customers:
+        return 0
+    condition = "IN %(customers)s" if customers is not None else "IS NOT NULL"
+    frappe.db.sql(f"""
+        UPDATE `tabCustomer` c
+        LEFT JOIN (
+            SELECT customer, SUM(points_earned) AS earned, SUM(points_redeemed) AS redeemed
+            FROM `tab{LEDGER_DOCTYPE}`
+            WHERE customer {condition}
+            GROUP BY customer
+        ) ledger ON ledger.customer = c.name
+        SET
+            c.custom_loyalty_points_balance = COALESCE(ledger.earned - ledger.redeemed, 0),
+            c.custom_lifetime_loyalty_points = COALESCE(ledger.earned, 0)
+        WHERE c.name {condition}
+            AND (IFNULL(c.custom_loyalty_points_balance, 0) != COALESCE(ledger.earned - ledger.redeemed, 0)
+                OR IFNULL(c.custom_lifetime_loyalty_points, 0) != COALESCE(ledger.earned, 0))
+    """, {"customers": tuple(customers or ())})
+    return frappe.db.sql("SELECT ROW_COUNT()")[0][0]
+
+
+def recompute_customers(customers: Iterable[str]) -> Dict:
+    """
+    Recompute every customer-level value derived from Service Requests for
+    the given customers, in one pass of set-based statements.
+
+    Returns:
+        Dict: Customers processed and rows changed per value
+    """
+    customers = sorted(set(customers))
+    if not customers:
+        return {"customers": 0}
+
+    service_details = CustomerServiceManager().update_customers(customers)
+    update_loyalty_balances(customers)
+    tags = CustomerTagEngine().run(customers, commit=False)
+    return {
+        "customers": len(customers),
+        "service_details_changed": service_details,
+        "tags_changed": tags.get("changed_customers", 0),
+    }
+
+
+def recompute_dirty_customers() -> Dict:
+    """
+    Background job: recompute the customers marked dirty, one batch and one
+    commit at a time. Each batch is popped from the set before it is
+    computed, so a customer marked again meanwhile is added back and picked
+    up later; a failed batch is put back for the next job.
+
+    Returns:
+        Dict: Totals for the run
+    """
+    cache = frappe.cache()
+    # Saves from now on queue a new job instead of relying on this one
+    cache.delete(cache.make_key(SCHEDULED_KEY))
+
+    key = cache.make_key(DIRTY_CUSTOMERS_KEY)
+    summary = {"customers": 0, "service_details_changed": 0, "tags_changed": 0, "failed_batches": 0}
+    failed = []
+    while True:
+        # SPOP with a count moves members out atomically
+        batch = sorted(frappe.safe_decode(customer) for customer in redis.Redis.spop(cache, key, BATCH_SIZE) or [])
+        if not batch:
+            break
+        try:
+            report = recompute_customers(batch)
+            frappe.db.commit()
+        except Exception:
+            frappe.db.rollback()
+            summary["failed_batches"] += 1
+            failed.extend(batch)
+            frappe.log_error(frappe.get_traceback(), "Customer recomputation failed")
+            continue
+        for report_key in ("customers", "service_details_changed", "tags_changed"):
+            summary[report_key] += report.get(report_key, 0)
+
+    if failed:
+        cache.sadd(DIRTY_CUSTOMERS_KEY, *failed)
+    logger.info(f"Customer recomputation: {summary}")
+    return summary
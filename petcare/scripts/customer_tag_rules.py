@@ -0,0 +1,195 @@
+"""
+Declarative customer tag rules.
+
+Each enabled Customer Tag Rule compares one customer metric with a threshold.
+All rules of a tag must hold for the tag to apply. The rules are compiled
+into a single grouped query with one CASE column per tag, so the database
+evaluates every customer's tags in one statement.
+"""
+
+import frappe
+import numpy as np
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+from petcare.scripts.customer_aggregates import PAID, SHARED_COLUMNS, shared_arrays
+from petcare.scripts.spending_percentiles import get_spending_quantile
+
+RULE_DOCTYPE = "Customer Tag Rule"
+
+# SQL for each metric over the customer's completed Service Requests (sr);
+# only paid services count, as in the built-in tag logic
+METRICS = {
+    "Completed Services": f"COALESCE(SUM({PAID}), 0)",
+    "Total Spent": f"COALESCE(SUM(CASE WHEN {PAID} THEN sr.amount_after_discount END), 0)",
+    "Days Since Last Service": f"DATEDIFF(%(today)s, MAX(CASE WHEN {PAID} THEN sr.completed_date END))",
+    "Services In Window": f"COALESCE(SUM({PAID} AND sr.completed_date >= %(window_{{days}})s), 0)",
+    "Spend In Window": (
+        f"COALESCE(SUM(CASE WHEN {PAID} AND sr.completed_date >= %(window_{{days}})s "
+        "THEN sr.amount_after_discount ELSE 0 END), 0)"
+    ),
+    "Pet Count": "COALESCE(MAX(pets.pet_count), 0)",
+}
+WINDOW_METRICS = ("Services In Window", "Spend In Window")
+OPERATORS = (">", ">=", "<", "<=", "=", "!=")
+
+THRESHOLD_VALUE = "Value"
+THRESHOLD_PERCENTILE = "Spending Percentile"
+
+
+def get_enabled_rules() -> List[Dict]:
+    """Enabled rules in tag order."""
+    return frappe.get_all(
+        RULE_DOCTYPE,
+        filters={"enabled": 1},
+        fields=["name", "tag", "sequence", "metric", "operator", "threshold_type", "threshold", "window_days"],
+        order_by="sequence asc, creation asc"
+    )
+
+
+def resolve_threshold(rule: Dict, spending_percentiles: Optional[Dict] = None) -> float:
+    """
+    Threshold value of a rule. Spending percentile thresholds (0-100) are
+    looked up in the given percentiles when they are the median or p90, and
+    in the Spending Percentile Snapshot otherwise.
+    """
+    if rule.threshold_type != THRESHOLD_PERCENTILE:
+        return rule.threshold or 0
+    known = {50: "median", 90: "percentile_90"}
+    key = known.get(rule.threshold)
+    if spending_percentiles and key in spending_percentiles:
+        return spending_percentiles[key]
+    return get_spending_quantile((rule.threshold or 0) / 100)
+
+
+def compile_tag_rules(rules: List[Dict], today: date, spending_percentiles: Optional[Dict] = None,
+                      include_shared: bool = False) -> Dict:
+    """
+    Compile rules into one grouped query.
+
+    Args:
+        rules (list): Output of get_enabled_rules
+        today (date): Date the day-based metrics are measured from
+        spending_percentiles (dict, optional): Known median/p90 values
+        include_shared (bool): Also select the columns the other nightly
+            pipeline stages need (see customer_aggregates)
+
+    Returns:
+        Dict: sql and params, plus the tag order and the windows (in days)
+              used by windowed rules
+    """
+    params = {"today": today}
+    conditions_by_tag = {}
+    windows = set()
+    for i, rule in enumerate(rules):
+        if rule.metric not in METRICS or rule.operator not in OPERATORS:
+            frappe.throw(f"Customer Tag Rule {rule.name} has an unsupported metric or operator")
+        expression = METRICS[rule.metric]
+        if rule.metric in WINDOW_METRICS:
+            days = int(rule.window_days or 0)
+            windows.add(days)
+            params[f"window_{days}"] = today - timedelta(days=days)
+            expression = expression.format(days=days)
+        params[f"threshold_{i}"] = resolve_threshold(rule, spending_percentiles)
+        conditions_by_tag.setdefault(rule.tag, []).append(f"{expression} {rule.operator} %(threshold_{i})s")
+
+    tags = list(conditions_by_tag)
+    tag_columns = [
+        f"CASE WHEN {' AND '.join(f'({condition})' for condition in conditions)} THEN 1 ELSE 0 END AS tag_{i}"
+        for i, conditions in enumerate(conditions_by_tag.values())
+    ]
+    window_columns = [
+        f"MIN(CASE WHEN {PAID} AND sr.completed_date >= %(window_{days})s THEN sr.completed_date END) "
+        f"AS oldest_in_window_{days}"
+        for days in sorted(windows)
+    ]
+    pet_join = ""
+    if any(rule.metric == "Pet Count" for rule in rules):
+        pet_join = "LEFT JOIN (SELECT owner, COUNT(*) AS pet_count FROM `tabPet` GROUP BY owner) pets ON pets.owner = c.name"
+
+    shared_columns = SHARED_COLUMNS if include_shared else []
+    columns = ",\n            ".join(window_columns + tag_columns + shared_columns)
+    sql = f"""
+        SELECT
+            c.name AS customer,
+            c.custom_next_tag_transition_date AS stored_transition,
+            MAX(CASE WHEN {PAID} THEN sr.completed_date END) AS latest_service,
+            {columns}
+        FROM `tabCustomer` c
+        LEFT JOIN `tabService Request` sr
+            ON sr.customer = c.name
+            AND sr.status = 'Completed'
+        {pet_join}
+        {{condition}}
+        GROUP BY c.name
+    """
+    return {
+        "sql": sql, "params": params, "tags": tags, "windows": sorted(windows),
+        "rules": rules, "include_shared": include_shared
+    }
+
+
+def evaluate_tag_rules(compiled: Dict, customers: Optional[List[str]] = None) -> Dict[str, np.ndarray]:
+    """
+    Run a compiled rule query.
+
+    Returns:
+        Dict[str, np.ndarray]: customer, stored_transition, latest_service and
+            oldest_in_window_<days> columns, plus one boolean mask per tag
+            under "masks"
+    """
+    params = dict(compiled["params"], customers=tuple(customers or [""]))
+    condition = "WHERE c.name IN %(customers)s" if customers else ""
+    rows = frappe.db.sql(compiled["sql"].format(condition=condition), params, as_dict=True)
+
+    result = {
+        "customer": np.array([row.customer for row in rows], dtype=object),
+        "stored_transition": np.array([row.stored_transition for row in rows], dtype="datetime64[D]"),
+        "latest_service": np.array([row.latest_service for row in rows], dtype="datetime64[D]"),
+        "masks": {
+            tag: np.array([bool(row[f"tag_{i}"]) for row in rows], dtype=bool)
+            for i, tag in enumerate(compiled["tags"])
+        },
+    }
+    for days in compiled["windows"]:
+        column = f"oldest_in_window_{days}"
+        result[column] = np.array([row[column] for row in rows], dtype="datetime64[D]")
+    if compiled["include_shared"]:
+        result.update(shared_arrays(rows))
+    return result
+
+
+def next_rule_transition_dates(compiled: Dict, evaluated: Dict[str, np.ndarray], today: date) -> np.ndarray:
+    """
+    Date on which each customer's rule-based tags can next change without
+    any new service request, the rule-driven counterpart of
+    CustomerTagEngine.next_transition_dates:
+    - a Days Since Last Service rule flips when the day count crosses its threshold
+    - a windowed rule can change when the oldest service leaves its window;
+      for > and >= rules only while the tag is held, since a shrinking
+      window can then only remove the tag
+
+    Returns:
+        np.ndarray: datetime64[D] per customer, NaT when nothing is pending
+    """
+    latest = evaluated["latest_service"]
+    today = np.datetime64(today, "D")
+    never = np.datetime64("NaT", "D")
+    candidates = [np.full(latest.shape, never)]
+
+    for rule in compiled["rules"]:
+        if rule.metric == "Days Since Last Service":
+            threshold = int(np.ceil(rule.threshold or 0))
+            # > and <= flip the day after the threshold, >= and < on it; = and != on both
+            offsets = {">": [1], "<=": [1], ">=": [0], "<": [0]}.get(rule.operator, [0, 1])
+            for offset in offsets:
+                flip = latest + np.timedelta64(threshold + offset, "D")
+                candidates.append(np.where(flip > today, flip, never))
+        elif rule.metric in WINDOW_METRICS:
+            days = int(rule.window_days or 0)
+            leaves = evaluated[f"oldest_in_window_{days}"] + np.timedelta64(days + 1, "D")
+            if rule.operator in (">", ">="):
+                leaves = np.where(evaluated["masks"][rule.tag], leaves, never)
+            candidates.append(leaves)
+
+    # NaT sorts last, so the minimum ignores missing candidates
+    return np.sort(np.stack(candidates), axis=0)[0]
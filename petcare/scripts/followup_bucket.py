@@ -0,0 +1,123 @@
+"""
+Follow-up buckets group customers by the days since their last completed
+service. Bucket boundaries come from site config (see
+utils.config.get_followup_bucket_boundaries).
+"""
+
+import time
+import frappe
+from typing import Dict, List, Optional, Tuple
+from frappe.utils import today
+from petcare.utils.config import get_followup_bucket_boundaries
+
+NO_SERVICE_HISTORY = "No Service History"
+CHUNK_SIZE = 5000
+
+logger = frappe.logger("followup_bucket", allow_site=True)
+
+
+def get_bucket_labels(boundaries: List[int]) -> List[Tuple[Optional[int], str]]:
+    """
+    (upper bound in days, label) per bucket; the last bucket is open ended.
+
+    [30, 60, 90] gives 0-30 days, 31-60 days, 61-90 days and 91+ days.
+    """
+    labels = []
+    lower = 0
+    for upper in boundaries:
+        labels.append((upper, f"{lower}-{upper} days"))
+        lower = upper + 1
+    labels.append((None, f"{lower}+ days"))
+    return labels
+
+
+def get_followup_bucket(days, boundaries: Optional[List[int]] = None) -> str:
+    """
+    Follow-up bucket for a number of days since the last service.
+
+    Args:
+        days (int): Days since the last completed service, None if there is none
+        boundaries (list, optional): Bucket upper bounds, from site config by default
+
+    Returns:
+        str: Bucket name
+    """
+    if days is None:
+        return NO_SERVICE_HISTORY
+    for upper, label in get_bucket_labels(boundaries or get_followup_bucket_boundaries()):
+        if upper is None or days <= upper:
+            return label
+
+
+def bucket_case_sql(boundaries: List[int]) -> Tuple[str, Dict]:
+    """
+    SQL CASE expression giving each Customer row its bucket.
+
+    Returns:
+        tuple: (expression, params)
+    """
+    params = {"today": today(), "no_service_history": NO_SERVICE_HISTORY}
+    whens = ["WHEN custom_latest_completed_service_date IS NULL THEN %(no_service_history)s"]
+    for i, (upper, label) in enumerate(get_bucket_labels(boundaries)):
+        params[f"bucket_{i}"] = label
+        if upper is None:
+            whens.append(f"ELSE %(bucket_{i})s")
+        else:
+            params[f"upper_{i}"] = upper
+            whens.append(
+                f"WHEN DATEDIFF(%(today)s, custom_latest_completed_service_date) <= %(upper_{i})s THEN %(bucket_{i})s"
+            )
+    return f"CASE {' '.join(whens)} END", params
+
+
+def update_followup_buckets(customers: Optional[List[str]] = None) -> Dict[str, int]:
+    """
+    Set custom_followup_bucket with one UPDATE per chunk of customers,
+    touching only rows whose bucket changes.
+
+    Args:
+        customers (list, optional): Only update these customers
+
+    Returns:
+        Dict[str, int]: Number of customers moved into each bucket
+    """
+    started = time.perf_counter()
+    bucket, params = bucket_case_sql(get_followup_bucket_boundaries())
+    names = customers or frappe.get_all("Customer", pluck="name", order_by="name")
+
+    counts = {}
+    for start in range(0, len(names), CHUNK_SIZE):
+        chunk_params = dict(params, customers=tuple(names[start:start + CHUNK_SIZE]))
+        changed = f"name IN %(customers)s AND NOT (custom_followup_bucket <=> {bucket})"
+        for label, count in frappe.db.sql(f"""
+            SELECT {bucket}, COUNT(*) FROM `tabCustomer` WHERE {changed} GROUP BY 1
+        """, chunk_params):
+            counts[label] = counts.get(label, 0) + count
+        frappe.db.sql(f"""
+            UPDATE `tabCustomer` SET custom_followup_bucket = {bucket} WHERE {changed}
+        """, chunk_params)
+        frappe.db.commit()
+
+    logger.info(f"Follow-up buckets updated in {time.perf_counter() - started:.2f}s: {counts}")
+    return counts
+
+
+def update_followup_bucket(customer_id=None):
+    """
+    Updates the custom_followup_bucket field for all customers, or only the given one.
+    
+    Args:
+        customer_id (str, optional): Specific customer ID to update. If provided, only updates that customer.
+    """
+    counts = update_followup_buckets([customer_id] if customer_id else None)
+    print(f"Updated follow-up buckets: {counts or 'no changes'}")
+    return counts
+
+def execute():
+    """
+    Main execution function that will be called by the scheduler
+    """
+    # Test for specific customer
+    # update_followup_bucket("CUST-2025-02036")
+    
+    return update_followup_bucket()
@@ -1,18 +1,68 @@
 import frappe
-from datetime import datetime
+from functools import lru_cache
 
-def generate_loyalty_message(customer_id, save_to_customer=True):
-    """
-    Generates a WhatsApp-friendly loyalty history message for a customer
-    and optionally saves it in the Customer Doctype.
+CACHE_KEY = "loyalty_message"
+
+# Rendered with the values already formatted, so the template only lays them out
+MESSAGE_TEMPLATE = """\
+{%- if not requests -%}
+Dear {{ customer_name }},
+
+You have no completed service requests yet. Your total redeemable points: {{ balance }}.
+{%- else -%}
+✨ *Loyalty History - Masterpet* ✨
+
+🐾 *Dear {{ customer_name }},*
+Here's your loyalty history with us:
+
+{% for sr in requests -%}
+📌 *Service Request:* {{ sr.name }}
+📅 *Date:* {{ sr.date }}
+{% if sr.pet_names %}🐶 *Pet(s):* {{ sr.pet_names }}
+{% endif -%}
+💰 *Amount Paid:* ₹{{ sr.amount }}
+✨ *Loyalty Earned:* {{ sr.earned }} points
+🔻 *Loyalty Redeemed:* {{ sr.redeemed }} points
+🎯 *Balance after this request:* {{ sr.balance }} points
+----------------------------------
+{% endfor %}
+🎉 *Total Redeemable Loyalty Points:* {{ balance }} points
+🙏 Thank you for being a valued Masterpet customer! We appreciate your love for pets. 🐾❤️
+{% endif -%}
+"""
+
+@lru_cache(maxsize=None)
+def get_message_template():
+    """The loyalty message template, compiled once per worker."""
+    return frappe.get_jenv().from_string(MESSAGE_TEMPLATE)
+
+def get_message_stamp(customer_id):
     """
+    Everything the message depends on, in one query: the latest ledger entry, the
+    latest change to a completed request, the customer's name and balance.
 
-    # Fetch customer details
-    customer = frappe.get_doc("Customer", customer_id)
-    customer_name = customer.customer_name
-    total_redeemable_points = customer.custom_loyalty_points_balance or 0
+    Returns:
+        tuple: (stamp, customer_name, balance), or None if the customer does not exist
+    """
+    row = frappe.db.sql("""
+        SELECT c.customer_name, c.custom_loyalty_points_balance,
+            (SELECT MAX(creation) FROM `tabLoyalty Ledger Entry` WHERE customer = c.name) AS latest_entry,
+            (SELECT MAX(modified) FROM `tabService Request`
+                WHERE customer = c.name AND status = 'Completed') AS latest_request
+        FROM `tabCustomer` c
+        WHERE c.name = %s
+    """, (customer_id,), as_dict=True)
+    if not row:
+        return None
+    row = row[0]
+    balance = row.custom_loyalty_points_balance or 0
+    return f"{row.latest_entry}|{row.latest_request}|{row.customer_name}|{balance}", row.customer_name, balance
 
-    # Fetch all completed service requests for the customer, ordered by date
+def render_loyalty_message(customer_id, customer_name, balance):
+    """
+    Render the WhatsApp-friendly loyalty history message, with the pet names of
+    all the customer's requests fetched in one query.
+    """
     service_requests = frappe.get_all(
         "Service Request",
         filters={"customer": customer_id, "status": "completed"},
@@ -20,52 +70,84 @@ def generate_loyalty_message(customer_id, save_to_customer=True):
         order_by="completed_date asc"
     )
 
-    if not service_requests:
-        message = f"Dear {customer_name},\n\nYou have no completed service requests yet. Your total redeemable points: {total_redeemable_points}."
-    else:
-        # Generate WhatsApp-friendly message
-        message = f"✨ *Loyalty History - Masterpet* ✨\n\n"
-        message += f"🐾 *Dear {customer_name},*\n"
-        message += f"Here's your loyalty history with us:\n\n"
-
-        running_balance = 0  # Keep track of the loyalty points history
-
-        for sr in service_requests:
-            # ✅ Convert datetime.date to formatted string
-            sr_date = sr["completed_date"].strftime("%d-%b-%Y") if sr["completed_date"] else "N/A"
-
-            earned = sr["loyalty_points_earned"] or 0
-            redeemed = sr["loyalty_points_redeemed"] or 0
-            running_balance += earned - redeemed
-
-            # ✅ Fetch pet names for this service request, skipping NULL values
-            service_items = frappe.get_all(
-                "Service Items Child Table",
-                filters={"parent": sr["name"], "pet_name": ["is", "set"]},  # Ensures pet_name is not NULL
-                fields=["pet_name"]
-            )
-
-            # ✅ Extract unique pet names, skipping empty values
-            pet_names = sorted(set(item["pet_name"] for item in service_items if item["pet_name"])) if service_items else []
-            pet_names_str = f"🐶 *Pet(s):* {', '.join(pet_names)}\n" if pet_names else ""  # Only add if pets exist
-
-            # ✅ Format WhatsApp-friendly message
-            message += f"📌 *Service Request:* {sr['name']}\n"
-            message += f"📅 *Date:* {sr_date}\n"
-            message += pet_names_str  # Add only if pets exist
-            message += f"💰 *Amount Paid:* ₹{round(sr['amount_after_discount'] or 0, 2)}\n"
-            message += f"✨ *Loyalty Earned:* {earned} points\n"
-            message += f"🔻 *Loyalty Redeemed:* {redeemed} points\n"
-            message += f"🎯 *Balance after this request:* {running_balance} points\n"
-            message += "----------------------------------\n"
-
-        message += f"\n🎉 *Total Redeemable Loyalty Points:* {total_redeemable_points} points\n"
-        message += "🙏 Thank you for being a valued Masterpet customer! We appreciate your love for pets. 🐾❤️\n"
-
-    # ✅ Save the generated message to Customer Doctype
-    if save_to_customer:
-        frappe.db.set_value("Customer", customer_id, "custom_loyalty_message", message)
-        frappe.db.commit()
-        frappe.logger().info(f"📩 Loyalty message updated for Customer {customer_id}")
+    pet_names = {}
+    if service_requests:
+        for parent, pet_name in frappe.db.sql("""
+            SELECT DISTINCT item.parent, item.pet_name
+            FROM `tabService Items Child Table` item
+            JOIN `tabService Request` sr ON sr.name = item.parent
+            WHERE item.parenttype = 'Service Request'
+            AND sr.customer = %s AND sr.status = 'Completed'
+            AND IFNULL(item.pet_name, '') != ''
+        """, (customer_id,)):
+            pet_names.setdefault(parent, []).append(pet_name)
+
+    running_balance = 0  # Keep track of the loyalty points history
+    requests = []
+    for sr in service_requests:
+        earned = sr["loyalty_points_earned"] or 0
+        redeemed = sr["loyalty_points_redeemed"] or 0
+        running_balance += earned - redeemed
+        requests.append({
+            "name": sr["name"],
+            "date": sr["completed_date"].strftime("%d-%b-%Y") if sr["completed_date"] else "N/A",
+            "pet_names": ", ".join(sorted(pet_names.get(sr["name"], []))),
+            "amount": round(sr["amount_after_discount"] or 0, 2),
+            "earned": earned,
+            "redeemed": redeemed,
+            "balance": running_balance,
+        })
+
+    return get_message_template().render(customer_name=customer_name, balance=balance, requests=requests)
+
+def get_loyalty_message(customer_id):
+    """
+    The customer's loyalty message, rendered only when something it depends on
+    changed since it was last rendered.
+    """
+    stamp = get_message_stamp(customer_id)
+    if not stamp:
+        return None
+    stamp, customer_name, balance = stamp
+
+    cached = frappe.cache().hget(CACHE_KEY, customer_id)
+    if cached and cached.get("stamp") == stamp:
+        return cached["message"]
+
+    message = render_loyalty_message(customer_id, customer_name, balance)
+    frappe.cache().hset(CACHE_KEY, customer_id, {"stamp": stamp, "message": message})
+    return message
+
+def generate_loyalty_message(customer_id, save_to_customer=True):
+    """
+    Generates a WhatsApp-friendly loyalty history message for a customer
+    and optionally saves it in the Customer Doctype, if it changed.
+    """
+    message = get_loyalty_message(customer_id)
+
+    if save_to_customer and message is not None:
+        if frappe.db.get_value("Customer", customer_id, "custom_loyalty_message") != message:
+            frappe.db.set_value("Customer", customer_id, "custom_loyalty_message", message, update_modified=False)
+            frappe.logger().info(f"📩 Loyalty message updated for Customer {customer_id}")
 
     return message
+
+@frappe.whitelist()
+def get_customer_loyalty_message(customer_id):
+    """
+    The loyalty message to send to a customer, storing it on the Customer first
+    if it changed. Meant for the action that sends the message; this app has
+    no sender of its own.
+    """
+    frappe.has_permission("Customer", "read", customer_id, throw=True)
+    return generate_loyalty_message(customer_id)
+
+def refresh_loyalty_message(doc, method=None):
+    """
+    Customer onload hook: show an up to date message on the form. Only the
+    loaded document is changed; form loads are GET requests and are not
+    committed, so the stored copy is updated when the message is sent.
+    """
+    message = get_loyalty_message(doc.name)
+    if message is not None:
+        doc.custom_loyalty_message = message
@@ -1,92 +1,209 @@
+import time
 import frappe
-from frappe.utils import nowdate, add_days, add_months, getdate
+from frappe.utils import nowdate, add_days, getdate
+from petcare.utils.recurrence import next_occurrence, occurrences_between
+
+INSERT_CHUNK_SIZE = 50
+
+SERVICE_ITEM_FIELDS = ["item_code", "item_name", "description", "quantity", "rate",
+                       "fetched_rate", "amount", "rate_changed", "tax_applicable",
+                       "pet", "pet_name", "pet_breed"]
+
+DEFAULT_GENERATION_WINDOW = 30
+
+logger = frappe.logger("recurring_service_requests", allow_site=True)
 
 def generate_recurring_service_requests():
+    """
+    Create Service Requests for the active Service Repeats that are due.
+
+    Only repeats whose indexed next_due_date falls inside their generation
+    window are selected; their dates are computed in closed form (see
+    petcare.utils.recurrence) and next_due_date is then moved past the window.
+    Existing (customer, scheduled_date) pairs and the repeats' service items
+    are preloaded with one query each, new requests are built in memory and
+    inserted in chunks, with one commit per chunk. A chunk that fails is
+    retried one request at a time, so only the requests that fail on their
+    own are counted as failed.
+
+    Returns:
+        dict: Counts and generation throughput for the run
+    """
+    started = time.perf_counter()
     today = getdate(nowdate())
 
-    # Fetch active Service Repeat records
-    service_repeats = frappe.get_all("Service Repeat",
-        filters={"status": "Active"},
-        fields=["name", "customer", "start_date", "recurrence_frequency", "repeat_end_date", 
-                "repeat_until_cancelled", "service_request_type",
-                "assigned_truckstore", "generation_window_days"]
+    # Only repeats with an occurrence inside their window; NULL is not computed yet
+    service_repeats = frappe.db.sql("""
+        SELECT name, customer, start_date, recurrence_frequency, custom_recurrence_rule,
+            repeat_end_date, repeat_until_cancelled, service_request_type,
+            assigned_truckstore, generation_window_days, custom_next_due_date
+        FROM `tabService Repeat`
+        WHERE status = 'Active'
+        AND (custom_next_due_date IS NULL
+            OR custom_next_due_date <= DATE_ADD(%(today)s,
+                INTERVAL IFNULL(NULLIF(generation_window_days, 0), %(default_window)s) DAY))
+    """, {"today": today, "default_window": DEFAULT_GENERATION_WINDOW}, as_dict=True)
+
+    # Calculate upcoming service dates within each repeat's window
+    planned = []
+    window_ends = {}
+    for repeat in service_repeats:
+        window_ends[repeat.name] = add_days(today, repeat.generation_window_days or DEFAULT_GENERATION_WINDOW)
+        # Dates before next_due_date were generated by an earlier run
+        after = today
+        if repeat.custom_next_due_date and getdate(repeat.custom_next_due_date) > today:
+            after = add_days(repeat.custom_next_due_date, -1)
+        for service_date in occurrences_between(repeat.start_date, repeat.recurrence_frequency,
+                                                after, window_ends[repeat.name], repeat.custom_recurrence_rule):
+            planned.append((repeat, service_date))
+
+    report = {
+        "repeats": len(service_repeats),
+        "dates_planned": len(planned),
+        "skipped_existing": 0,
+        "created": 0,
+        "failed": 0,
+        "advanced": 0,
+    }
+    failed_dates = {}
+
+    if planned:
+        existing = get_existing_requests({repeat.customer for repeat, _ in planned},
+                                         min(date for _, date in planned), max(date for _, date in planned))
+        items_by_repeat = get_service_items({repeat.name for repeat, _ in planned})
+
+        new_requests = []
+        for repeat, service_date in planned:
+            # Skip to avoid duplicates, including two repeats of one customer on the same date
+            if (repeat.customer, service_date) in existing:
+                report["skipped_existing"] += 1
+                continue
+            existing.add((repeat.customer, service_date))
+            new_requests.append((repeat, service_date))
+
+        def build(repeat, service_date):
+            return build_service_request(repeat, service_date, items_by_repeat.get(repeat.name, []))
+
+        for start in range(0, len(new_requests), INSERT_CHUNK_SIZE):
+            chunk = new_requests[start:start + INSERT_CHUNK_SIZE]
+            try:
+                for repeat, service_date in chunk:
+                    build(repeat, service_date).insert(ignore_permissions=True)
+                frappe.db.commit()
+                report["created"] += len(chunk)
+                continue
+            except Exception:
+                frappe.db.rollback()
+
+            # Retry the chunk one request at a time, so one bad repeat does not
+            # hold back the others
+            for repeat, service_date in chunk:
+                try:
+                    build(repeat, service_date).insert(ignore_permissions=True)
+                    frappe.db.commit()
+                    report["created"] += 1
+                except Exception as e:
+                    frappe.db.rollback()
+                    report["failed"] += 1
+                    failed_dates[repeat.name] = min(service_date, failed_dates.get(repeat.name, service_date))
+                    frappe.log_error(
+                        f"Error generating recurring service request for {repeat.name} "
+                        f"on {service_date}: {str(e)}",
+                        "Recurring Service Request Generation"
+                    )
+
+    report["advanced"] = advance_next_due_dates(service_repeats, window_ends, failed_dates)
+
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    report["requests_per_second"] = round(report["created"] / report["seconds"], 1) if report["seconds"] else 0
+    logger.info(f"Recurring service request generation: {report}")
+    return report
+
+def get_existing_requests(customers, from_date, to_date):
+    """
+    Load the (customer, scheduled_date) pairs that already have a Service Request
+    in the generation window, in one query.
+    """
+    rows = frappe.db.sql("""
+        SELECT customer, scheduled_date
+        FROM `tabService Request`
+        WHERE customer IN %(customers)s
+        AND scheduled_date BETWEEN %(from_date)s AND %(to_date)s
+    """, {"customers": tuple(customers), "from_date": from_date, "to_date": to_date})
+    return {(customer, getdate(scheduled_date)) for customer, scheduled_date in rows}
+
+def get_service_items(repeat_names):
+    """
+    Load the Service Items of all the given repeats in one query.
+
+    Returns:
+        dict: {repeat name: [item rows in table order]}
+    """
+    service_items = frappe.get_all("Service Items Child Table",
+        filters={"parent": ["in", list(repeat_names)], "parenttype": "Service Repeat"},
+        fields=["parent"] + SERVICE_ITEM_FIELDS,
+        order_by="idx asc"
     )
+    items_by_repeat = {}
+    for item in service_items:
+        items_by_repeat.setdefault(item.parent, []).append(item)
+    return items_by_repeat
+
+def build_service_request(repeat, service_date, service_items):
+    """Build (without inserting) the Service Request for one repeat date."""
+    new_service_request = frappe.get_doc({
+        "doctype": "Service Request",
+        "customer": repeat.customer,
+        "scheduled_date": service_date,  # ✅ Correctly set dynamically
+        "status": "Scheduled",  # Hardcoded
+        "source": "Auto-generated from Service Repeat",  # Hardcoded
+        "service_repeat": repeat.name,  # Link back to Service Repeat
+        "service_request_type": repeat.service_request_type,  # From Service Repeat
+        "assigned_truckstore": repeat.assigned_truckstore,  # From Service Repeat
+        "services": []  # This will hold the copied child table
+    })
+
+    # Copy the Service Items from the Service Repeat
+    for item in service_items:
+        new_service_request.append("services", {field: item.get(field) for field in SERVICE_ITEM_FIELDS})
 
+    return new_service_request
+
+def advance_next_due_dates(service_repeats, window_ends, failed_dates):
+    """
+    Move each processed repeat's next_due_date past its generation window.
+    A repeat with failed inserts restarts from its earliest failed date, so
+    the next run retries it.
+
+    Returns:
+        int: Number of repeats whose next_due_date changed
+    """
+    advanced = 0
     for repeat in service_repeats:
-        start_date = getdate(repeat.start_date)
-        generation_window = repeat.generation_window_days or 30  # Default to 30 days if not set
-
-        # Calculate upcoming service dates within the window
-        upcoming_dates = get_upcoming_service_dates(start_date, repeat.recurrence_frequency, today, generation_window)
-
-        for service_date in upcoming_dates:
-            # Check if a service request already exists for this customer on this date
-            existing_request = frappe.db.exists("Service Request", {
-                "customer": repeat.customer,
-                "scheduled_date": service_date
-            })
-
-            if existing_request:
-                continue  # Skip to avoid duplicates
-
-            # Create new Service Request
-            new_service_request = frappe.get_doc({
-                "doctype": "Service Request",
-                "customer": repeat.customer,
-                "scheduled_date": service_date,  # ✅ Correctly set dynamically
-                "status": "Scheduled",  # Hardcoded
-                "source": "Auto-generated from Service Repeat",  # Hardcoded
-                "service_repeat": repeat.name,  # Link back to Service Repeat
-                "service_request_type": repeat.service_request_type,  # From Service Repeat
-                "assigned_truckstore": repeat.assigned_truckstore,  # From Service Repeat
-                "services": []  # This will hold the copied child table
-            })
-
-            # Fetch Service Items from Service Repeat and copy them
-            service_items = frappe.get_all("Service Items Child Table",
-                filters={"parent": repeat.name, "parenttype": "Service Repeat"},
-                fields=["item_code", "item_name", "description", "quantity", "rate", 
-                        "fetched_rate", "amount", "rate_changed", "tax_applicable", 
-                        "pet", "pet_name", "pet_breed"]
-            )
-
-            for item in service_items:
-                new_service_request.append("services", {
-                    "item_code": item.item_code,
-                    "item_name": item.item_name,
-                    "description": item.description,
-                    "quantity": item.quantity,
-                    "rate": item.rate,
-                    "fetched_rate": item.fetched_rate,
-                    "amount": item.amount,
-                    "rate_changed": item.rate_changed,
-                    "tax_applicable": item.tax_applicable,
-                    "pet": item.pet,
-                    "pet_name": item.pet_name,
-                    "pet_breed": item.pet_breed
-                })
-
-            new_service_request.insert(ignore_permissions=True)
-            frappe.db.commit()
-
-def get_upcoming_service_dates(start_date, recurrence_frequency, today, generation_window):
+        next_due_date = failed_dates.get(repeat.name) or next_occurrence(
+            repeat.start_date, repeat.recurrence_frequency, window_ends[repeat.name], repeat.custom_recurrence_rule
+        )
+        if next_due_date != (getdate(repeat.custom_next_due_date) if repeat.custom_next_due_date else None):
+            frappe.db.set_value("Service Repeat", repeat.name, "custom_next_due_date",
+                                next_due_date, update_modified=False)
+            advanced += 1
+    frappe.db.commit()
+    return advanced
+
+def set_next_due_date(doc, method=None):
+    """
+    Service Repeat before_save hook: recompute next_due_date when the schedule changes,
+    so the next daily run picks the repeat up.
+    """
+    if not doc.is_new() and not any(doc.has_value_changed(field) for field in
+                                    ("start_date", "recurrence_frequency", "custom_recurrence_rule", "status")):
+        return
+    doc.custom_next_due_date = next_occurrence(
+        doc.start_date, doc.recurrence_frequency, getdate(nowdate()), doc.get("custom_recurrence_rule")
+    ) if doc.start_date else None
+
+def get_upcoming_service_dates(start_date, recurrence_frequency, today, generation_window, rule=None):
     """
     Calculate all upcoming service dates within the generation window.
     """
-    upcoming_dates = []
-    service_date = start_date
-    while service_date <= add_days(today, generation_window):
-
-        if service_date > today:  # Only consider future dates
-            upcoming_dates.append(service_date)
-
-        if recurrence_frequency == "Monthly":
-            service_date = add_months(service_date, 1)
-        elif recurrence_frequency == "Biweekly":
-            service_date = add_days(service_date, 14)
-        elif recurrence_frequency == "Weekly":
-            service_date = add_days(service_date, 7)
-        else:
-            break  # Unknown recurrence type
-
-    return upcoming_dates
+    return occurrences_between(start_date, recurrence_frequency, today, add_days(today, generation_window), rule)
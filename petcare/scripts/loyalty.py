@@ -1,86 +1,179 @@
 import frappe
-from petcare.scripts.generate_loyalty_message import generate_loyalty_message  # Import function
+import numpy as np
+from frappe.utils import nowdate
+from petcare.utils.hook_gating import depends_on
 
-def update_loyalty_totals(doc, method):
-    """
-    Calculates and updates loyalty points for a Service Request and updates the Customer's total loyalty balance.
-    Also, updates the loyalty message in the Customer Doctype.
-    """
+LEDGER_DOCTYPE = "Loyalty Ledger Entry"
 
-    frappe.logger().info(f"🔹 Running update_loyalty_totals for {doc.customer}, Service Request: {doc.name}")
-    print(f"🔹 Running update_loyalty_totals for {doc.customer}, Service Request: {doc.name}")
+# Items that do not earn loyalty points
+NON_EARNING_ITEMS = ["TRAVEL_EXP", "Food", "TIP"]
+AMOUNT_PER_POINT = 27.5  # 1 point per Rs. 27.5 spent
 
-    # Ensure all None values are converted to 0
-    doc.loyalty_points_earned = doc.loyalty_points_earned or 0
-    doc.loyalty_points_redeemed = doc.loyalty_points_redeemed or 0
+def get_item_points(item_code, amount):
+    """Loyalty points earned by one service item."""
+    if item_code in NON_EARNING_ITEMS:
+        return 0
+    return int((amount or 0) / AMOUNT_PER_POINT)
 
-    # ✅ Calculate loyalty points based on service items
-    eligible_amount = 0
-    points_earned = 0
-    if doc.get("services"):
-        for item in doc.services:
-            if item.item_code not in ["TRAVEL_EXP", "Food", "TIP"]:
-                item_points = int(item.amount / 27.5)  # 1 point per Rs. 27.5 spent
-                eligible_amount += item.amount or 0
-                points_earned += item_points
-                print(f"✅ Item: {item.item_code} | Amount: {item.amount} | Points Earned: {item_points}")
-
-    # ✅ Store calculated loyalty points in the Service Request
-    doc.loyalty_points_earned = points_earned
-    frappe.db.set_value("Service Request", doc.name, "loyalty_points_earned", points_earned)  # Ensure it gets saved
-
-    print(f"📌 Eligible Amount for Loyalty: {eligible_amount}")
-    print(f"🎯 Earned Points: {doc.loyalty_points_earned}")
-
-    # ✅ Fetch all previous completed service requests for this customer
-    previous_requests = frappe.get_all(
-        "Service Request",
-        filters={"customer": doc.customer, "status": "completed", "completed_date": ["<", doc.completed_date]},
-        fields=["loyalty_points_earned", "loyalty_points_redeemed"]
-    )
+def calculate_points_earned(doc):
+    """Loyalty points earned by a Service Request's own service items."""
+    return sum(get_item_points(item.item_code, item.amount) for item in doc.get("services") or [])
 
-    print(f"📌 Found {len(previous_requests)} previous service requests for {doc.customer}")
-    
-    # ✅ Calculate cumulative loyalty points
-    total_earned = sum(sr["loyalty_points_earned"] or 0 for sr in previous_requests) + doc.loyalty_points_earned
-    total_redeemed = sum(sr["loyalty_points_redeemed"] or 0 for sr in previous_requests) + doc.loyalty_points_redeemed
+def get_request_totals(earned_before, redeemed_before, earned, redeemed):
+    """
+    A request's running totals from the customer's points before it plus its
+    own. The rebuild sums the requests ordered before it (by completed date,
+    creation, name); on save the customer's posted totals are used instead, so
+    the cost does not depend on the customer's history. The two agree when
+    requests are completed in order; a rebuild reorders back-dated ones.
+    Works on numbers or on NumPy arrays.
+
+    Returns:
+        dict: lifetime_loyalty_points, total_loyalty_points and total_loyalty_points_redeemable
+    """
+    lifetime = earned_before + earned
+    total = lifetime - redeemed_before - redeemed
+    return {
+        "lifetime_loyalty_points": lifetime,
+        "total_loyalty_points": total,
+        "total_loyalty_points_redeemable": np.maximum(total - earned, 0),
+    }
+
+def get_entries_for_change(already_posted, delta_earned, delta_redeemed):
+    """
+    Ledger entries for a change in a request's points: an Earn and/or a Redeem
+    the first time, Adjustments afterwards.
 
-    # ✅ Update the Service Request fields
-    doc.lifetime_loyalty_points = total_earned
-    doc.total_loyalty_points = total_earned - total_redeemed
-    doc.total_loyalty_points_redeemable = max(doc.total_loyalty_points - doc.loyalty_points_earned, 0)
+    Returns:
+        list: (entry_type, points_earned, points_redeemed) tuples
+    """
+    if already_posted:
+        return [("Adjustment", delta_earned, delta_redeemed)] if delta_earned or delta_redeemed else []
+    entries = [("Earn", delta_earned, 0)] if delta_earned else []
+    entries += [("Redeem", 0, delta_redeemed)] if delta_redeemed else []
+    return entries
+
+def get_posted_points(service_request):
+    """
+    Points already in the ledger for a Service Request, per customer.
 
-    frappe.db.set_value("Service Request", doc.name, "total_loyalty_points", doc.total_loyalty_points)
-    frappe.db.set_value("Service Request", doc.name, "lifetime_loyalty_points", doc.lifetime_loyalty_points)
-    frappe.db.set_value("Service Request", doc.name, "total_loyalty_points_redeemable", doc.total_loyalty_points_redeemable)
+    Returns:
+        dict: {customer: (points earned, points redeemed)}
+    """
+    rows = frappe.db.sql(f"""
+        SELECT customer, SUM(points_earned), SUM(points_redeemed)
+        FROM `tab{LEDGER_DOCTYPE}`
+        WHERE service_request = %s
+        GROUP BY customer
+    """, (service_request,))
+    return {customer: (int(earned or 0), int(redeemed or 0)) for customer, earned, redeemed in rows}
+
+def lock_customer_totals(customer):
+    """
+    Lock a customer's row until the transaction ends and return its running totals,
+    so concurrent postings for one customer apply one after the other.
 
-    print(f"✅ Customer: {doc.customer} | Lifetime: {doc.lifetime_loyalty_points}, Total: {doc.total_loyalty_points}, Redeemable: {doc.total_loyalty_points_redeemable}")
+    Returns:
+        tuple: (balance, lifetime points)
+    """
+    row = frappe.db.sql("""
+        SELECT custom_loyalty_points_balance, custom_lifetime_loyalty_points
+        FROM `tabCustomer`
+        WHERE name = %s
+        FOR UPDATE
+    """, (customer,))
+    return (int(row[0][0] or 0), int(row[0][1] or 0)) if row else (0, 0)
+
+def post_loyalty_entries(doc, reverse=False):
+    """
+    Append ledger entries for the change in a Service Request's points since they
+    were last posted, and move the customer's balance by the same amount.
 
-    # ✅ Fetch all service requests (past & future) for correct customer balance
-    all_requests = frappe.get_all(
-        "Service Request",
-        filters={"customer": doc.customer, "status": "completed"},
-        fields=["loyalty_points_earned", "loyalty_points_redeemed"]
-    )
+    Only completed requests hold points in the ledger. The first posting adds an
+    Earn and/or a Redeem entry; later changes (edits, a status change, a changed
+    customer, `reverse` on delete) add Adjustment entries with the difference.
+    Cost depends only on this request's own entries, not the customer's history.
 
-    if not all_requests:
-        print(f"⚠️ No service requests found for {doc.customer}, skipping loyalty balance update.")
-        return
+    Returns:
+        tuple: The request customer's (balance, lifetime points) after posting
+    """
+    completed = (doc.status or "").lower() == "completed" and not reverse
+    target = {doc.customer: (
+        (doc.loyalty_points_earned or 0, doc.loyalty_points_redeemed or 0) if completed else (0, 0)
+    )}
+    posted = get_posted_points(doc.name)
+
+    totals = {}
+    # Lock customers in a fixed order so two postings cannot deadlock
+    for customer in sorted(set(target) | set(posted)):
+        balance, lifetime = lock_customer_totals(customer)
+        earned, redeemed = target.get(customer, (0, 0))
+        posted_earned, posted_redeemed = posted.get(customer, (0, 0))
+        entries = get_entries_for_change(customer in posted, earned - posted_earned, redeemed - posted_redeemed)
+
+        for entry_type, points_earned, points_redeemed in entries:
+            balance += points_earned - points_redeemed
+            lifetime += points_earned
+            frappe.get_doc({
+                "doctype": LEDGER_DOCTYPE,
+                "customer": customer,
+                "service_request": doc.name,
+                "entry_type": entry_type,
+                "posting_date": doc.completed_date or nowdate(),
+                "points_earned": points_earned,
+                "points_redeemed": points_redeemed,
+                "balance_after": balance,
+                "lifetime_after": lifetime,
+            }).insert(ignore_permissions=True)
+
+        if entries:
+            frappe.db.set_value("Customer", customer, {
+                "custom_loyalty_points_balance": balance,
+                "custom_lifetime_loyalty_points": lifetime,
+            })
+        totals[customer] = (balance, lifetime)
+
+    return totals[doc.customer]
+
+@depends_on("customer", "status", "completed_date", "services", "loyalty_points_redeemed")
+def update_loyalty_totals(doc, method):
+    """
+    Calculates loyalty points for a Service Request, posts them to the Loyalty Ledger
+    and updates the Customer's loyalty balance incrementally.
+    The loyalty message is rendered when it is next viewed or sent.
+    """
 
-    # ✅ Calculate total customer loyalty balance
-    customer_total_earned = sum(sr["loyalty_points_earned"] or 0 for sr in all_requests)
-    customer_total_redeemed = sum(sr["loyalty_points_redeemed"] or 0 for sr in all_requests)
-    customer_total_loyalty_points = customer_total_earned - customer_total_redeemed
+    frappe.logger().info(f"🔹 Running update_loyalty_totals for {doc.customer}, Service Request: {doc.name}")
 
-    print(f"🎯 Updating customer {doc.customer} balance to {customer_total_loyalty_points}")
-    frappe.logger().info(f"🎯 Customer {doc.customer} balance updated to {customer_total_loyalty_points}")
+    # Ensure all None values are converted to 0
+    doc.loyalty_points_redeemed = doc.loyalty_points_redeemed or 0
+    doc.loyalty_points_earned = calculate_points_earned(doc)
+
+    balance, lifetime = post_loyalty_entries(doc)
+    # The customer's totals just locked and posted, without this request's own
+    # points; a request that is not completed yet holds none in the ledger and
+    # shows what its totals will be once it is
+    if (doc.status or "").lower() == "completed":
+        earned_before = lifetime - doc.loyalty_points_earned
+        redeemed_before = lifetime - balance - doc.loyalty_points_redeemed
+    else:
+        earned_before, redeemed_before = lifetime, lifetime - balance
 
-    # ✅ Update customer loyalty balance
-    frappe.db.set_value("Customer", doc.customer, "custom_loyalty_points_balance", customer_total_loyalty_points)
-    
-    # ✅ Generate and save loyalty message **after** the calculations
-    generate_loyalty_message(doc.customer)
+    # ✅ Update the Service Request fields
+    totals = {
+        "loyalty_points_earned": doc.loyalty_points_earned,
+        **{fieldname: int(value) for fieldname, value in get_request_totals(
+            earned_before, redeemed_before, doc.loyalty_points_earned, doc.loyalty_points_redeemed
+        ).items()},
+    }
+    # Runs before save/submit, so the document write stores the fields
+    doc.update(totals)
+
+    frappe.logger().info(
+        f"🎯 Customer {doc.customer} | Lifetime: {totals['lifetime_loyalty_points']}, "
+        f"Balance: {totals['total_loyalty_points']}"
+    )
 
-    # ✅ Commit changes to ensure all updates are saved
-    frappe.db.commit()
-    print(f"📩 Loyalty message updated for Customer {doc.customer}")
+def reverse_loyalty_entries(doc, method):
+    """Service Request on_trash: take the request's points back out of the customer's balance."""
+    post_loyalty_entries(doc, reverse=True)
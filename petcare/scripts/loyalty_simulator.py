@@ -0,0 +1,213 @@
+"""
+Loyalty policy simulator.
+
+Loads every completed Service Request's item lines once into NumPy arrays and
+evaluates loyalty policies over the whole history in one vectorized pass per
+policy. Nothing is written: the report compares each policy with the
+current one (see loyalty.py) by points earned, liability, the distribution
+of balances and per-customer deltas.
+
+A policy is a dict; omitted keys keep the current rule:
+
+    {
+        "amount_per_point": 25,                  # Rs. spent per point
+        "excluded_items": ["TRAVEL_EXP", "TIP"], # items that earn nothing
+        "item_amount_per_point": {"Food": 50},   # per-item earn rates
+        "redemption_tiers": [                    # Rs. value of a point by balance
+            {"min_points": 0, "point_value": 1},
+            {"min_points": 500, "point_value": 1.2}
+        ]
+    }
+"""
+
+import json
+import frappe
+import numpy as np
+from typing import Dict, List, Optional
+from petcare.scripts.loyalty import AMOUNT_PER_POINT, NON_EARNING_ITEMS
+
+CURRENT_POLICY = {
+    "amount_per_point": AMOUNT_PER_POINT,
+    "excluded_items": NON_EARNING_ITEMS,
+    "item_amount_per_point": {},
+    "redemption_tiers": [{"min_points": 0, "point_value": 1}],  # 1 point = Rs. 1
+}
+
+DISTRIBUTION_QUANTILES = [0.5, 0.75, 0.9, 0.95, 0.99]
+TOP_DELTAS = 20
+
+
+def load_history() -> Dict:
+    """
+    Every completed Service Request's item lines and redemptions, as arrays.
+    Customers and item codes are stored as indexes into `customers` and `item_codes`.
+    """
+    lines = frappe.db.sql("""
+        SELECT sr.customer, sr.name AS service_request, item.item_code, COALESCE(item.amount, 0) AS amount
+        FROM `tabService Items Child Table` item
+        JOIN `tabService Request` sr ON sr.name = item.parent
+        WHERE item.parenttype = 'Service Request' AND sr.status = 'Completed' AND sr.customer IS NOT NULL
+    """)
+    redemptions = frappe.db.sql("""
+        SELECT customer, COALESCE(SUM(loyalty_points_redeemed), 0), COALESCE(SUM(loyalty_points_earned), 0)
+        FROM `tabService Request`
+        WHERE status = 'Completed' AND customer IS NOT NULL
+        GROUP BY customer
+    """)
+
+    customers = sorted({row[0] for row in lines} | {row[0] for row in redemptions})
+    customer_index = {customer: i for i, customer in enumerate(customers)}
+    item_codes = sorted({row[2] or "" for row in lines})
+    item_index = {item_code: i for i, item_code in enumerate(item_codes)}
+
+    redeemed = np.zeros(len(customers), dtype=np.int64)
+    recorded_earned = np.zeros(len(customers), dtype=np.int64)
+    for customer, points_redeemed, points_earned in redemptions:
+        redeemed[customer_index[customer]] = int(points_redeemed)
+        recorded_earned[customer_index[customer]] = int(points_earned)
+
+    return {
+        "customers": np.array(customers, dtype=object),
+        "item_codes": item_codes,
+        "line_customer": np.array([customer_index[row[0]] for row in lines], dtype=np.int64),
+        "line_item": np.array([item_index[row[2] or ""] for row in lines], dtype=np.int64),
+        "line_amount": np.array([float(row[3]) for row in lines], dtype=np.float64),
+        "redeemed": redeemed,
+        "recorded_earned": recorded_earned,
+        "service_requests": len({row[1] for row in lines}),
+    }
+
+
+def resolve_policy(policy: Optional[Dict]) -> Dict:
+    """A policy with the current rule filled in for every omitted key."""
+    resolved = {**CURRENT_POLICY, **(policy or {})}
+    if resolved["amount_per_point"] <= 0:
+        frappe.throw("amount_per_point must be greater than zero")
+    if any(rate <= 0 for rate in resolved["item_amount_per_point"].values()):
+        frappe.throw("Per-item amount_per_point values must be greater than zero")
+    resolved["redemption_tiers"] = sorted(resolved["redemption_tiers"], key=lambda tier: tier["min_points"])
+    return resolved
+
+
+def evaluate_policy(history: Dict, policy: Dict) -> Dict[str, np.ndarray]:
+    """
+    Points earned, balance and liability per customer under a resolved policy.
+
+    Each line earns int(amount / amount_per_point), as on save; balances keep
+    the points actually redeemed.
+    """
+    item_codes = history["item_codes"]
+    rates = np.full(len(item_codes), float(policy["amount_per_point"]))
+    for item_code, rate in policy["item_amount_per_point"].items():
+        if item_code in item_codes:
+            rates[item_codes.index(item_code)] = rate
+    rates[np.isin(item_codes, list(policy["excluded_items"]))] = np.inf
+
+    line_points = np.trunc(history["line_amount"] / rates[history["line_item"]])
+    earned = np.bincount(
+        history["line_customer"], weights=line_points, minlength=len(history["customers"])
+    ).astype(np.int64)
+    balance = earned - history["redeemed"]
+
+    thresholds = np.array([tier["min_points"] for tier in policy["redemption_tiers"]], dtype=np.float64)
+    values = np.array([tier["point_value"] for tier in policy["redemption_tiers"]], dtype=np.float64)
+    tier = np.searchsorted(thresholds, balance, side="right") - 1
+    point_value = np.where(tier >= 0, values[np.clip(tier, 0, None)], 0)
+    liability = np.maximum(balance, 0) * point_value
+
+    return {"earned": earned, "balance": balance, "liability": liability}
+
+
+def summarize(result: Dict[str, np.ndarray]) -> Dict:
+    """Totals and balance distribution of one evaluated policy."""
+    balance = result["balance"]
+    positive = balance[balance > 0]
+    return {
+        "points_earned": int(result["earned"].sum()),
+        "points_outstanding": int(np.maximum(balance, 0).sum()),
+        "liability": round(float(result["liability"].sum()), 2),
+        "customers_with_balance": int(len(positive)),
+        "customers_negative": int((balance < 0).sum()),
+        "balance_quantiles": {
+            str(q): float(np.quantile(positive, q)) if len(positive) else 0 for q in DISTRIBUTION_QUANTILES
+        },
+    }
+
+
+def compare(history: Dict, baseline: Dict[str, np.ndarray], result: Dict[str, np.ndarray]) -> Dict:
+    """Per-customer balance changes against the baseline policy."""
+    delta = result["balance"] - baseline["balance"]
+    order = np.argsort(delta)
+    changed = delta != 0
+
+    def rows(indexes):
+        return [
+            {
+                "customer": history["customers"][i],
+                "baseline_balance": int(baseline["balance"][i]),
+                "balance": int(result["balance"][i]),
+                "delta": int(delta[i]),
+            }
+            for i in indexes if delta[i]
+        ]
+
+    return {
+        "customers_changed": int(changed.sum()),
+        "customers_gaining": int((delta > 0).sum()),
+        "customers_losing": int((delta < 0).sum()),
+        "mean_delta": round(float(delta[changed].mean()), 2) if changed.any() else 0,
+        "liability_delta": round(float(result["liability"].sum() - baseline["liability"].sum()), 2),
+        "largest_gains": rows(order[::-1][:TOP_DELTAS]),
+        "largest_losses": rows(order[:TOP_DELTAS]),
+    }
+
+
+def run_simulation(history: Dict, policies: List[Dict]) -> Dict:
+    """
+    Evaluate policies over loaded history against the current policy.
+
+    Returns:
+        Dict: The current policy's summary, and per policy its summary and
+        comparison with the current policy
+    """
+    baseline = evaluate_policy(history, resolve_policy(None))
+    report = {
+        "customers": len(history["customers"]),
+        "service_requests": history["service_requests"],
+        "item_lines": len(history["line_amount"]),
+        "current": summarize(baseline),
+        # Points earned as recorded on the requests, to spot drift from the current rule
+        "recorded_points_earned": int(history["recorded_earned"].sum()),
+        "policies": [],
+    }
+    for policy in policies:
+        result = evaluate_policy(history, resolve_policy(policy))
+        report["policies"].append({
+            "policy": policy,
+            **summarize(result),
+            "comparison": compare(history, baseline, result),
+        })
+    return report
+
+
+@frappe.whitelist()
+def simulate_loyalty_policies(policies) -> Dict:
+    """
+    Evaluate one or more loyalty policies over the full history, without writing anything.
+
+    Args:
+        policies (list | dict | str): Policies, or their JSON
+
+    Returns:
+        Dict: See run_simulation
+    """
+    frappe.only_for(["System Manager", "Accounts Manager"])
+    if isinstance(policies, str):
+        policies = json.loads(policies)
+    if isinstance(policies, dict):
+        policies = [policies]
+    return run_simulation(load_history(), policies)
+
+# Usage Instructions:
+# bench --site <site> execute petcare.scripts.loyalty_simulator.simulate_loyalty_policies \
+#     --kwargs '{"policies": [{"amount_per_point": 25}, {"excluded_items": ["TRAVEL_EXP", "TIP"]}]}'
@@ -0,0 +1,264 @@
+"""
+Nightly customer pipeline.
+
+Replaces the separate nightly jobs (service details, tags, follow-up buckets,
+loyalty balance) with one staged run. The per-customer aggregates are loaded
+once and every later stage works from them, writing only the customers
+whose stored value differs. A named lock keeps runs from overlapping, each
+stage is retried on its own, and every run is recorded in a Customer
+Pipeline Run with per-stage timings and row counts.
+"""
+
+import time
+import frappe
+import numpy as np
+from datetime import date
+from typing import Callable, Dict, List, Optional
+from frappe.utils import now_datetime
+from petcare.scripts.customer_recompute import update_loyalty_balances
+from petcare.scripts.customer_tag_engine import CustomerTagEngine, LAST_RUN_KEY, LAST_PERCENTILES_KEY
+from petcare.scripts.customer_tag_rules import get_enabled_rules, compile_tag_rules, evaluate_tag_rules
+from petcare.scripts.followup_bucket import update_followup_buckets
+from petcare.scripts.spending_percentiles import rebuild_spending_snapshot
+from petcare.scripts.update_customer_tags import CustomerTagManager
+from petcare.utils.locks import named_lock, LockNotAcquiredError
+
+LOCK_NAME = "nightly_customer_pipeline"
+STAGE_ATTEMPTS = 3
+RETRY_DELAY_SECONDS = 10
+WRITE_CHUNK_SIZE = 1000
+# Tags are retagged in full on this weekday (Sunday); other nights only the
+# customers whose tags can have changed are retagged
+FULL_TAG_RUN_WEEKDAY = 6
+
+logger = frappe.logger("nightly_pipeline", allow_site=True, file_count=50)
+
+
+def write_changed(fieldname: str, customers: np.ndarray, values: List, stored: np.ndarray) -> int:
+    """
+    Set a Customer field for the customers whose stored value differs,
+    with one UPDATE per distinct value and chunk.
+
+    Returns:
+        int: Number of customers written
+    """
+    by_value = {}
+    for customer, value, current in zip(customers, values, stored):
+        if value != current:
+            by_value.setdefault(value, []).append(customer)
+
+    for value, names in by_value.items():
+        for start in range(0, len(names), WRITE_CHUNK_SIZE):
+            frappe.db.sql(f"""
+                UPDATE `tabCustomer` SET `{fieldname}` = %s WHERE name IN %s
+            """, (value, tuple(names[start:start + WRITE_CHUNK_SIZE])))
+    return sum(len(names) for names in by_value.values())
+
+
+class CustomerPipeline:
+    """
+    Stages, in order:
+    - load: per-customer aggregates in one query (the compiled tag-rule
+      query when Customer Tag Rules are enabled)
+    - service_details: latest completed service date and lead status
+    - tags: customer tags and next tag transition dates, incrementally
+      except on FULL_TAG_RUN_WEEKDAY or when no run has been recorded yet
+    - followup_buckets: follow-up bucket from the days since the last service,
+      one set-based UPDATE per chunk (see followup_bucket)
+    - loyalty_balance: loyalty balance and lifetime points from the ledger
+
+    Stages after load are independent, so one failing does not stop the others.
+    """
+
+    def __init__(self):
+        self.today = date.today()
+        self.tag_manager = CustomerTagManager()
+        self.engine = CustomerTagEngine(self.tag_manager)
+        self.shared: Optional[Dict] = None
+        self.rules: List[Dict] = []
+        self.compiled: Optional[Dict] = None
+        self.spending_percentiles: Optional[Dict] = None
+        self.run_log = None
+
+    def run_stage(self, name: str, stage: Callable[[], Dict]) -> bool:
+        """
+        Run one stage with retries and record it in the run log.
+        A stage returns {"rows_read": int, "rows_written": int}.
+
+        Returns:
+            bool: True if the stage completed
+        """
+        started = time.perf_counter()
+        error = None
+        result = {}
+        attempts = 0
+        for attempts in range(1, STAGE_ATTEMPTS + 1):
+            try:
+                result = stage() or {}
+                frappe.db.commit()
+                error = None
+                break
+            except Exception:
+                frappe.db.rollback()
+                error = frappe.get_traceback()
+                logger.warning(f"Stage {name} failed (attempt {attempts}/{STAGE_ATTEMPTS})")
+                if attempts < STAGE_ATTEMPTS:
+                    time.sleep(RETRY_DELAY_SECONDS)
+
+        duration = round(time.perf_counter() - started, 3)
+        self.run_log.append("stages", {
+            "stage": name,
+            "status": "Failed" if error else "Completed",
+            "attempts": attempts,
+            "duration_seconds": duration,
+            "rows_read": result.get("rows_read", 0),
+            "rows_written": result.get("rows_written", 0),
+            "error": error,
+        })
+        self.run_log.save(ignore_permissions=True)
+        frappe.db.commit()
+
+        if error:
+            frappe.log_error(error, f"Nightly customer pipeline: {name} failed")
+        logger.info(f"Stage {name}: {'failed' if error else 'completed'} in {duration}s, {result}")
+        return not error
+
+    def load(self) -> Dict:
+        """Load every customer's aggregates once for all later stages."""
+        self.rules = get_enabled_rules()
+        if self.rules:
+            # Rule thresholds are bound into the query, so percentiles come first
+            self.spending_percentiles = rebuild_spending_snapshot()
+            self.compiled = compile_tag_rules(
+                self.rules, self.today, self.spending_percentiles, include_shared=True
+            )
+            self.shared = evaluate_tag_rules(self.compiled)
+        else:
+            self.shared = self.engine.load_aggregates(include_shared=True)
+        return {"rows_read": len(self.shared["customer"])}
+
+    def service_details(self) -> Dict:
+        """Latest completed service date and lead status."""
+        customers = self.shared["customer"]
+        lead_statuses = ["Converted" if count else "New Lead" for count in self.shared["completed_count"]]
+        written = write_changed(
+            "custom_latest_completed_service_date", customers,
+            list(self.shared["latest_completed"]), self.shared["stored_latest_completed"]
+        )
+        written += write_changed("custom_lead_status", customers, lead_statuses, self.shared["stored_lead_status"])
+        return {"rows_read": len(customers), "rows_written": written}
+
+    def tags(self) -> Dict:
+        """
+        Tags written only where they changed. Most nights only dirty customers,
+        customers whose transition date has arrived and customers around a
+        moved spending threshold are retagged (see run_incremental); the
+        weekly full run from the shared aggregates catches anything missed.
+        """
+        if self.today.weekday() != FULL_TAG_RUN_WEEKDAY and frappe.db.get_global(LAST_RUN_KEY):
+            report = self.engine.run_incremental(commit=False)
+            return {
+                "rows_read": report["customers"],
+                "rows_written": report.get("rows_inserted", 0) + report.get("rows_deleted", 0),
+            }
+
+        started_at = now_datetime()
+        if self.rules:
+            report = self.engine.run_rules(
+                self.rules, spending_percentiles=self.spending_percentiles, commit=False,
+                compiled=self.compiled, evaluated=self.shared
+            )
+        else:
+            report = self.engine.run(aggregates=self.shared, commit=False)
+
+        # A full run is the baseline for the following incremental runs
+        frappe.db.set_global(LAST_RUN_KEY, str(started_at))
+        frappe.db.set_global(LAST_PERCENTILES_KEY, frappe.as_json(report["spending_percentiles"]))
+        return {
+            "rows_read": report["customers"],
+            "rows_written": report.get("rows_inserted", 0) + report.get("rows_deleted", 0),
+        }
+
+    def followup_buckets(self) -> Dict:
+        """
+        Follow-up bucket from the days since the latest completed service.
+        Runs after service_details, from the Customer table alone.
+        """
+        counts = update_followup_buckets()
+        return {"rows_read": len(self.shared["customer"]), "rows_written": sum(counts.values())}
+
+    def loyalty_balance(self) -> Dict:
+        """
+        Loyalty balance and lifetime points from the loyalty ledger, the same
+        way as after a Service Request save (see customer_recompute).
+        Only repairs drift; postings keep the totals in step.
+        """
+        written = update_loyalty_balances()
+        return {"rows_read": len(self.shared["customer"]), "rows_written": written}
+
+    def run(self) -> Dict:
+        """
+        Run every stage under the pipeline lock.
+
+        Returns:
+            Dict: Run log name, status and per-stage results
+        """
+        started = time.perf_counter()
+        self.run_log = frappe.get_doc({
+            "doctype": "Customer Pipeline Run",
+            "status": "Running",
+            "started_on": now_datetime(),
+        }).insert(ignore_permissions=True)
+        frappe.db.commit()
+
+        try:
+            with named_lock(LOCK_NAME):
+                if not self.run_stage("load", self.load):
+                    status = "Failed"
+                else:
+                    results = [
+                        self.run_stage("service_details", self.service_details),
+                        self.run_stage("tags", self.tags),
+                        self.run_stage("followup_buckets", self.followup_buckets),
+                        self.run_stage("loyalty_balance", self.loyalty_balance),
+                    ]
+                    status = "Completed" if all(results) else (
+                        "Partially Completed" if any(results) else "Failed"
+                    )
+        except LockNotAcquiredError as e:
+            status = "Skipped"
+            self.run_log.error = str(e)
+
+        self.run_log.status = status
+        self.run_log.customers = len(self.shared["customer"]) if self.shared else 0
+        self.run_log.finished_on = now_datetime()
+        self.run_log.duration_seconds = round(time.perf_counter() - started, 3)
+        self.run_log.save(ignore_permissions=True)
+        frappe.db.commit()
+
+        summary = {
+            "run": self.run_log.name,
+            "status": status,
+            "duration_seconds": self.run_log.duration_seconds,
+            "stages": {
+                stage.stage: {
+                    "status": stage.status,
+                    "seconds": stage.duration_seconds,
+                    "rows_written": stage.rows_written,
+                }
+                for stage in self.run_log.stages
+            },
+        }
+        logger.info(f"Nightly customer pipeline: {summary}")
+        return summary
+
+
+def run_nightly_pipeline():
+    """
+    Scheduler entry point for the nightly customer pipeline.
+    """
+    return CustomerPipeline().run()
+
+# Usage Instructions:
+# To run the pipeline from bench:
+# bench --site <site> execute petcare.scripts.nightly_pipeline.run_nightly_pipeline
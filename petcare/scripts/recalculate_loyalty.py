@@ -1,63 +1,260 @@
 import frappe
-from petcare.scripts.loyalty import update_loyalty_totals
+import numpy as np
+from frappe.utils import now_datetime, nowdate
+from petcare.scripts.loyalty import LEDGER_DOCTYPE, get_item_points, get_entries_for_change, get_request_totals
 
-@frappe.whitelist()
-def recalculate_loyalty_for_customer(customer_id):
+CUSTOMERS_PER_JOB = 500
+WRITE_CHUNK_SIZE = 1000
+
+PROGRESS_KEY = "loyalty_recalculation_progress"
+PROGRESS_DONE_KEY = "loyalty_recalculation_done"
+
+TOTAL_FIELDS = ["loyalty_points_earned", "lifetime_loyalty_points",
+                "total_loyalty_points", "total_loyalty_points_redeemable"]
+
+logger = frappe.logger("loyalty_recalculation", allow_site=True)
+
+def compute_loyalty_totals(earned, redeemed):
     """
-    Recalculates loyalty points for all completed Service Requests of a specific customer
-    and updates their total loyalty balance.
+    Running loyalty totals of one customer's completed requests, in completion
+    order (completed date, creation, name).
+
+    A request's totals include every request before it plus itself, what
+    saving the requests in that order gives (see get_request_totals).
+
+    Args:
+        earned (np.ndarray): Points earned per request
+        redeemed (np.ndarray): Points redeemed per request
+
+    Returns:
+        dict: lifetime_loyalty_points, total_loyalty_points and total_loyalty_points_redeemable arrays
     """
+    # Exclusive prefix sums: the points of every earlier request
+    return get_request_totals(np.cumsum(earned) - earned, np.cumsum(redeemed) - redeemed, earned, redeemed)
 
-    print(f"🔄 Recalculating loyalty points for Customer: {customer_id}")
+def update_by_name(doctype, fieldnames, rows):
+    """
+    Write several fields of many documents with one CASE UPDATE per chunk.
 
-    # Fetch all completed service requests for the customer
-    service_requests = frappe.get_all(
-        "Service Request",
-        filters={"customer": customer_id, "status": "completed"},
-        fields=["name"],
-        order_by="completed_date asc"
-    )
+    Args:
+        rows (list): (name, value for each fieldname) tuples
+    """
+    for start in range(0, len(rows), WRITE_CHUNK_SIZE):
+        chunk = rows[start:start + WRITE_CHUNK_SIZE]
+        case = " ".join(["WHEN %s THEN %s"] * len(chunk))
+        assignments = ", ".join(f"`{fieldname}` = CASE name {case} END" for fieldname in fieldnames)
+        values = [value for position in range(1, len(fieldnames) + 1)
+                  for row in chunk for value in (row[0], row[position])]
+        frappe.db.sql(f"""
+            UPDATE `tab{doctype}` SET {assignments} WHERE name IN %s
+        """, values + [tuple(row[0] for row in chunk)])
 
-    if not service_requests:
-        print(f"⚠️ No completed service requests found for Customer {customer_id}")
-        return
+def recalculate_loyalty_for_customers(customers):
+    """
+    Recalculate the loyalty points of every completed Service Request of the given
+    customers in one pass: three reads for the whole batch, running totals from
+    prefix sums, and bulk writes of only the values that changed.
+
+    The ledger stays append-only: requests whose posted points differ get an
+    Adjustment entry, and the customer balance is set from the ledger.
+
+    Returns:
+        dict: Counts of customers, requests and rows written
+    """
+    customers = sorted(set(customers))
+    report = {"customers": len(customers), "requests": 0, "requests_updated": 0, "ledger_entries": 0}
+    if not customers:
+        return report
+
+    # Hold the customers' rows so saves in the meantime wait for the rebuild
+    frappe.db.sql("""
+        SELECT name FROM `tabCustomer` WHERE name IN %s ORDER BY name FOR UPDATE
+    """, (tuple(customers),))
+
+    requests = frappe.db.sql("""
+        SELECT name, customer, completed_date, COALESCE(loyalty_points_redeemed, 0) AS loyalty_points_redeemed,
+            loyalty_points_earned, lifetime_loyalty_points, total_loyalty_points, total_loyalty_points_redeemable
+        FROM `tabService Request`
+        WHERE customer IN %s AND status = 'Completed'
+        ORDER BY customer, completed_date, creation, name
+    """, (tuple(customers),), as_dict=True)
+
+    points_earned = {}
+    for parent, item_code, amount in frappe.db.sql("""
+        SELECT item.parent, item.item_code, item.amount
+        FROM `tabService Items Child Table` item
+        JOIN `tabService Request` sr ON sr.name = item.parent
+        WHERE item.parenttype = 'Service Request' AND sr.customer IN %s AND sr.status = 'Completed'
+    """, (tuple(customers),)):
+        points_earned[parent] = points_earned.get(parent, 0) + get_item_points(item_code, amount)
+
+    # {customer: {service_request: (earned, redeemed)}} as posted in the ledger
+    posted = {}
+    ledger_totals = {}
+    for customer, service_request, earned, redeemed in frappe.db.sql(f"""
+        SELECT customer, service_request, SUM(points_earned), SUM(points_redeemed)
+        FROM `tab{LEDGER_DOCTYPE}`
+        WHERE customer IN %s
+        GROUP BY customer, service_request
+    """, (tuple(customers),)):
+        posted.setdefault(customer, {})[service_request] = (int(earned or 0), int(redeemed or 0))
+        balance, lifetime = ledger_totals.get(customer, (0, 0))
+        ledger_totals[customer] = (balance + int(earned or 0) - int(redeemed or 0), lifetime + int(earned or 0))
+
+    by_customer = {}
+    for sr in requests:
+        by_customer.setdefault(sr.customer, []).append(sr)
 
-    # Process each Service Request in order
-    for sr in service_requests:
-        print(f"🔹 Processing Service Request: {sr['name']}")
-        sr_doc = frappe.get_doc("Service Request", sr["name"])
+    request_updates = []
+    ledger_rows = []
+    customer_totals = []
+    now = now_datetime()
+    user = frappe.session.user
+    for customer in customers:
+        rows = by_customer.get(customer, [])
+        earned = np.array([points_earned.get(sr.name, 0) for sr in rows], dtype=np.int64)
+        redeemed = np.array([int(sr.loyalty_points_redeemed) for sr in rows], dtype=np.int64)
+        totals = compute_loyalty_totals(earned, redeemed)
+
+        for i, sr in enumerate(rows):
+            values = (int(earned[i]),) + tuple(int(totals[fieldname][i]) for fieldname in TOTAL_FIELDS[1:])
+            if values != tuple(int(sr[fieldname] or 0) for fieldname in TOTAL_FIELDS):
+                request_updates.append((sr.name,) + values)
 
-        # Run the update_loyalty_totals function on each service request
-        update_loyalty_totals(sr_doc, "validate")
+        # Bring the ledger in line with the recalculated points, request by request
+        balance, lifetime = ledger_totals.get(customer, (0, 0))
+        customer_posted = posted.get(customer, {})
+        targets = {sr.name: (int(earned[i]), int(redeemed[i]), sr.completed_date) for i, sr in enumerate(rows)}
+        for service_request in customer_posted:
+            if service_request not in targets:
+                # Posted for a request that is no longer completed for this customer
+                targets[service_request] = (0, 0, None)
+        for service_request, (target_earned, target_redeemed, posting_date) in targets.items():
+            posted_earned, posted_redeemed = customer_posted.get(service_request, (0, 0))
+            for entry_type, entry_earned, entry_redeemed in get_entries_for_change(
+                service_request in customer_posted, target_earned - posted_earned, target_redeemed - posted_redeemed
+            ):
+                balance += entry_earned - entry_redeemed
+                lifetime += entry_earned
+                ledger_rows.append((
+                    frappe.generate_hash(length=10), customer, service_request, entry_type,
+                    posting_date or nowdate(), entry_earned, entry_redeemed, balance, lifetime,
+                    now, now, user, user, 0
+                ))
+        customer_totals.append((customer, balance, lifetime))
+        report["requests"] += len(rows)
 
-        # ✅ Instead of .save(), use db_update() to avoid TimestampMismatchError
-        sr_doc.db_update()
+    update_by_name("Service Request", TOTAL_FIELDS, request_updates)
+    if ledger_rows:
+        frappe.db.bulk_insert(LEDGER_DOCTYPE, [
+            "name", "customer", "service_request", "entry_type", "posting_date", "points_earned",
+            "points_redeemed", "balance_after", "lifetime_after", "creation", "modified", "owner",
+            "modified_by", "docstatus"
+        ], ledger_rows, chunk_size=WRITE_CHUNK_SIZE)
+    update_by_name("Customer", ["custom_loyalty_points_balance", "custom_lifetime_loyalty_points"], customer_totals)
 
-    # ✅ Commit all changes to ensure they are saved
+    report["requests_updated"] = len(request_updates)
+    report["ledger_entries"] = len(ledger_rows)
+    return report
+
+@frappe.whitelist()
+def recalculate_loyalty_for_customer(customer_id):
+    """
+    Recalculates loyalty points for all completed Service Requests of a specific customer
+    and updates their total loyalty balance.
+    """
+
+    print(f"🔄 Recalculating loyalty points for Customer: {customer_id}")
+
+    report = recalculate_loyalty_for_customers([customer_id])
     frappe.db.commit()
 
-    print(f"✅ Loyalty recalculation completed for Customer: {customer_id}")
+    if not report["requests"]:
+        print(f"⚠️ No completed service requests found for Customer {customer_id}")
+    print(f"✅ Loyalty recalculation completed for Customer: {customer_id} ({report})")
+    return report
 
 @frappe.whitelist()
-def recalculate_loyalty_for_all_customers():
+def recalculate_loyalty_for_all_customers(customers_per_job=CUSTOMERS_PER_JOB):
     """
-    Runs `recalculate_loyalty_for_customer` for all customers who have at least one completed service request.
+    Queues the recalculation of every customer with a completed service request,
+    split into partitions of customers that background workers process in parallel.
+    Progress is published as each partition finishes; see get_loyalty_recalculation_progress.
     """
 
     print("🔄 Starting loyalty recalculation for all customers...")
 
     # Fetch distinct customer IDs who have at least one completed service request
-    customers = frappe.get_all(
-        "Service Request",
-        filters={"status": "completed"},
-        fields=["distinct customer"]
-    )
+    customers = frappe.db.sql_list("""
+        SELECT DISTINCT customer FROM `tabService Request`
+        WHERE status = 'Completed' AND customer IS NOT NULL
+        ORDER BY customer
+    """)
 
     if not customers:
         print("⚠️ No customers found with completed service requests.")
         return
 
-    for customer in customers:
-        recalculate_loyalty_for_customer(customer["customer"])
+    customers_per_job = frappe.utils.cint(customers_per_job) or CUSTOMERS_PER_JOB
+    partitions = [customers[start:start + customers_per_job] for start in range(0, len(customers), customers_per_job)]
+
+    # Jobs of an earlier run may still be queued; the run id keeps their job
+    # ids and progress apart from this run's
+    run_id = frappe.generate_hash(length=8)
+    frappe.cache().set_value(PROGRESS_KEY, {
+        "run_id": run_id,
+        "customers": len(customers),
+        "jobs": len(partitions),
+        "started_on": str(now_datetime()),
+    })
+    frappe.cache().delete_value(PROGRESS_DONE_KEY)
+
+    for index, partition in enumerate(partitions):
+        frappe.enqueue(
+            "petcare.scripts.recalculate_loyalty.recalculate_loyalty_partition",
+            queue="long",
+            job_id=f"recalculate_loyalty::{run_id}::{index}",
+            deduplicate=True,
+            customers=partition,
+            user=frappe.session.user,
+            run_id=run_id
+        )
+
+    print(f"✅ Queued loyalty recalculation of {len(customers)} customers in {len(partitions)} jobs.")
+    return {"customers": len(customers), "jobs": len(partitions)}
 
-    print("✅ Loyalty recalculation completed for all customers.")
+def recalculate_loyalty_partition(customers, user=None, run_id=None):
+    """
+    Background job: recalculate one partition of customers, then record and
+    publish the overall progress, unless a newer run has started since.
+    """
+    report = recalculate_loyalty_for_customers(customers)
+    frappe.db.commit()
+
+    cache = frappe.cache()
+    if (cache.get_value(PROGRESS_KEY) or {}).get("run_id") != run_id:
+        logger.info(f"Loyalty recalculation of an earlier run: {report}")
+        return report
+    cache.incrby(cache.make_key(PROGRESS_DONE_KEY), len(customers))
+    progress = get_loyalty_recalculation_progress()
+    logger.info(f"Loyalty recalculation: {report}, progress {progress}")
+    frappe.publish_realtime(PROGRESS_KEY, progress, user=user)
+    return report
+
+@frappe.whitelist()
+def get_loyalty_recalculation_progress():
+    """
+    Progress of the last full loyalty recalculation.
+
+    Returns:
+        dict: Customers done out of the total, and the percentage
+    """
+    cache = frappe.cache()
+    progress = cache.get_value(PROGRESS_KEY) or {}
+    done = frappe.utils.cint(cache.get(cache.make_key(PROGRESS_DONE_KEY)))
+    total = progress.get("customers", 0)
+    return {
+        **progress,
+        "done": done,
+        "percent": round(done * 100 / total, 1) if total else 0,
+    }
@@ -3,36 +3,21 @@ This file contains scheduler events for PetCare.
 """
 
 import frappe
-from frappe.utils import now_datetime
-from petcare.scripts.update_customer_service_details import update_customer_service_details
-from petcare.scripts.update_customer_tags import CustomerTagManager
+from petcare.scripts.nightly_pipeline import run_nightly_pipeline
 
 def daily_customer_service_update():
     """
-    Daily scheduled task to update customer service details and tags.
-    Runs at 11:20 PM IST (17:50 UTC) every day.
+    Daily customer service update: service details, tags, follow-up buckets
+    and loyalty balance. Kept for existing callers; the nightly pipeline is
+    scheduled in hooks.py.
     """
     try:
-        # Update service details
-        update_customer_service_details()
-        
-        # Update tags
-        tag_manager = CustomerTagManager()
-        tag_manager.process_all_customers()
+        summary = run_nightly_pipeline()
         
         # Log success
-        frappe.logger().info("Daily customer service update completed successfully")
+        frappe.logger().info(f"Daily customer service update finished: {summary['status']}")
         
     except Exception as e:
         # Log error
         frappe.logger().error(f"Error in daily customer service update: {str(e)}")
         frappe.log_error(f"Daily customer service update failed: {str(e)}")
-
-# Scheduler configuration
-scheduler_events = {
-    "cron": {
-        "50 17 * * *": [  # Run at 11:20 PM IST (17:50 UTC) every day
-            "petcare.petcare.scheduler_events.daily_customer_service_update"
-        ]
-    }
-} 
\ No newline at end of file
@@ -1,32 +1,18 @@
-import frappe
-from datetime import date
+from petcare.scripts.customer_recompute import mark_customer_dirty
+from petcare.utils.hook_gating import depends_on
 
-def update_latest_completed_service(doc, method):
-    """Updates the latest completed service date and days since last service in the Customer doctype whenever a Service Request is completed."""
-    
-    if doc.status == "Completed" and doc.completed_date:
-        latest_date = frappe.db.sql("""
-            SELECT MAX(completed_date) 
-            FROM `tabService Request`
-            WHERE customer = %s AND status = 'Completed'
-        """, (doc.customer,))[0][0]
+# Fields feeding latest completed service, lead status, loyalty balance and tags
+CUSTOMER_FIELDS = ("customer", "status", "completed_date", "amount_after_discount",
+                   "loyalty_points_redeemed", "services")
 
-        days_since_last_service = 0  # Default to 0 to prevent IntegrityError
+@depends_on(*CUSTOMER_FIELDS)
+def mark_customer_for_recompute(doc, method):
+    """Marks the Service Request's customer (and the previous one, if it changed) for recomputation
+    of latest completed service, lead status, loyalty balance and tags once the save commits.
+    Days since last service is derived from the latest completed service date when read."""
 
-        if latest_date:
-            today = date.today()
-            latest_service_date = latest_date if isinstance(latest_date, date) else latest_date.date()
-            days_since_last_service = (today - latest_service_date).days
+    mark_customer_dirty(doc.customer)
 
-            frappe.db.set_value("Customer", doc.customer, "custom_latest_completed_service_date", latest_service_date)
-        
-        # Always update days since last service
-        frappe.db.set_value("Customer", doc.customer, "custom_days_since_last_service", days_since_last_service)
-        
-        # Check if the customer has any service request
-        service_request_exists = frappe.db.exists("Service Request", {"customer": doc.customer})
-
-        if service_request_exists:
-            frappe.db.set_value("Customer", doc.customer, "custom_lead_status", "Converted")
-
-        frappe.db.commit()
+    doc_before_save = doc.get_doc_before_save()
+    if doc_before_save and doc_before_save.customer != doc.customer:
+        mark_customer_dirty(doc_before_save.customer)
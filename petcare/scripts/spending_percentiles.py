@@ -0,0 +1,182 @@
+"""
+Persisted spending percentiles for customer tagging.
+
+The Spending Percentile Snapshot keeps a quantile sketch of every customer's
+total completed spend. The sketch is rebuilt by the full tag run and kept
+current in between by swapping a customer's old total for the new one
+whenever a Service Request's completed amount changes, so single-customer
+tagging reads the thresholds instead of aggregating every Service Request.
+"""
+
+import frappe
+from typing import Dict, Iterable, List, Optional, Tuple
+from frappe.utils import flt, now_datetime
+from petcare.utils.quantile_sketch import QuantileSketch, DEFAULT_RELATIVE_ACCURACY
+from petcare.utils.hook_gating import depends_on
+
+SNAPSHOT_DOCTYPE = "Spending Percentile Snapshot"
+DEFAULT_QUANTILES = (0.5, 0.75, 0.9, 0.95)
+
+
+def parse_quantiles(value: Optional[str]) -> List[float]:
+    """Parse the comma separated quantiles setting, ignoring invalid entries."""
+    quantiles = set()
+    for part in (value or "").split(","):
+        try:
+            q = float(part)
+        except ValueError:
+            continue
+        if 0 <= q <= 1:
+            quantiles.add(q)
+    return sorted(quantiles or DEFAULT_QUANTILES)
+
+
+def summarize(sketch: QuantileSketch, quantiles: List[float]) -> Dict:
+    """Snapshot field values for a sketch."""
+    return {
+        "median": flt(sketch.quantile(0.5), 2),
+        "percentile_90": flt(sketch.quantile(0.9), 2),
+        "quantile_values": frappe.as_json({str(q): flt(sketch.quantile(q), 2) for q in quantiles}),
+        "customer_count": sketch.count,
+        "sketch": frappe.as_json(sketch.to_dict(), indent=None),
+        "updated_on": now_datetime(),
+    }
+
+
+def load_customer_totals() -> List[float]:
+    """Total completed spend of every customer with at least one paid service."""
+    return frappe.db.sql_list("""
+        SELECT SUM(amount_after_discount)
+        FROM `tabService Request`
+        WHERE status = 'Completed' AND amount_after_discount > 0
+        GROUP BY customer
+    """)
+
+
+def rebuild_spending_snapshot(totals: Optional[Iterable[float]] = None) -> Dict:
+    """
+    Rebuild the sketch from scratch.
+
+    Args:
+        totals (iterable, optional): Per-customer totals already loaded by the
+            caller; queried from Service Requests when omitted
+
+    Returns:
+        Dict: The stored median and 90th percentile
+    """
+    settings = frappe.db.get_singles_dict(SNAPSHOT_DOCTYPE)
+    sketch = QuantileSketch(flt(settings.get("relative_accuracy")) or DEFAULT_RELATIVE_ACCURACY)
+    for total in (load_customer_totals() if totals is None else totals):
+        if flt(total) > 0:
+            sketch.add(flt(total))
+
+    values = summarize(sketch, parse_quantiles(settings.get("quantiles")))
+    values["rebuilt_on"] = values["updated_on"]
+    frappe.db.set_single_value(SNAPSHOT_DOCTYPE, values)
+    return {"median": values["median"], "percentile_90": values["percentile_90"]}
+
+
+def get_spending_percentiles() -> Dict:
+    """
+    Median and 90th percentile of customer spend from the snapshot.
+    Builds the snapshot the first time it is needed.
+
+    Returns:
+        Dict: {"median": float, "percentile_90": float}
+    """
+    snapshot = frappe.db.get_singles_dict(SNAPSHOT_DOCTYPE)
+    if not snapshot.get("rebuilt_on"):
+        return rebuild_spending_snapshot()
+    return {
+        "median": flt(snapshot.get("median")),
+        "percentile_90": flt(snapshot.get("percentile_90")),
+    }
+
+
+def get_spending_quantile(q: float) -> float:
+    """
+    Any quantile (0..1) of customer spend, read from the stored sketch.
+    Builds the snapshot the first time it is needed.
+    """
+    stored = frappe.db.get_single_value(SNAPSHOT_DOCTYPE, "sketch")
+    if not stored:
+        rebuild_spending_snapshot()
+        stored = frappe.db.get_single_value(SNAPSHOT_DOCTYPE, "sketch")
+    return flt(QuantileSketch.from_dict(frappe.parse_json(stored)).quantile(q), 2)
+
+
+def apply_spending_changes(changes: List[Tuple[float, float]]) -> None:
+    """
+    Replace customers' old totals with their new ones in the stored sketch.
+
+    The sketch row is locked for the rest of the transaction so concurrent
+    completions cannot overwrite each other's update.
+
+    Args:
+        changes (list): (old_total, new_total) pairs; 0 means "not counted"
+    """
+    stored = frappe.db.sql("""
+        SELECT value FROM `tabSingles`
+        WHERE doctype = %s AND field = 'sketch'
+        FOR UPDATE
+    """, SNAPSHOT_DOCTYPE)
+    if not stored or not stored[0][0]:
+        # Never built: the first reader builds it from the committed totals
+        return
+
+    sketch = QuantileSketch.from_dict(frappe.parse_json(stored[0][0]))
+    for old_total, new_total in changes:
+        if flt(old_total) > 0:
+            sketch.remove(flt(old_total))
+        if flt(new_total) > 0:
+            sketch.add(flt(new_total))
+
+    quantiles = parse_quantiles(frappe.db.get_single_value(SNAPSHOT_DOCTYPE, "quantiles"))
+    frappe.db.set_single_value(SNAPSHOT_DOCTYPE, summarize(sketch, quantiles))
+
+
+def get_paid_amount(doc) -> float:
+    """Amount a Service Request contributes to its customer's total spend."""
+    if doc and doc.status == "Completed" and flt(doc.amount_after_discount) > 0:
+        return flt(doc.amount_after_discount)
+    return 0
+
+
+@depends_on("customer", "status", "amount_after_discount")
+def update_spending_snapshot(doc, method):
+    """
+    Service Request on_update hook: keep the spending sketch in step with the
+    customer's total when the request's completed amount changes.
+    """
+    before = doc.get_doc_before_save()
+    old_amount = get_paid_amount(before)
+    new_amount = get_paid_amount(doc)
+    old_customer = before.customer if before else doc.customer
+    if old_amount == new_amount and old_customer == doc.customer:
+        return
+
+    customers = tuple({old_customer, doc.customer} - {None}) or ("",)
+    totals = dict(frappe.db.sql("""
+        SELECT customer, SUM(amount_after_discount)
+        FROM `tabService Request`
+        WHERE customer IN %s AND status = 'Completed' AND amount_after_discount > 0
+        GROUP BY customer
+    """, [customers]))
+
+    if old_customer == doc.customer:
+        new_total = flt(totals.get(doc.customer))
+        changes = [(new_total - new_amount + old_amount, new_total)]
+    else:
+        # Request moved to another customer: both totals change
+        old_customer_total = flt(totals.get(old_customer))
+        new_customer_total = flt(totals.get(doc.customer))
+        changes = [
+            (old_customer_total + old_amount, old_customer_total),
+            (new_customer_total - new_amount, new_customer_total),
+        ]
+
+    try:
+        apply_spending_changes(changes)
+    except Exception as e:
+        # The nightly rebuild corrects any drift, so never block the save
+        frappe.log_error(f"Error updating spending snapshot for {doc.name}: {str(e)}")
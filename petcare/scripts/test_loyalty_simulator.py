@@ -0,0 +1,47 @@
+# Copyright (c) 2026, sj and Contributors
+# See license.txt
+
+import numpy as np
+from frappe.tests.utils import FrappeTestCase
+from petcare.scripts.loyalty import get_item_points
+from petcare.scripts.loyalty_simulator import evaluate_policy, resolve_policy, run_simulation
+
+
+def make_history():
+	# Customer 0: two grooming lines and a tip; customer 1: one grooming line
+	return {
+		"customers": np.array(["CUST-A", "CUST-B"], dtype=object),
+		"item_codes": ["GROOM", "TIP"],
+		"line_customer": np.array([0, 0, 0, 1]),
+		"line_item": np.array([0, 0, 1, 0]),
+		"line_amount": np.array([1100.0, 550.0, 200.0, 82.5]),
+		"redeemed": np.array([20, 0]),
+		"recorded_earned": np.array([60, 3]),
+		"service_requests": 3,
+	}
+
+
+class TestLoyaltySimulator(FrappeTestCase):
+	def test_current_policy_matches_save_rule(self):
+		history = make_history()
+		result = evaluate_policy(history, resolve_policy(None))
+		expected = [
+			sum(get_item_points(history["item_codes"][item], amount)
+				for customer, item, amount in zip(history["line_customer"], history["line_item"], history["line_amount"])
+				if customer == index)
+			for index in range(2)
+		]
+		self.assertEqual(result["earned"].tolist(), expected)
+		self.assertEqual(result["balance"].tolist(), [expected[0] - 20, expected[1]])
+
+	def test_policy_changes_and_tiers(self):
+		report = run_simulation(make_history(), [{
+			"amount_per_point": 55,
+			"excluded_items": [],
+			"redemption_tiers": [{"min_points": 0, "point_value": 1}, {"min_points": 20, "point_value": 2}],
+		}])
+		policy = report["policies"][0]
+		# 20 + 10 + 3 (tip) - 20 redeemed = 13 for A, 1 for B
+		self.assertEqual(policy["points_outstanding"], 14)
+		self.assertEqual(policy["liability"], 14)
+		self.assertEqual(policy["comparison"]["customers_losing"], 2)
@@ -0,0 +1,33 @@
+# Copyright (c) 2026, sj and Contributors
+# See license.txt
+
+import numpy as np
+from frappe.tests.utils import FrappeTestCase
+from petcare.scripts.loyalty import get_request_totals
+from petcare.scripts.recalculate_loyalty import compute_loyalty_totals
+
+
+class TestRecalculateLoyalty(FrappeTestCase):
+	def test_rebuild_matches_save(self):
+		# Two requests on the same date, then a redemption
+		earned = np.array([10, 5, 8])
+		redeemed = np.array([0, 0, 12])
+		totals = compute_loyalty_totals(earned, redeemed)
+		self.assertEqual(totals["lifetime_loyalty_points"].tolist(), [10, 15, 23])
+		self.assertEqual(totals["total_loyalty_points"].tolist(), [10, 15, 11])
+		self.assertEqual(totals["total_loyalty_points_redeemable"].tolist(), [0, 10, 3])
+
+		# Saved in completion order, each request's customer totals before it
+		# are the sums of the requests ordered before it
+		rng = np.random.default_rng(3)
+		earned = rng.integers(0, 40, 50)
+		redeemed = rng.integers(0, 20, 50)
+		totals = compute_loyalty_totals(earned, redeemed)
+		for i in range(len(earned)):
+			on_save = get_request_totals(
+				int(earned[:i].sum()), int(redeemed[:i].sum()), int(earned[i]), int(redeemed[i])
+			)
+			self.assertEqual(
+				{fieldname: int(value) for fieldname, value in on_save.items()},
+				{fieldname: int(values[i]) for fieldname, values in totals.items()}
+			)
@@ -0,0 +1,43 @@
+# Copyright (c) 2026, sj and Contributors
+# See license.txt
+
+from frappe.tests.utils import FrappeTestCase
+from petcare.scripts.voxbay_load_test import compare_with_baseline, generate_payloads, summarize
+
+
+class TestVoxbayLoadTest(FrappeTestCase):
+	def test_generated_corpus(self):
+		payloads = generate_payloads(400, ["+919847000001"], seed=7, run_id="t")
+		self.assertEqual(payloads, generate_payloads(400, ["+919847000001"], seed=7, run_id="t"))
+
+		kinds = {payload["_kind"] for payload in payloads}
+		self.assertEqual(kinds, {"known", "unknown", "duplicate", "malformed"})
+		originals = {payload["call_id"] for payload in payloads if payload["_kind"] in ("known", "unknown")}
+		for payload in payloads:
+			if payload["_kind"] == "duplicate":
+				self.assertIn(payload["call_id"], originals)
+			if payload["_kind"] == "malformed":
+				self.assertTrue(
+					not all(payload.get(field) for field in ("caller_number", "start_time", "call_status"))
+					or payload["call_type"] == "transfer" or payload["start_time"] == "yesterday-ish"
+				)
+
+		# Without known numbers every valid call is from an unknown number
+		self.assertNotIn("known", {payload["_kind"] for payload in generate_payloads(50, [], seed=1)})
+
+	def test_summary_and_regressions(self):
+		results = [{"kind": "known", "ok": True, "latency_ms": float(ms)} for ms in range(1, 101)]
+		results.append({"kind": "malformed", "ok": False, "latency_ms": 5.0})
+		report = summarize(results, seconds=2)
+		self.assertEqual(report["requests"], 101)
+		self.assertEqual(report["errors"], 1)
+		self.assertEqual(report["kinds"]["known"]["p50_ms"], 50.5)
+		self.assertEqual(report["kinds"]["known"]["error_rate"], 0)
+
+		baseline = {"p50_ms": 50, "p95_ms": 95, "p99_ms": 99, "error_rate": 0.0, "queries_per_request": 20}
+		current = {**baseline, "p99_ms": 130, "error_rate": 0.001, "queries_per_request": 23}
+		self.assertEqual([r["metric"] for r in compare_with_baseline(current, baseline)], ["p99_ms"])
+		self.assertEqual(
+			[r["metric"] for r in compare_with_baseline({**current, "error_rate": 0.01}, baseline)],
+			["p99_ms", "error_rate"]
+		)
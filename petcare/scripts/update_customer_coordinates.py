@@ -123,6 +123,11 @@ def update_single_customer_coordinates(doc, method=None):
         doc: Customer document
         method: Trigger method (not used but required for hooks)
     """
+    # Saves that leave the link alone (loyalty, tags, service details) skip geocoding
+    if not doc.is_new() and not doc.has_value_changed("custom_google_maps_link") \
+            and doc.custom_latitude and doc.custom_longitude:
+        return
+
     try:
         # Check if Google Maps link exists and coordinates need updating
         if doc.custom_google_maps_link:
@@ -3,11 +3,16 @@ This module manages customer service details in the PetCare system.
 It handles updating service dates, lead status, and integrates with the tagging system.
 """
 
+import time
 import frappe
 from datetime import date
-from typing import Optional
+from typing import Dict, List
 from petcare.scripts.update_customer_tags import CustomerTagManager
 
+CHUNK_SIZE = 2000
+
+logger = frappe.logger("customer_service_details", allow_site=True)
+
 class CustomerServiceManager:
     """
     Manages customer service-related operations including:
@@ -20,146 +25,83 @@ class CustomerServiceManager:
         """Initialize with today's date for calculations."""
         self.today = date.today()
 
-    def get_latest_service_date(self, customer: str) -> Optional[date]:
+    def update_customers(self, customers: List[str]) -> int:
         """
-        Get the latest completed service date for a customer.
-        
-        Args:
-            customer (str): The customer ID to check
-            
-        Returns:
-            Optional[date]: The date of the latest completed service, or None if no services
-        """
-        try:
-            # Get all completed service requests for the customer
-            latest_service = frappe.get_all(
-                "Service Request",
-                filters={
-                    "customer": customer,
-                    "status": "Completed"
-                },
-                fields=["completed_date"],
-                order_by="completed_date DESC",
-                limit=1
-            )
-
-            if latest_service:
-                return latest_service[0].completed_date
-            return None
-            
-        except Exception as e:
-            frappe.log_error(f"Error getting latest service date for customer {customer}: {str(e)}")
-            return None
+        Update service details for the given customers with one statement.
+        Updates:
+        - Latest completed service date (days since last service is derived from it)
+        - Lead status (Converted when any service is completed, else New Lead)
 
-    def calculate_days_since_service(self, latest_service_date: Optional[date]) -> int:
-        """
-        Calculate the number of days since the last service.
-        
         Args:
-            latest_service_date (Optional[date]): The date of the last service
-            
-        Returns:
-            int: Number of days since last service, 0 if no service
-        """
-        if not latest_service_date:
-            return 0
-        return (self.today - latest_service_date).days
+            customers (List[str]): Customer IDs to update
 
-    def has_completed_service(self, customer: str) -> bool:
-        """
-        Check if a customer has any completed service requests.
-        
-        Args:
-            customer (str): The customer ID to check
-            
         Returns:
-            bool: True if customer has completed services, False otherwise
+            int: Number of customer rows that changed
         """
-        return frappe.db.exists(
-            "Service Request",
-            {
-                "customer": customer,
-                "status": "Completed"
-            }
-        )
+        frappe.db.sql("""
+            UPDATE `tabCustomer` c
+            LEFT JOIN (
+                SELECT customer, MAX(completed_date) AS latest_service_date
+                FROM `tabService Request`
+                WHERE status = 'Completed' AND customer IN %(customers)s
+                GROUP BY customer
+            ) sr ON sr.customer = c.name
+            SET
+                c.custom_latest_completed_service_date = sr.latest_service_date,
+                c.custom_lead_status = IF(sr.customer IS NULL, 'New Lead', 'Converted')
+            WHERE c.name IN %(customers)s
+        """, {"customers": tuple(customers)})
+        # MariaDB counts only rows whose values actually changed
+        return frappe.db.sql("SELECT ROW_COUNT()")[0][0]
 
     def update_customer_details(self, customer: str) -> None:
         """
         Update service details for a specific customer.
-        Updates:
-        - Latest completed service date
-        - Days since last service
-        - Lead status (Converted/New Lead)
+        Same statement as the nightly run, restricted to one customer.
         
         Args:
             customer (str): The customer ID to update
         """
         try:
-            # Get latest service date
-            latest_service_date = self.get_latest_service_date(customer)
-            
-            # Calculate days since last service
-            days_since_service = self.calculate_days_since_service(latest_service_date)
-            
-            # Get current lead status
-            current_lead_status = frappe.db.get_value("Customer", customer, "custom_lead_status")
-            
-            # Check if customer has any completed service
-            has_completed = self.has_completed_service(customer)
-            
-            # Determine lead status
-            # If there's a completed service and status isn't already Converted, set to Converted
-            # Otherwise, set to New Lead
-            new_lead_status = "Converted" if has_completed else "New Lead"
-
-            # Update customer document
-            frappe.db.set_value(
-                "Customer",
-                customer,
-                {
-                    "custom_latest_completed_service_date": latest_service_date,
-                    "custom_days_since_last_service": days_since_service,
-                    "custom_lead_status": new_lead_status
-                },
-                update_modified=False
-            )
-
-            # Commit after each customer update
+            self.update_customers([customer])
             frappe.db.commit()
-
-            print(f"\nUpdated Customer {customer}:")
-            print(f"Latest Service Date: {latest_service_date}")
-            print(f"Days Since Service: {days_since_service}")
-            print(f"Lead Status: {new_lead_status}")
+            logger.info(f"Updated service details for customer {customer}")
 
         except Exception as e:
             frappe.db.rollback()
             frappe.log_error(f"Error updating service details for customer {customer}: {str(e)}")
             print(f"❌ Error updating customer {customer}: {str(e)}")
 
-    def process_all_customers(self) -> None:
+    def process_all_customers(self) -> Dict:
         """
         Process and update service details for all customers in the system.
-        Handles database transactions and error logging.
+        Customers are updated in chunks with one statement and one commit
+        per chunk; a failed chunk is rolled back and logged without stopping
+        the run.
+
+        Returns:
+            Dict: Customer, chunk, changed-row and error counts
         """
-        customers = frappe.get_all("Customer", pluck="name")
-        total_customers = len(customers)
-        updated_count = 0
-        error_count = 0
-        
-        print(f"\nProcessing {total_customers} customers...")
-        
-        for customer in customers:
+        started = time.perf_counter()
+        customers = frappe.get_all("Customer", pluck="name", order_by="name")
+        summary = {"customers": len(customers), "chunks": 0, "changed": 0, "errors": 0}
+
+        for start in range(0, len(customers), CHUNK_SIZE):
+            chunk = customers[start:start + CHUNK_SIZE]
             try:
-                self.update_customer_details(customer)
-                updated_count += 1
+                summary["changed"] += self.update_customers(chunk)
+                frappe.db.commit()
             except Exception as e:
-                error_count += 1
-                print(f"❌ Error processing customer {customer}: {str(e)}")
-        
-        print(f"\n✅ Update complete!")
-        print(f"Successfully updated: {updated_count} customers")
-        print(f"Errors encountered: {error_count} customers")
+                frappe.db.rollback()
+                summary["errors"] += len(chunk)
+                frappe.log_error(f"Error updating service details for customers {chunk[0]} to {chunk[-1]}: {str(e)}")
+            summary["chunks"] += 1
+
+        summary["seconds"] = round(time.perf_counter() - started, 2)
+        logger.info(f"Customer service details update: {summary}")
+        print(f"✅ Update complete! {summary['changed']} of {summary['customers']} customers changed "
+              f"in {summary['chunks']} chunks ({summary['seconds']}s), {summary['errors']} errors")
+        return summary
 
 def update_customer_service_details():
     """
@@ -188,9 +130,7 @@ def run_update(customer=None):
         manager.update_customer_details(customer)
         # Update tags for this customer
         tag_manager = CustomerTagManager()
-        service_data = tag_manager.get_customer_service_data(customer)
-        spending_percentiles = tag_manager.calculate_spending_percentiles()
-        tags = tag_manager.determine_customer_tags(customer, service_data, spending_percentiles)
+        tags = tag_manager.compute_customer_tags(customer)
         tag_manager.update_customer_tags(customer, tags)
         return "Customer updated successfully"
     else:
@@ -5,8 +5,140 @@ It handles tag assignment, tag descriptions, and action guides based on customer
 
 import frappe
 from datetime import date, timedelta
-import numpy as np
-from typing import Dict, List, Optional
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from petcare.scripts.customer_tag_rules import get_enabled_rules, compile_tag_rules, evaluate_tag_rules
+from petcare.scripts.spending_percentiles import get_spending_percentiles
+
+TAG_ACTIONS = {
+    "Active Customer": {
+        "status": "✅ Active",
+        "actions": [
+            "Maintain regular communication",
+            "Ask for referrals",
+            "Introduce new services"
+        ]
+    },
+    "Inactive Customer": {
+        "status": "⚠️ Needs Attention",
+        "actions": [
+            "Schedule follow-up call",
+            "Send special comeback offer",
+            "Review last service feedback"
+        ]
+    },
+    "First-Time Customer": {
+        "status": "🆕 New",
+        "actions": [
+            "Follow up within 48 hours",
+            "Get service feedback",
+            "Share loyalty program benefits"
+        ]
+    },
+    "Regular Customer": {
+        "status": "👍 Regular",
+        "actions": [
+            "Maintain service quality",
+            "Suggest additional services",
+            "Consider for loyalty program"
+        ]
+    },
+    "Loyal Customer": {
+        "status": "⭐ Loyal",
+        "actions": [
+            "Provide priority booking",
+            "Offer exclusive services",
+            "Send appreciation message"
+        ]
+    },
+    "High-Value Customer": {
+        "status": "💎 High Value",
+        "actions": [
+            "Provide premium service options",
+            "Assign dedicated staff member",
+            "Regular personal check-ins"
+        ]
+    },
+    "VIP Customer": {
+        "status": "👑 VIP",
+        "actions": [
+            "Priority scheduling",
+            "Personalized service plans",
+            "Direct manager contact"
+        ]
+    },
+    "Multiple Pets Owner": {
+        "status": "🐾 Multiple Pets",
+        "actions": [
+            "Offer multi-pet discounts",
+            "Suggest combined appointments",
+            "Share multi-pet care tips"
+        ]
+    }
+}
+
+TAG_DESCRIPTIONS = {
+    "Active Customer": "Customer who has had a service within the last 30 days. Shows regular engagement with our services.",
+    "Recently Active": "Customer who has had a service within the last 30 days. Shows current engagement with our services.",
+    "Inactive Customer": "Customer who hasn't had any services in the last 180 days. May need re-engagement efforts.",
+    "First-Time Customer": "Has completed exactly one service with us. Critical period for customer retention.",
+    "Regular Customer": "Has completed more than one service. Shows repeated trust in our services.",
+    "Repeat Customer": "Has completed more than one service. Shows customer satisfaction and trust.",
+    "Loyal Customer": "Has been consistently using our services for over 6 months with regular visits.",
+    "High-Value Customer": "Total spending is above the median customer spending. Values our premium services.",
+    "VIP Customer": "Among our top 10% of customers by spending. Highest value customer segment.",
+    "Multiple Pets Owner": "Has more than one pet registered with us. Higher potential for multiple services.",
+    "Frequent Customer": "Has at least 3 services in the last 3 months. Shows strong current engagement."
+}
+
+@lru_cache(maxsize=512)
+def render_tag_actions_guide(tags: Tuple[str, ...]) -> str:
+    """
+    Render the recommended-actions guide for a tag set.
+    Cached per tag set, since only a few dozen combinations occur in practice.
+    """
+    guide = "RECOMMENDED ACTIONS:\n\n"
+
+    active_tags = [tag for tag in tags if tag in TAG_ACTIONS]
+
+    if not active_tags:
+        guide += "No active tags to show actions for."
+    else:
+        for tag in active_tags:
+            actions = TAG_ACTIONS[tag]
+            guide += f"{actions['status']} - {tag}\n"
+            for action in actions['actions']:
+                guide += f"• {action}\n"
+            guide += "\n"
+
+    return guide
+
+@lru_cache(maxsize=512)
+def render_tag_descriptions(tags: Tuple[str, ...]) -> str:
+    """
+    Render the tag descriptions for a tag set.
+    Cached per tag set, like render_tag_actions_guide.
+    """
+    descriptions = "CURRENT TAG DESCRIPTIONS:\n\n"
+
+    customer_tags = [tag for tag in tags if tag in TAG_DESCRIPTIONS]
+
+    if not customer_tags:
+        descriptions += "No tags to describe."
+    else:
+        for tag in customer_tags:
+            descriptions += f"📌 {tag}\n"
+            descriptions += f"   {TAG_DESCRIPTIONS[tag]}\n\n"
+
+    # Add warning for any tags that don't have descriptions
+    missing_tags = [tag for tag in tags if tag not in TAG_DESCRIPTIONS]
+    if missing_tags:
+        descriptions += "\n⚠️ Tags without descriptions:\n"
+        for tag in missing_tags:
+            descriptions += f"• {tag}\n"
+
+    return descriptions
+
 
 class CustomerTagManager:
     """
@@ -25,6 +157,7 @@ class CustomerTagManager:
         self.one_month_ago = self.today - timedelta(days=30)
         self.one_year_ago = self.today - timedelta(days=365)
         self.three_months_ago = self.today - timedelta(days=90)
+        self.writes_avoided = 0
 
     def get_customer_service_data(self, customer: str) -> Dict:
         """Get all relevant service data for a customer."""
@@ -71,23 +204,12 @@ class CustomerTagManager:
             return None
 
     def calculate_spending_percentiles(self) -> Dict:
-        """Calculate spending percentiles across all customers."""
+        """
+        Spending percentiles across all customers, read from the
+        Spending Percentile Snapshot rather than aggregated per call.
+        """
         try:
-            all_customer_spending = frappe.db.sql("""
-                SELECT customer, SUM(amount_after_discount) as total_spent
-                FROM `tabService Request`
-                WHERE status = 'Completed' AND amount_after_discount > 0
-                GROUP BY customer
-            """, as_dict=True)
-
-            if not all_customer_spending:
-                return {"median": 0, "percentile_90": 0}
-
-            spend_values = [cs.total_spent for cs in all_customer_spending]
-            return {
-                "median": np.percentile(spend_values, 50),
-                "percentile_90": np.percentile(spend_values, 90)
-            }
+            return get_spending_percentiles()
         except Exception as e:
             frappe.log_error(f"Error calculating spending percentiles: {str(e)}")
             return {"median": 0, "percentile_90": 0}
@@ -148,66 +270,108 @@ class CustomerTagManager:
 
         return tags
 
-    def update_customer_tags(self, customer: str, tags: List[str]) -> None:
+    def compute_customer_tags(self, customer: str) -> List[str]:
+        """
+        Determine a single customer's tags, from the enabled Customer Tag
+        Rules when any exist and from determine_customer_tags otherwise.
+
+        Args:
+            customer (str): Customer ID
+
+        Returns:
+            List[str]: List of tags to be applied to the customer
+        """
+        spending_percentiles = self.calculate_spending_percentiles()
+        rules = get_enabled_rules()
+        if rules:
+            compiled = compile_tag_rules(rules, self.today, spending_percentiles)
+            evaluated = evaluate_tag_rules(compiled, [customer])
+            return [tag for tag in compiled["tags"] if evaluated["masks"][tag].any()]
+
+        service_data = self.get_customer_service_data(customer)
+        return self.determine_customer_tags(customer, service_data, spending_percentiles)
+
+    def update_customer_tags(self, customer: str, tags: List[str]) -> Optional[bool]:
         """
         Update tags for a specific customer and generate associated guides.
+        The stored tag set is compared first and nothing is written when it
+        already matches; otherwise only the changed tag rows and the guide
+        text are written, without a full document save.
         
         Args:
             customer (str): Customer ID to update
             tags (List[str]): List of tags to apply
+
+        Returns:
+            Optional[bool]: True if the customer's tags were written, False if
+            they were already up to date, None if the update failed
         """
+        from petcare.scripts.customer_tag_engine import CustomerTagEngine
+
         try:
-            # Get the customer document
-            customer_doc = frappe.get_doc("Customer", customer)
+            engine = CustomerTagEngine(self)
+            existing = engine.load_existing_tags([customer])
+            changes = engine.diff({customer: tags}, existing)
 
-            # Clear existing tags
-            customer_doc.set("custom_customer_tags", [])
-            
-            # Add new tags
-            for tag in tags:
-                customer_doc.append("custom_customer_tags", {
-                    "tag": tag,
-                    "assigned_date": self.today,
-                    "assigned_by": "Administrator",
-                    "is_automatic": 1
-                })
-            
-            # Update the tag actions guide and descriptions
-            customer_doc.custom_tag_actions_guide = self.get_tag_actions_guide(tags)
-            customer_doc.custom_tag_descriptions = self.get_tag_descriptions(tags)
-            
-            # Save the document
-            customer_doc.save(ignore_permissions=True)
+            if not changes:
+                self.writes_avoided += 1
+                print(f"Tags unchanged for {customer}, skipped write")
+                return False
+
+            engine.write(changes)
             print(f"Successfully updated tags and guides for {customer}")
+            return True
             
         except Exception as e:
             frappe.log_error(f"Error updating tags for customer {customer}: {str(e)}")
             print(f"Error updating tags for {customer}: {str(e)}")
+            return None
 
-    def process_all_customers(self) -> None:
+    def process_all_customers(self) -> Dict:
         """
         Process and update tags for all customers in the system.
-        Handles database transactions and error logging.
+        Runs the set-based CustomerTagEngine, which loads every customer's
+        aggregates in one query and only writes tags that changed.
+
+        Returns:
+            Dict: Stage timings, tag counts and write statistics
         """
+        from petcare.scripts.customer_tag_engine import CustomerTagEngine
+
         try:
-            # Get spending percentiles first
-            spending_percentiles = self.calculate_spending_percentiles()
+            report = CustomerTagEngine(self).run()
+            print(f"✅ Customer tags updated successfully! {report['changed_customers']} of "
+                  f"{report['customers']} customers changed in {sum(report['timings'].values()):.2f}s, "
+                  f"{report['writes_avoided']} writes avoided")
+            return report
 
-            # Get all customers
-            customers = frappe.get_all("Customer", pluck="name")
-            
-            for customer in customers:
-                service_data = self.get_customer_service_data(customer)
-                if service_data:
-                    tags = self.determine_customer_tags(customer, service_data, spending_percentiles)
-                    self.update_customer_tags(customer, tags)
+        except Exception as e:
+            frappe.db.rollback()
+            frappe.log_error(f"Error in customer tag update process: {str(e)}")
+            print("❌ Error updating customer tags. Check error log for details.")
+
+    def process_changed_customers(self) -> Dict:
+        """
+        Retag only customers whose tags can have changed since the last run:
+        those with edited service requests or pets, and those whose next tag
+        transition date has arrived. Runtime follows activity rather than
+        the number of customers.
 
-            frappe.db.commit()
-            print("✅ Customer tags updated successfully!")
+        Returns:
+            Dict: Stage timings, candidate counts and write statistics
+        """
+        from petcare.scripts.customer_tag_engine import CustomerTagEngine
+
+        try:
+            report = CustomerTagEngine(self).run_incremental()
+            print(f"✅ Customer tags updated incrementally! {report['changed_customers']} of "
+                  f"{report['customers']} candidate customers changed, "
+                  f"{report['writes_avoided']} writes avoided")
+            return report
 
         except Exception as e:
             frappe.db.rollback()
-            frappe.log_error(f"Error in customer tag update process: {str(e)}")
+            frappe.log_error(f"Error in incremental customer tag update: {str(e)}")
             print("❌ Error updating customer tags. Check error log for details.")
 
     def get_tag_actions_guide(self, tags: List[str]) -> str:
@@ -220,88 +384,7 @@ class CustomerTagManager:
         Returns:
             str: Formatted HTML string containing recommended actions
         """
-        tag_actions = {
-            "Active Customer": {
-                "status": "✅ Active",
-                "actions": [
-                    "Maintain regular communication",
-                    "Ask for referrals",
-                    "Introduce new services"
-                ]
-            },
-            "Inactive Customer": {
-                "status": "⚠️ Needs Attention",
-                "actions": [
-                    "Schedule follow-up call",
-                    "Send special comeback offer",
-                    "Review last service feedback"
-                ]
-            },
-            "First-Time Customer": {
-                "status": "🆕 New",
-                "actions": [
-                    "Follow up within 48 hours",
-                    "Get service feedback",
-                    "Share loyalty program benefits"
-                ]
-            },
-            "Regular Customer": {
-                "status": "👍 Regular",
-                "actions": [
-                    "Maintain service quality",
-                    "Suggest additional services",
-                    "Consider for loyalty program"
-                ]
-            },
-            "Loyal Customer": {
-                "status": "⭐ Loyal",
-                "actions": [
-                    "Provide priority booking",
-                    "Offer exclusive services",
-                    "Send appreciation message"
-                ]
-            },
-            "High-Value Customer": {
-                "status": "💎 High Value",
-                "actions": [
-                    "Provide premium service options",
-                    "Assign dedicated staff member",
-                    "Regular personal check-ins"
-                ]
-            },
-            "VIP Customer": {
-                "status": "👑 VIP",
-                "actions": [
-                    "Priority scheduling",
-                    "Personalized service plans",
-                    "Direct manager contact"
-                ]
-            },
-            "Multiple Pets Owner": {
-                "status": "🐾 Multiple Pets",
-                "actions": [
-                    "Offer multi-pet discounts",
-                    "Suggest combined appointments",
-                    "Share multi-pet care tips"
-                ]
-            }
-        }
-
-        guide = "RECOMMENDED ACTIONS:\n\n"
-        
-        active_tags = [tag for tag in tags if tag in tag_actions]
-        
-        if not active_tags:
-            guide += "No active tags to show actions for."
-        else:
-            for tag in active_tags:
-                actions = tag_actions[tag]
-                guide += f"{actions['status']} - {tag}\n"
-                for action in actions['actions']:
-                    guide += f"• {action}\n"
-                guide += "\n"
-
-        return guide
+        return render_tag_actions_guide(tuple(tags))
 
     def get_tag_descriptions(self, tags: List[str]) -> str:
         """
@@ -313,39 +396,7 @@ class CustomerTagManager:
         Returns:
             str: Formatted string containing tag descriptions
         """
-        tag_descriptions = {
-            "Active Customer": "Customer who has had a service within the last 30 days. Shows regular engagement with our services.",
-            "Recently Active": "Customer who has had a service within the last 30 days. Shows current engagement with our services.",
-            "Inactive Customer": "Customer who hasn't had any services in the last 180 days. May need re-engagement efforts.",
-            "First-Time Customer": "Has completed exactly one service with us. Critical period for customer retention.",
-            "Regular Customer": "Has completed more than one service. Shows repeated trust in our services.",
-            "Repeat Customer": "Has completed more than one service. Shows customer satisfaction and trust.",
-            "Loyal Customer": "Has been consistently using our services for over 6 months with regular visits.",
-            "High-Value Customer": "Total spending is above the median customer spending. Values our premium services.",
-            "VIP Customer": "Among our top 10% of customers by spending. Highest value customer segment.",
-            "Multiple Pets Owner": "Has more than one pet registered with us. Higher potential for multiple services.",
-            "Frequent Customer": "Has at least 3 services in the last 3 months. Shows strong current engagement."
-        }
-
-        descriptions = "CURRENT TAG DESCRIPTIONS:\n\n"
-        
-        customer_tags = [tag for tag in tags if tag in tag_descriptions]
-        
-        if not customer_tags:
-            descriptions += "No tags to describe."
-        else:
-            for tag in customer_tags:
-                descriptions += f"📌 {tag}\n"
-                descriptions += f"   {tag_descriptions[tag]}\n\n"
-
-        # Add warning for any tags that don't have descriptions
-        missing_tags = [tag for tag in tags if tag not in tag_descriptions]
-        if missing_tags:
-            descriptions += "\n⚠️ Tags without descriptions:\n"
-            for tag in missing_tags:
-                descriptions += f"• {tag}\n"
-
-        return descriptions
+        return render_tag_descriptions(tuple(tags))
 
 def update_customer_tags():
     """
@@ -355,6 +406,14 @@ def update_customer_tags():
     manager = CustomerTagManager()
     manager.process_all_customers()
 
+def update_changed_customer_tags():
+    """
+    Entry point for an incremental tag update outside the nightly pipeline,
+    whose tags stage runs the same incremental pass on most nights.
+    """
+    manager = CustomerTagManager()
+    manager.process_changed_customers()
+
 @frappe.whitelist()
 def run_update(customer=None):
     """
@@ -371,15 +430,19 @@ def run_update(customer=None):
     
     if customer:
         # Update single customer
-        service_data = manager.get_customer_service_data(customer)
-        spending_percentiles = manager.calculate_spending_percentiles()
-        tags = manager.determine_customer_tags(customer, service_data, spending_percentiles)
-        manager.update_customer_tags(customer, tags)
+        tags = manager.compute_customer_tags(customer)
+        updated = manager.update_customer_tags(customer, tags)
+        if updated is None:
+            frappe.db.rollback()
+            frappe.throw(f"Error updating tags for customer {customer}. Check error log for details.")
+        if not updated:
+            return "Customer tags already up to date"
         frappe.db.commit()
         return "Customer tags updated successfully"
     else:
         # Update all customers
-        manager.process_all_customers()
+        if manager.process_all_customers() is None:
+            frappe.throw("Error updating customer tags. Check error log for details.")
         return "All customers' tags updated successfully"
 
 # Usage Instructions:
@@ -0,0 +1,328 @@
+"""
+Load test for the Voxbay webhook.
+
+Replays a corpus of Voxbay payloads against a bench site's webhook at a
+fixed rate and reports latency percentiles, error rate, database queries
+per request and rows created. The corpus is either recorded payloads (a
+JSON array, one webhook body per element) or generated from a mix of:
+
+    known      calls from existing customers' numbers
+    unknown    calls from numbers with no customer, which create one
+    duplicate  re-deliveries of a recent payload, often while it is in flight
+    malformed  missing fields, bad call types or unparseable times
+
+Run it against a local site, never production: the calls and customers it
+creates are real rows (see cleanup). Results are saved as JSON and can be
+compared with an earlier run's to catch regressions.
+"""
+
+import json
+import random
+import time
+import frappe
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+WEBHOOK_PATH = "/api/method/petcare.api.handle_voxbay_event.handle_voxbay_event"
+DEFAULT_MIX = {"known": 0.6, "unknown": 0.2, "duplicate": 0.1, "malformed": 0.1}
+LATENCY_PERCENTILES = [50, 95, 99]
+# Numbers for unknown callers; no real customer should have them
+SYNTHETIC_NUMBER_PREFIX = "+9190000"
+# A metric regresses when it is this much worse than the baseline
+DEFAULT_TOLERANCE = 0.2
+REQUEST_TIMEOUT = 30
+
+
+def make_event(rng: random.Random, call_id: str, number: str, receiver: str = "+914842000000") -> Dict:
+    """One valid Voxbay payload for a call from or to `number`."""
+    start = datetime.now() - timedelta(seconds=rng.randint(60, 3600))
+    duration = rng.randint(0, 600)
+    incoming = rng.random() < 0.7
+    return {
+        "call_id": call_id,
+        "caller_number": number if incoming else receiver,
+        "receiver_number": receiver if incoming else number,
+        "call_type": "incoming" if incoming else "outgoing",
+        "call_status": rng.choice(["ANSWERED", "ANSWERED", "ANSWERED", "NOANSWER", "BUSY"]),
+        "start_time": start.strftime("%Y-%m-%d %H:%M:%S"),
+        "end_time": (start + timedelta(seconds=duration)).strftime("%Y-%m-%d %H:%M:%S"),
+        "duration": duration,
+        "agent_number": receiver,
+    }
+
+
+def break_event(rng: random.Random, event: Dict) -> Dict:
+    """A copy of a payload the webhook must reject."""
+    event = dict(event)
+    fault = rng.choice(["missing_field", "call_type", "start_time"])
+    if fault == "missing_field":
+        event.pop(rng.choice(["caller_number", "start_time", "call_status"]))
+    elif fault == "call_type":
+        event["call_type"] = "transfer"
+    else:
+        event["start_time"] = "yesterday-ish"
+    return event
+
+
+def generate_payloads(count: int, known_numbers: List[str], mix: Optional[Dict] = None,
+                      seed: int = 0, run_id: str = "run") -> List[Dict]:
+    """
+    A synthetic corpus in the given proportions of kinds.
+
+    Each payload carries its kind under "_kind", which is not sent. Duplicates
+    repeat one of the last few valid payloads, so some arrive concurrently
+    with the original.
+
+    Args:
+        count (int): Number of payloads
+        known_numbers (list): Existing customers' numbers; without any, known calls become unknown
+        mix (dict): Weight per kind, see DEFAULT_MIX
+        seed (int): Random seed, so runs can be repeated exactly
+        run_id (str): Prefix for call_ids, so this run's rows can be found
+    """
+    rng = random.Random(seed)
+    mix = {**DEFAULT_MIX, **(mix or {})}
+    kinds, weights = zip(*[(kind, weight) for kind, weight in mix.items() if weight > 0])
+    payloads = []
+    recent = []
+    for index in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "duplicate" and not recent:
+            kind = "unknown"
+        if kind == "known" and not known_numbers:
+            kind = "unknown"
+
+        if kind == "duplicate":
+            event = dict(rng.choice(recent[-5:]))
+        else:
+            if kind == "known":
+                number = rng.choice(known_numbers)
+            else:
+                # A few unknown numbers call more than once in a run
+                number = f"{SYNTHETIC_NUMBER_PREFIX}{rng.randint(0, max(count // 2, 1)):05d}"
+            event = make_event(rng, f"{run_id}-{index}", number)
+            if kind == "malformed":
+                event = break_event(rng, event)
+            else:
+                recent.append(event)
+        payloads.append({**event, "_kind": kind})
+    return payloads
+
+
+def load_payloads(path: str) -> List[Dict]:
+    """
+    Recorded payloads from a JSON array. "_kind" defaults to "recorded", which
+    is expected to succeed; mark payloads that should be rejected "malformed".
+    """
+    with open(path) as f:
+        return [{"_kind": "recorded", **payload} for payload in json.load(f)]
+
+
+def get_known_numbers(limit: int = 500) -> List[str]:
+    """Normalized mobile numbers of existing customers, to call as known callers."""
+    return frappe.db.sql_list("""
+        SELECT custom_normalized_mobile FROM `tabCustomer`
+        WHERE IFNULL(custom_normalized_mobile, '') != '' AND custom_normalized_mobile NOT LIKE %s
+        ORDER BY RAND() LIMIT %s
+    """, (f"{SYNTHETIC_NUMBER_PREFIX}%", limit))
+
+
+def get_queries_executed() -> int:
+    """The server's statement counter; deltas include all clients, so keep the site otherwise idle."""
+    return int(frappe.db.sql("SHOW GLOBAL STATUS LIKE 'Questions'")[0][1])
+
+
+def send(session, url: str, api_key: str, payload: Dict, scheduled: float) -> Dict:
+    """
+    Post one payload. Latency is measured from when it was scheduled, so time
+    spent waiting for a free worker counts when the site cannot keep up.
+    """
+    body = {key: value for key, value in payload.items() if not key.startswith("_")}
+    expected = "Error" if payload["_kind"] == "malformed" else "Success"
+    try:
+        response = session.post(url, json=body, headers={"X-Api-Key": api_key}, timeout=REQUEST_TIMEOUT)
+        result = response.json().get("message") or {}
+        outcome = result.get("message") if isinstance(result, dict) else None
+        status = response.status_code
+    except Exception as e:
+        outcome, status = f"{type(e).__name__}", None
+    return {
+        "kind": payload["_kind"],
+        "status": status,
+        "outcome": outcome,
+        "ok": status is not None and status < 500 and outcome == expected,
+        "latency_ms": (time.perf_counter() - scheduled) * 1000,
+    }
+
+
+def summarize(results: List[Dict], seconds: float) -> Dict:
+    """Latency percentiles and error rate, overall and per kind."""
+    def stats(rows):
+        latencies = np.array([row["latency_ms"] for row in rows]) if rows else np.zeros(1)
+        errors = sum(not row["ok"] for row in rows)
+        return {
+            "requests": len(rows),
+            **{f"p{p}_ms": round(float(np.percentile(latencies, p)), 1) for p in LATENCY_PERCENTILES},
+            "max_ms": round(float(latencies.max()), 1),
+            "errors": errors,
+            "error_rate": round(errors / len(rows), 4) if rows else 0,
+        }
+
+    by_kind = {}
+    for row in results:
+        by_kind.setdefault(row["kind"], []).append(row)
+    return {
+        **stats(results),
+        "achieved_rps": round(len(results) / seconds, 1) if seconds else 0,
+        "kinds": {kind: stats(rows) for kind, rows in sorted(by_kind.items())},
+    }
+
+
+def count_rows(since: datetime) -> Dict:
+    """Call logs and customers created since a run started."""
+    return {
+        "call_logs": frappe.db.count("Voxbay Call Log", {"creation": [">=", since]}),
+        "customers": frappe.db.count("Customer", {"creation": [">=", since]}),
+    }
+
+
+def compare_with_baseline(report: Dict, baseline: Dict, tolerance: float = DEFAULT_TOLERANCE) -> List[Dict]:
+    """
+    Metrics that got worse than the baseline by more than `tolerance`.
+
+    Returns:
+        list: {"metric", "baseline", "current"} per regression
+    """
+    metrics = [f"p{p}_ms" for p in LATENCY_PERCENTILES] + ["error_rate", "queries_per_request"]
+    regressions = []
+    for metric in metrics:
+        before, after = baseline.get(metric), report.get(metric)
+        if before is None or after is None:
+            continue
+        # Error rates near zero compare in percentage points, everything else relatively
+        limit = before + tolerance / 100 if metric == "error_rate" else before * (1 + tolerance)
+        if after > limit:
+            regressions.append({"metric": metric, "baseline": before, "current": after})
+    return regressions
+
+
+def run_load_test(rate: float = 20, count: int = 500, concurrency: int = 20, payloads_path: Optional[str] = None,
+                  mix: Optional[Dict] = None, seed: int = 0, url: Optional[str] = None,
+                  output: Optional[str] = None, baseline: Optional[str] = None,
+                  tolerance: float = DEFAULT_TOLERANCE) -> Dict:
+    """
+    Replay Voxbay payloads against the site's webhook and report how it held up.
+
+    Args:
+        rate (float): Requests started per second
+        count (int): Payloads to generate; ignored with payloads_path
+        concurrency (int): Requests in flight at most
+        payloads_path (str): JSON array of recorded payloads to replay instead
+        mix (dict | str): Weights of generated kinds, see DEFAULT_MIX
+        seed (int): Random seed for generated payloads
+        url (str): Webhook URL; defaults to this site's
+        output (str): Save the report here as JSON, to use as a later baseline
+        baseline (str): Earlier report to compare with
+        tolerance (float): Allowed relative worsening before a metric counts as a regression
+
+    Returns:
+        Dict: The report
+    """
+    import requests
+    from petcare.api.handle_voxbay_event import load_api_key
+
+    if isinstance(mix, str):
+        mix = json.loads(mix)
+    run_id = f"loadtest-{int(time.time())}"
+    if payloads_path:
+        payloads = load_payloads(payloads_path)
+    else:
+        payloads = generate_payloads(int(count), get_known_numbers(), mix, seed=int(seed), run_id=run_id)
+    url = url or frappe.utils.get_url(WEBHOOK_PATH)
+    api_key = load_api_key()
+    if not api_key:
+        frappe.throw("No Voxbay API key is configured for this site")
+
+    print(f"\nReplaying {len(payloads)} payloads at {rate}/s with {concurrency} workers to {url}")
+    started_at = datetime.now()
+    queries_before = get_queries_executed()
+    session = requests.Session()
+    session.mount(url, requests.adapters.HTTPAdapter(pool_maxsize=int(concurrency)))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=int(concurrency)) as pool:
+        futures = []
+        for index, payload in enumerate(payloads):
+            scheduled = started + index / float(rate)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(send, session, url, api_key, payload, scheduled))
+        results = [future.result() for future in futures]
+    seconds = time.perf_counter() - started
+
+    queries = get_queries_executed() - queries_before
+    report = {
+        "run_id": run_id,
+        "started_at": str(started_at),
+        "url": url,
+        "target_rps": float(rate),
+        "concurrency": int(concurrency),
+        "seed": int(seed),
+        "corpus": payloads_path or "synthetic",
+        "seconds": round(seconds, 2),
+        **summarize(results, seconds),
+        "queries_per_request": round(queries / len(results), 1) if results else 0,
+        "rows_created": count_rows(started_at),
+    }
+
+    print(f"Achieved {report['achieved_rps']}/s over {report['seconds']}s")
+    print("Latency: " + ", ".join(f"p{p} {report[f'p{p}_ms']} ms" for p in LATENCY_PERCENTILES))
+    print(f"Errors: {report['errors']} ({report['error_rate'] * 100:.2f}%)")
+    print(f"Queries per request: {report['queries_per_request']}")
+    print(f"Rows created: {report['rows_created']}")
+    for kind, stats in report["kinds"].items():
+        print(f"  {kind}: {stats['requests']} requests, p95 {stats['p95_ms']} ms, {stats['errors']} errors")
+
+    if baseline:
+        with open(baseline) as f:
+            report["regressions"] = compare_with_baseline(report, json.load(f), float(tolerance))
+        if report["regressions"]:
+            for regression in report["regressions"]:
+                print(f"✗ {regression['metric']}: {regression['baseline']} → {regression['current']}")
+        else:
+            print("✓ No regressions against the baseline")
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {output}")
+    return report
+
+
+def cleanup(run_id: str) -> Dict:
+    """
+    Delete a run's call logs and the customers created for its synthetic
+    unknown numbers.
+    """
+    call_logs = frappe.get_all("Voxbay Call Log", filters={"call_id": ["like", f"{run_id}-%"]}, pluck="name")
+    for call_log in call_logs:
+        frappe.delete_doc("Voxbay Call Log", call_log, ignore_permissions=True, force=True)
+    customers = frappe.get_all("Customer", filters={
+        "custom_normalized_mobile": ["like", f"{SYNTHETIC_NUMBER_PREFIX}%"],
+        "customer_name": ["like", "Customer +%"],
+    }, pluck="name")
+    for customer in customers:
+        frappe.delete_doc("Customer", customer, ignore_permissions=True, force=True)
+    frappe.db.commit()
+    print(f"✓ Deleted {len(call_logs)} call logs and {len(customers)} customers")
+    return {"call_logs": len(call_logs), "customers": len(customers)}
+
+# Usage Instructions (local sites only):
+# bench --site <site> execute petcare.scripts.voxbay_load_test.run_load_test \
+#     --kwargs '{"rate": 50, "count": 2000, "output": "voxbay_baseline.json"}'
+# bench --site <site> execute petcare.scripts.voxbay_load_test.run_load_test \
+#     --kwargs '{"rate": 50, "count": 2000, "baseline": "voxbay_baseline.json"}'
+# bench --site <site> execute petcare.scripts.voxbay_load_test.cleanup --kwargs '{"run_id": "loadtest-..."}'
@@ -2,3 +2,30 @@ from frappe import get_site_config
 
 def get_google_maps_api_key():
     return get_site_config().get("google_maps_api_key")
+
+# Upper bounds (in days since the last service) of the follow-up buckets
+DEFAULT_FOLLOWUP_BUCKET_BOUNDARIES = [30, 60, 90]
+
+def get_followup_bucket_boundaries():
+    """
+    Follow-up bucket boundaries from site config, e.g.
+    "followup_bucket_boundaries": [30, 60, 90]
+    gives 0-30, 31-60, 61-90 and 91+ days.
+    """
+    boundaries = get_site_config().get("followup_bucket_boundaries") or DEFAULT_FOLLOWUP_BUCKET_BOUNDARIES
+    return sorted({int(days) for days in boundaries})
+
+# Country code assumed for phone numbers stored without one
+DEFAULT_PHONE_COUNTRY_CODE = "91"
+
+def get_default_phone_country_code():
+    """Country code for numbers without one, from site config "default_phone_country_code"."""
+    return str(get_site_config().get("default_phone_country_code") or DEFAULT_PHONE_COUNTRY_CODE).lstrip("+")
+
+def is_voxbay_customer_creation_deferred():
+    """
+    Site config "voxbay_defer_customer_creation": when set, the Voxbay webhook
+    logs calls from unknown numbers without a customer and a background job
+    creates the customer.
+    """
+    return bool(get_site_config().get("voxbay_defer_customer_creation"))
@@ -37,6 +37,78 @@ def calculate_round_trip(api_key, locations, departure_time='now', mode='driving
         "total_duration_in_traffic_seconds": total_duration_in_traffic
     }
 
+# Google rejects Distance Matrix requests above these sizes
+MAX_MATRIX_ORIGINS = 25
+MAX_MATRIX_DESTINATIONS = 25
+MAX_MATRIX_ELEMENTS = 100
+
+class DistanceMatrixClient:
+    """
+    Thin wrapper around the Google Distance Matrix API.
+
+    Bulk callers take any object with the same `distance_matrix` method, so
+    tests and offline runs can swap in a local stand-in.
+    """
+
+    def __init__(self, api_key, departure_time='now', mode='driving'):
+        self.gmaps = googlemaps.Client(key=api_key)
+        self.departure_time = departure_time
+        self.mode = mode
+        self.request_count = 0
+
+    def distance_matrix(self, origins, destinations):
+        """
+        Fetch every origin x destination leg in a single request.
+
+        Returns:
+            list: rows[i][j] with distance_meters, duration_seconds and
+                  duration_in_traffic_seconds, or None where Google found no route
+        """
+        self.request_count += 1
+        response = self.gmaps.distance_matrix(
+            origins=origins,
+            destinations=destinations,
+            mode=self.mode,
+            departure_time=self.departure_time
+        )
+        rows = []
+        for row in response.get('rows', []):
+            elements = []
+            for element in row.get('elements', []):
+                if element.get('status') != 'OK':
+                    elements.append(None)
+                    continue
+                duration = element['duration']['value']
+                elements.append({
+                    "distance_meters": element['distance']['value'],
+                    "duration_seconds": duration,
+                    "duration_in_traffic_seconds": element.get('duration_in_traffic', {}).get('value', duration)
+                })
+            rows.append(elements)
+        return rows
+
+def get_distance_matrix(client, origins, destinations):
+    """
+    Fetch all origin x destination legs, splitting into as few requests as
+    Google's size limits allow.
+
+    Returns:
+        dict: {(origin, destination): leg} for every leg Google could route
+    """
+    legs = {}
+    destination_chunk = min(MAX_MATRIX_DESTINATIONS, MAX_MATRIX_ELEMENTS)
+    for d_start in range(0, len(destinations), destination_chunk):
+        chunk_destinations = destinations[d_start:d_start + destination_chunk]
+        origin_chunk = max(1, min(MAX_MATRIX_ORIGINS, MAX_MATRIX_ELEMENTS // len(chunk_destinations)))
+        for o_start in range(0, len(origins), origin_chunk):
+            chunk_origins = origins[o_start:o_start + origin_chunk]
+            rows = client.distance_matrix(chunk_origins, chunk_destinations)
+            for origin, row in zip(chunk_origins, rows):
+                for destination, leg in zip(chunk_destinations, row):
+                    if leg:
+                        legs[(origin, destination)] = leg
+    return legs
+
 def get_coordinates(api_key, address):
     """
     Get the latitude and longitude for an address using Google Maps Geocoding API.
@@ -0,0 +1,89 @@
+"""
+Field-level gating for document hooks.
+
+A hook declares the fields it depends on and only runs when the document is
+new (or being deleted) or one of those fields changed in this save:
+
+    @depends_on("status", "completed_date", "services")
+    def on_update(doc, method=None):
+        ...
+
+Table fields are compared by their rows' values, so re-saving a document
+with the same items does not count as a change. Every call is counted as
+run or skipped in a site-wide Redis hash; see get_hook_gating_counts.
+"""
+
+import frappe
+import redis
+from functools import wraps
+
+COUNTS_KEY = "hook_gating_counts"
+
+
+def get_table_rows(doc, fieldname):
+    """A table field's rows as plain values, without names or timestamps."""
+    return [row.as_dict(no_default_fields=True, no_child_table_fields=True) for row in doc.get(fieldname) or []]
+
+
+def has_field_changed(doc, before, fieldname):
+    """Whether a field differs from the saved version; table fields compare row values."""
+    if doc.meta.get_field(fieldname) and doc.meta.get_field(fieldname).fieldtype in frappe.model.table_fields:
+        return get_table_rows(before, fieldname) != get_table_rows(doc, fieldname)
+    return doc.has_value_changed(fieldname)
+
+
+def should_run(doc, fieldnames):
+    """True for new documents and deletions, else when one of the fields changed."""
+    before = doc.get_doc_before_save()
+    if before is None:
+        return True
+    return any(has_field_changed(doc, before, fieldname) for fieldname in fieldnames)
+
+
+def record(hook, outcome):
+    """Count one run or skip of a hook, as a plain integer in the hash."""
+    cache = frappe.cache()
+    cache.hincrby(cache.make_key(COUNTS_KEY), f"{hook}:{outcome}", 1)
+
+
+def depends_on(*fieldnames):
+    """Decorator: skip a doc event hook unless one of `fieldnames` changed."""
+    def decorator(hook):
+        name = f"{hook.__module__}.{hook.__qualname__}"
+
+        @wraps(hook)
+        def gated(doc, method=None, *args, **kwargs):
+            if not should_run(doc, fieldnames):
+                record(name, "skipped")
+                return None
+            record(name, "run")
+            return hook(doc, method, *args, **kwargs)
+
+        gated.depends_on = fieldnames
+        return gated
+    return decorator
+
+
+@frappe.whitelist()
+def get_hook_gating_counts(reset=False):
+    """
+    Runs and skips per gated hook since the last reset.
+
+    Returns:
+        dict: {hook: {"run": int, "skipped": int, "skipped_percent": float}}
+    """
+    frappe.only_for("System Manager")
+    cache = frappe.cache()
+    key = cache.make_key(COUNTS_KEY)
+    counts = {}
+    # The counters are raw integers under the built key; Frappe's hgetall
+    # would prefix the key again and unpickle the values
+    for field, value in (redis.Redis.hgetall(cache, key) or {}).items():
+        hook, outcome = frappe.safe_decode(field).rsplit(":", 1)
+        counts.setdefault(hook, {"run": 0, "skipped": 0})[outcome] = int(value)
+    for hook_counts in counts.values():
+        total = hook_counts["run"] + hook_counts["skipped"]
+        hook_counts["skipped_percent"] = round(hook_counts["skipped"] * 100 / total, 1) if total else 0
+    if frappe.utils.cint(reset):
+        redis.Redis.delete(cache, key)
+    return counts
@@ -0,0 +1,63 @@
+"""
+Insert-or-return-existing for rows that must only be created once.
+
+Checking for an existing row and then inserting is racy: two concurrent
+requests can both see nothing and both insert. Where a unique index exists
+it is the check: every writer just inserts, and the ones that lose the race
+catch the duplicate-key error and return the row that won. Where it cannot
+exist, a lock serializes the check and the insert.
+"""
+
+from typing import Callable, ContextManager, Tuple, Type, TypeVar, Union
+
+T = TypeVar("T")
+
+
+def insert_or_get_existing(
+    insert: Callable[[], T],
+    get_existing: Callable[[], T],
+    duplicate_errors: Union[Type[Exception], Tuple[Type[Exception], ...]],
+) -> Tuple[T, bool]:
+    """
+    Run `insert`; on a duplicate-key error return `get_existing()` instead.
+
+    Args:
+        insert: Inserts the row and returns its name
+        get_existing: Returns the name of the row holding the key; it must see
+            rows committed by other transactions (a locking read)
+        duplicate_errors: Exception type(s) raised for a unique key violation
+
+    Returns:
+        tuple: (name, True if this call inserted the row)
+    """
+    try:
+        return insert(), True
+    except duplicate_errors:
+        existing = get_existing()
+        if existing is None:
+            raise
+        return existing, False
+
+
+def find_or_create_locked(lock: ContextManager, find: Callable[[], T], create: Callable[[], T]) -> Tuple[T, bool]:
+    """
+    Find a row, or create it, serialized by `lock`.
+
+    For rows no unique index can protect. The lookup is repeated inside the
+    lock, so a writer that waited on the lock finds the row its predecessor
+    created instead of creating another.
+
+    Args:
+        lock: Held around the lookup and creation, e.g. a named_lock
+        find: Returns the existing row or None; it must see rows committed
+            by other transactions
+        create: Creates the row and makes it visible (commits) before returning
+
+    Returns:
+        tuple: (row, True if this call created it)
+    """
+    with lock:
+        existing = find()
+        if existing:
+            return existing, False
+        return create(), True
@@ -0,0 +1,59 @@
+"""
+Named locks shared by every worker of a site.
+
+Backed by MariaDB's GET_LOCK, so a lock taken by a job on one worker is seen
+by jobs on any other worker or host using the same database. The lock is
+held by the database connection and released with it, so a crashed job
+cannot leave it behind.
+"""
+
+import frappe
+from contextlib import contextmanager
+
+
+class LockNotAcquiredError(Exception):
+    """Raised when a named lock is still held elsewhere after the timeout."""
+
+
+def get_lock_name(name):
+    """Prefix the lock with the database name, so sites sharing a server do not collide."""
+    # MariaDB lock names are limited to 64 characters
+    return f"{frappe.conf.db_name}:{name}"[:64]
+
+
+def acquire_lock(name, timeout=0):
+    """
+    Try to take a named lock.
+
+    Args:
+        name (str): Lock name
+        timeout (int): Seconds to wait for the lock; 0 returns immediately
+
+    Returns:
+        bool: True if the lock was acquired
+    """
+    return frappe.db.sql("SELECT GET_LOCK(%s, %s)", (get_lock_name(name), timeout))[0][0] == 1
+
+
+def release_lock(name):
+    """Release a named lock held by this connection."""
+    frappe.db.sql("SELECT RELEASE_LOCK(%s)", (get_lock_name(name),))
+
+
+@contextmanager
+def named_lock(name, timeout=0):
+    """
+    Hold a named lock for the duration of a block.
+
+        with named_lock("nightly_customer_pipeline"):
+            ...
+
+    Raises:
+        LockNotAcquiredError: If the lock is held elsewhere after `timeout` seconds
+    """
+    if not acquire_lock(name, timeout):
+        raise LockNotAcquiredError(f"Lock {name} is held by another process")
+    try:
+        yield
+    finally:
+        release_lock(name)
@@ -0,0 +1,56 @@
+"""
+Phone number normalization for exact, indexed lookups.
+
+Numbers reach us as "+91 98470 12345", "919847012345", "09847012345" or
+"9847012345". They are all normalized to one form, "+919847012345", which
+is stored in Customer.custom_normalized_mobile so a caller can be found
+with an equality match instead of a LIKE scan.
+"""
+
+from typing import List, Optional
+
+# National numbers are 10 digits (India); shorter numbers are kept as given
+NATIONAL_NUMBER_LENGTH = 10
+
+
+def normalize_phone(number, country_code: str = "91") -> Optional[str]:
+    """
+    Normalize a phone number to "+<country code><national number>".
+
+    Args:
+        number: Number in any common format
+        country_code (str): Country code for numbers without one
+
+    Returns:
+        str: The normalized number, or None if it has no digits
+    """
+    if not number:
+        return None
+    digits = "".join(char for char in str(number) if char.isdigit())
+    if not digits:
+        return None
+
+    if str(number).strip().startswith("00"):
+        # International prefix: 00 followed by the country code
+        digits = digits[2:]
+    elif len(digits) == NATIONAL_NUMBER_LENGTH + 1 and digits.startswith("0"):
+        # Trunk prefix: 0 followed by the national number
+        digits = country_code + digits[1:]
+    elif len(digits) == NATIONAL_NUMBER_LENGTH and not str(number).strip().startswith("+"):
+        digits = country_code + digits
+    return f"+{digits}"
+
+
+def phone_variants(normalized: str, country_code: str = "91") -> List[str]:
+    """
+    The formats a normalized number is commonly stored in, for exact matches
+    against columns that are not normalized (e.g. Contact Phone).
+    """
+    if not normalized:
+        return []
+    digits = normalized.lstrip("+")
+    variants = [normalized, digits]
+    if digits.startswith(country_code) and len(digits) == len(country_code) + NATIONAL_NUMBER_LENGTH:
+        national = digits[len(country_code):]
+        variants += [national, f"0{national}", f"+{country_code} {national}", f"+{country_code}-{national}"]
+    return variants
@@ -0,0 +1,117 @@
+"""
+Mergeable quantile sketch for customer spending.
+
+Values are counted in logarithmic buckets (the DDSketch layout): bucket i
+holds values in (gamma^(i-1), gamma^i], so any quantile is returned within
+`relative_accuracy` of the true value. Because a bucket is just a count, a
+value can be removed again as easily as it was added, which lets a
+customer's old total be swapped for the new one when a request completes.
+Sketches with the same accuracy merge by adding their bucket counts.
+"""
+
+import math
+
+DEFAULT_RELATIVE_ACCURACY = 0.01  # quantiles within 1% of the exact value
+
+
+class QuantileSketch:
+    """
+    Approximate quantiles over non-negative values with add, remove and merge.
+    """
+
+    def __init__(self, relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError("relative_accuracy must be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def bucket_index(self, value):
+        """Index of the bucket a positive value falls in."""
+        return math.ceil(math.log(value) / self.log_gamma)
+
+    def bucket_value(self, index):
+        """Representative value of a bucket, within relative_accuracy of every value in it."""
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        """Count a value (or `count` copies of it)."""
+        value = float(value or 0)
+        if value < 0:
+            raise ValueError("QuantileSketch only holds non-negative values")
+        if value == 0:
+            self.zero_count += count
+        else:
+            index = self.bucket_index(value)
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += count
+        return self
+
+    def remove(self, value, count=1):
+        """
+        Uncount a value that was added earlier.
+
+        Removing a value that is not in the sketch is ignored, so a missed
+        update cannot drive bucket counts negative.
+        """
+        value = float(value or 0)
+        if value <= 0:
+            removed = min(count, self.zero_count)
+            self.zero_count -= removed
+        else:
+            index = self.bucket_index(value)
+            removed = min(count, self.buckets.get(index, 0))
+            if removed == self.buckets.get(index, 0):
+                self.buckets.pop(index, None)
+            else:
+                self.buckets[index] -= removed
+        self.count -= removed
+        return self
+
+    def merge(self, other):
+        """Add another sketch's counts into this one."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Only sketches with the same relative_accuracy can be merged")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        return self
+
+    def quantile(self, q):
+        """
+        Approximate value at quantile q (0..1), or 0 for an empty sketch.
+
+        Ranks are taken as q * (count - 1), the same as numpy.percentile.
+        """
+        if not self.count:
+            return 0
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return self.bucket_value(index)
+        return self.bucket_value(max(self.buckets))
+
+    def to_dict(self):
+        """Serializable form, for storing the sketch in a document field."""
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "zero_count": self.zero_count,
+            "buckets": {str(index): count for index, count in self.buckets.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a sketch stored with to_dict."""
+        sketch = cls(data.get("relative_accuracy") or DEFAULT_RELATIVE_ACCURACY)
+        sketch.buckets = {int(index): count for index, count in (data.get("buckets") or {}).items()}
+        sketch.zero_count = data.get("zero_count") or 0
+        sketch.count = sketch.zero_count + sum(sketch.buckets.values())
+        return sketch
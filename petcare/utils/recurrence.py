@@ -0,0 +1,80 @@
+"""
+Closed-form recurrence dates for Service Repeats.
+
+Weekly, biweekly and monthly schedules are computed directly from the start
+date instead of stepping through every past occurrence, so the cost does
+not grow with a repeat's age. Monthly dates are always `start + k months`
+(clamped to the month's last day), so a repeat started on the 31st keeps
+returning to the 31st where the month has one. Custom schedules use an
+RFC 5545 RRULE, e.g. "FREQ=MONTHLY;BYDAY=1SA" for the first Saturday.
+"""
+
+from datetime import date, datetime, time
+from typing import List, Optional
+from dateutil.rrule import rrulestr
+from frappe.utils import add_days, add_months, getdate
+
+STEP_DAYS = {"Weekly": 7, "Biweekly": 14}
+
+
+def next_occurrence(start_date, frequency: str, after, rule: Optional[str] = None) -> Optional[date]:
+    """
+    First occurrence strictly after a date.
+
+    Args:
+        start_date: First occurrence of the schedule
+        frequency (str): Weekly, Biweekly or Monthly; ignored when `rule` is set
+        after: Occurrences on or before this date are skipped
+        rule (str, optional): RRULE for custom schedules
+
+    Returns:
+        date: The occurrence, or None for an unknown frequency or a finished rule
+    """
+    start_date, after = getdate(start_date), getdate(after)
+    if rule:
+        occurrence = rrulestr(rule, dtstart=datetime.combine(start_date, time())).after(
+            datetime.combine(after, time()), inc=False
+        )
+        return occurrence.date() if occurrence else None
+
+    if start_date > after:
+        return start_date if frequency in STEP_DAYS or frequency == "Monthly" else None
+
+    if frequency in STEP_DAYS:
+        step = STEP_DAYS[frequency]
+        steps = (after - start_date).days // step + 1
+        return add_days(start_date, steps * step)
+
+    if frequency == "Monthly":
+        months = (after.year - start_date.year) * 12 + after.month - start_date.month
+        occurrence = add_months(start_date, months)
+        if occurrence <= after:
+            occurrence = add_months(start_date, months + 1)
+        return occurrence
+
+    return None
+
+
+def occurrences_between(start_date, frequency: str, after, until, rule: Optional[str] = None) -> List[date]:
+    """
+    Occurrences in (after, until].
+
+    Returns:
+        list: Dates in ascending order
+    """
+    start_date, after, until = getdate(start_date), getdate(after), getdate(until)
+    if rule:
+        return [
+            occurrence.date()
+            for occurrence in rrulestr(rule, dtstart=datetime.combine(start_date, time())).between(
+                datetime.combine(after, time()), datetime.combine(until, time()), inc=True
+            )
+            if occurrence.date() > after
+        ]
+
+    occurrences = []
+    occurrence = next_occurrence(start_date, frequency, after)
+    while occurrence and occurrence <= until:
+        occurrences.append(occurrence)
+        occurrence = next_occurrence(start_date, frequency, occurrence)
+    return occurrences
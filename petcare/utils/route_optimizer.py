@@ -0,0 +1,246 @@
+"""
+Visiting-order optimisation for a truckstore's daily schedule.
+
+Node 0 is always the truckstore. Every other node is a service stop with an
+optional time window (seconds since midnight) and a service duration. Routes
+are built with a time-window aware nearest-neighbour pass and improved with
+2-opt; lateness past a window's end is penalised far above travel time, so
+the visiting order respects the scheduled windows whenever it can.
+"""
+
+import time
+from petcare.utils.travel_estimator import get_cached_legs, get_estimator, normalize_location
+
+LATENESS_PENALTY = 100  # one second late costs as much as 100 seconds of driving
+MAX_TWO_OPT_PASSES = 50
+
+
+def build_duration_matrix(truckstore, locations, estimator=None):
+    """
+    Build travel duration and distance matrices between all locations.
+
+    Cached Directions legs are used where available; all other legs are
+    estimated, so no Google API call is made.
+
+    Args:
+        truckstore (str): Truckstore used to pick the calibrated estimator
+        locations (list): "lat,lng" strings, truckstore first
+
+    Returns:
+        tuple: (durations, distances, estimated_legs) with square list matrices
+    """
+    estimator = estimator or get_estimator(truckstore)
+    cached = get_cached_legs(locations)
+    keys = [normalize_location(location) for location in locations]
+    size = len(locations)
+
+    durations = [[0.0] * size for _ in range(size)]
+    distances = [[0.0] * size for _ in range(size)]
+    estimated_legs = 0
+    for i in range(size):
+        for j in range(size):
+            if i == j or keys[i] == keys[j]:
+                continue
+            leg = cached.get((keys[i], keys[j]))
+            if leg:
+                durations[i][j] = leg.duration_seconds
+                distances[i][j] = leg.distance_meters
+            else:
+                estimate = estimator.estimate_leg(locations[i], locations[j])
+                durations[i][j] = estimate["duration_seconds"]
+                distances[i][j] = estimate["distance_meters"]
+                estimated_legs += 1
+    return durations, distances, estimated_legs
+
+
+def simulate_route(order, durations, windows, service_seconds, departure):
+    """
+    Walk a route and time every stop.
+
+    Args:
+        order (list): Stop indexes, excluding the truckstore at both ends
+        durations (list): Travel duration matrix in seconds
+        windows (list): (start, end) per node in seconds since midnight, or None
+        service_seconds (list): Time spent at each node
+        departure (float): Departure time from the truckstore
+
+    Returns:
+        tuple: (cost, stops) where stops holds arrival/start/lateness per stop
+    """
+    clock = departure
+    previous = 0
+    lateness = 0.0
+    stops = []
+    for node in order:
+        clock += durations[previous][node]
+        arrival = clock
+        window = windows[node]
+        if window and window[0] is not None and clock < window[0]:
+            clock = window[0]  # wait for the window to open
+        late = 0.0
+        if window and window[1] is not None and clock > window[1]:
+            late = clock - window[1]
+            lateness += late
+        stops.append({"node": node, "arrival": arrival, "start": clock, "late_seconds": late})
+        clock += service_seconds[node]
+        previous = node
+    clock += durations[previous][0]
+    cost = (clock - departure) + LATENESS_PENALTY * lateness
+    return cost, stops
+
+
+def nearest_neighbour(durations, windows, service_seconds, departure):
+    """
+    Greedy start: repeatedly go to the stop whose service can begin soonest,
+    counting any lateness past its window at the lateness penalty.
+    """
+    remaining = set(range(1, len(durations)))
+    order = []
+    clock = departure
+    previous = 0
+    while remaining:
+        best, best_key, best_start = None, None, None
+        for node in remaining:
+            start = clock + durations[previous][node]
+            window = windows[node]
+            if window and window[0] is not None:
+                start = max(start, window[0])
+            late = 0.0
+            closes = float("inf")
+            if window and window[1] is not None:
+                closes = window[1]
+                late = max(0.0, start - closes)
+            # Earliest possible start wins; ties go to the window that closes first
+            key = (start + LATENESS_PENALTY * late, closes)
+            if best_key is None or key < best_key:
+                best, best_key, best_start = node, key, start
+        order.append(best)
+        remaining.discard(best)
+        clock = best_start + service_seconds[best]
+        previous = best
+    return order
+
+
+def two_opt(order, durations, windows, service_seconds, departure):
+    """
+    Improve a route by reversing segments while the total cost drops.
+    Costs are recomputed with the time windows, not just travel distance.
+    """
+    best_cost, _ = simulate_route(order, durations, windows, service_seconds, departure)
+    for _ in range(MAX_TWO_OPT_PASSES):
+        improved = False
+        for i in range(len(order) - 1):
+            for j in range(i + 1, len(order)):
+                candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                cost, _ = simulate_route(candidate, durations, windows, service_seconds, departure)
+                if cost < best_cost - 1e-6:
+                    order, best_cost = candidate, cost
+                    improved = True
+        if not improved:
+            break
+    return order, best_cost
+
+
+def solve_route(durations, windows=None, service_seconds=None, departure=None):
+    """
+    Find a good visiting order for one truckstore's stops.
+
+    Args:
+        durations (list): Square travel duration matrix, node 0 is the truckstore
+        windows (list, optional): (start, end) per node in seconds since midnight
+        service_seconds (list, optional): Service time per node
+        departure (float, optional): Departure time; defaults to just in time
+                                     for the earliest window
+
+    Returns:
+        dict: order, per-stop timings, cost and solve time in milliseconds
+    """
+    started = time.perf_counter()
+    size = len(durations)
+    windows = windows or [None] * size
+    service_seconds = service_seconds or [0] * size
+
+    if departure is None:
+        openings = [
+            windows[node][0] - durations[0][node]
+            for node in range(1, size)
+            if windows[node] and windows[node][0] is not None
+        ]
+        departure = min(openings) if openings else 0
+
+    order = nearest_neighbour(durations, windows, service_seconds, departure)
+    order, cost = two_opt(order, durations, windows, service_seconds, departure)
+    _, stops = simulate_route(order, durations, windows, service_seconds, departure)
+
+    return {
+        "order": order,
+        "stops": stops,
+        "departure": departure,
+        "cost": cost,
+        "solve_ms": (time.perf_counter() - started) * 1000
+    }
+
+
+def make_synthetic_day(stops, seed=None, radius_km=15, service_minutes=60):
+    """
+    Random but realistic day for benchmarking: stops scattered around a
+    truckstore in Kochi, each with a two-hour window between 8 AM and 6 PM.
+
+    Returns:
+        tuple: (durations, windows, service_seconds) ready for solve_route
+    """
+    import math
+    import random
+    from petcare.utils.travel_estimator import TravelEstimator
+
+    rng = random.Random(seed)
+    depot = (10.0159, 76.3419)
+    locations = [f"{depot[0]},{depot[1]}"]
+    for _ in range(stops):
+        distance = rng.uniform(0.5, radius_km) / 111.0
+        angle = rng.uniform(0, 2 * math.pi)
+        locations.append(f"{depot[0] + distance * math.sin(angle)},{depot[1] + distance * math.cos(angle)}")
+
+    estimator = TravelEstimator()
+    size = len(locations)
+    durations = [[0.0] * size for _ in range(size)]
+    for i in range(size):
+        for j in range(size):
+            if i != j:
+                durations[i][j] = estimator.estimate_leg(locations[i], locations[j])["duration_seconds"]
+
+    windows = [None]
+    for _ in range(stops):
+        opens = rng.randrange(8, 16) * 3600
+        windows.append((opens, opens + 2 * 3600))
+    service_seconds = [0] + [service_minutes * 60] * stops
+    return durations, windows, service_seconds
+
+
+def benchmark(days=20, stops=12, seed=42):
+    """
+    Solve a batch of synthetic days and report solve-time statistics.
+
+    bench execute petcare.utils.route_optimizer.benchmark --kwargs "{'days': 50, 'stops': 15}"
+
+    Returns:
+        dict: Mean, p95 and max solve time in milliseconds plus lateness
+    """
+    timings = []
+    late_stops = 0
+    for day in range(days):
+        durations, windows, service_seconds = make_synthetic_day(stops, seed=seed + day)
+        result = solve_route(durations, windows, service_seconds)
+        timings.append(result["solve_ms"])
+        late_stops += sum(1 for stop in result["stops"] if stop["late_seconds"] > 0)
+
+    timings.sort()
+    summary = {
+        "days": days,
+        "stops_per_day": stops,
+        "mean_ms": round(sum(timings) / len(timings), 2),
+        "p95_ms": round(timings[min(len(timings) - 1, int(0.95 * len(timings)))], 2),
+        "max_ms": round(timings[-1], 2),
+        "late_stops": late_stops
+    }
+    return summary
@@ -0,0 +1,56 @@
+"""
+Days since a customer's last completed service.
+
+Only `custom_latest_completed_service_date` is stored on the Customer; the
+day count is derived when it is read, so it never goes stale and nothing
+has to rewrite it every night. Filters and sorting on the day count are
+translated to the stored date, which keeps them index-friendly.
+"""
+
+from datetime import date
+from typing import Dict, List, Optional
+from frappe.utils import getdate, add_days, today as get_today
+
+LATEST_SERVICE_FIELD = "custom_latest_completed_service_date"
+DAYS_SINCE_FIELD = "custom_days_since_last_service"
+
+# "days since >= N" is "latest date <= today - N", and so on
+FLIPPED_OPERATORS = {">=": "<=", ">": "<", "<=": ">=", "<": ">", "=": "="}
+
+
+def days_since(latest_service_date, today: Optional[date] = None) -> Optional[int]:
+    """
+    Days between the latest completed service and today.
+
+    Returns:
+        Optional[int]: None when the customer has no completed service
+    """
+    if not latest_service_date:
+        return None
+    return (getdate(today or get_today()) - getdate(latest_service_date)).days
+
+
+def days_since_filter(operator: str, days: int, today: Optional[date] = None) -> Dict:
+    """
+    Frappe filter for a condition on the day count, e.g. (">=", 30).
+
+    Customers without a completed service never match. For ">", ">=" and a
+    positive "=" that is as before, when their stored day count was 0; for
+    "<", "<=" and "= 0" they used to match and no longer do.
+    """
+    if operator not in FLIPPED_OPERATORS:
+        raise ValueError(f"Unsupported operator for days since last service: {operator}")
+    cutoff = add_days(getdate(today or get_today()), -int(days))
+    return {LATEST_SERVICE_FIELD: [FLIPPED_OPERATORS[operator], cutoff]}
+
+
+def days_since_order(direction: str = "desc") -> str:
+    """order_by clause sorting by the day count (most days = oldest date first)."""
+    return f"{LATEST_SERVICE_FIELD} {'asc' if direction == 'desc' else 'desc'}"
+
+
+def add_days_since(rows: List[Dict], today: Optional[date] = None) -> List[Dict]:
+    """Set the day count on rows fetched with the latest service date."""
+    for row in rows:
+        row[DAYS_SINCE_FIELD] = days_since(row.get(LATEST_SERVICE_FIELD), today)
+    return rows
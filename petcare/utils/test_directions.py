@@ -0,0 +1,39 @@
+# Copyright (c) 2026, sj and Contributors
+# See license.txt
+
+from frappe.tests.utils import FrappeTestCase
+from petcare.utils.directions import get_distance_matrix, MAX_MATRIX_ELEMENTS
+from petcare.utils.travel_estimator import TravelEstimator
+
+
+class LocalDistanceMatrixClient:
+	"""Stand-in for the Google client that answers from the haversine estimator."""
+
+	def __init__(self):
+		self.estimator = TravelEstimator()
+		self.requests = []
+
+	def distance_matrix(self, origins, destinations):
+		self.requests.append((len(origins), len(destinations)))
+		return [
+			[self.estimator.estimate_leg(origin, destination) for destination in destinations]
+			for origin in origins
+		]
+
+
+class TestDistanceMatrix(FrappeTestCase):
+	def test_batches_within_google_limits(self):
+		client = LocalDistanceMatrixClient()
+		truck = "10.0159,76.3419"
+		customers = [f"{10 + i / 1000},{76.3 + i / 1000}" for i in range(60)]
+
+		outbound = get_distance_matrix(client, [truck], customers)
+		inbound = get_distance_matrix(client, customers, [truck])
+
+		self.assertEqual(len(outbound), 60)
+		self.assertEqual(len(inbound), 60)
+		# 60 destinations need 3 requests each way instead of 120 Directions calls
+		self.assertEqual(len(client.requests), 6)
+		for origins, destinations in client.requests:
+			self.assertLessEqual(origins * destinations, MAX_MATRIX_ELEMENTS)
+			self.assertLessEqual(max(origins, destinations), 25)
@@ -0,0 +1,52 @@
+# Copyright (c) 2026, sj and Contributors
+# See license.txt
+
+from unittest.mock import patch
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from petcare.utils.hook_gating import depends_on, get_hook_gating_counts
+
+
+class TestHookGating(FrappeTestCase):
+	def setUp(self):
+		self.calls = []
+
+		@depends_on("status", "completed_date")
+		def hook(doc, method=None):
+			self.calls.append(doc.name)
+
+		self.hook = hook
+
+	def make_doc(self, **changes):
+		doc = frappe.get_doc({"doctype": "ToDo", "description": "Gating", "status": "Open"})
+		before = frappe.get_doc(doc.as_dict())
+		doc.update(changes)
+		doc._doc_before_save = before
+		return doc
+
+	@patch("petcare.utils.hook_gating.record")
+	def test_skips_unrelated_changes(self, record):
+		self.hook(self.make_doc(description="Only notes changed"), "on_update")
+		self.assertEqual(self.calls, [])
+		record.assert_called_once_with(f"{__name__}.TestHookGating.setUp.<locals>.hook", "skipped")
+
+	@patch("petcare.utils.hook_gating.record")
+	def test_runs_on_dependency_change_and_new_documents(self, record):
+		self.hook(self.make_doc(status="Closed"), "on_update")
+		new_doc = frappe.get_doc({"doctype": "ToDo", "description": "New"})
+		self.hook(new_doc, "on_update")
+		self.assertEqual(len(self.calls), 2)
+		self.assertEqual([call.args[1] for call in record.call_args_list], ["run", "run"])
+
+	def test_counts_runs_and_skips(self):
+		get_hook_gating_counts(reset=True)
+		self.hook(self.make_doc(description="Only notes changed"), "on_update")
+		self.hook(self.make_doc(description="Again"), "on_update")
+		self.hook(self.make_doc(status="Closed"), "on_update")
+
+		counts = get_hook_gating_counts(reset=True)
+		self.assertEqual(
+			counts[f"{__name__}.TestHookGating.setUp.<locals>.hook"],
+			{"run": 1, "skipped": 2, "skipped_percent": 66.7}
+		)
+		self.assertEqual(get_hook_gating_counts(), {})
@@ -0,0 +1,22 @@
+# Copyright (c) 2026, sj and Contributors
+# See license.txt
+
+from frappe.tests.utils import FrappeTestCase
+from petcare.utils.phone import normalize_phone, phone_variants
+
+
+class TestPhone(FrappeTestCase):
+	def test_common_formats_normalize_alike(self):
+		for number in ("+91 98470 12345", "919847012345", "09847012345", "9847012345", "0091-9847012345"):
+			self.assertEqual(normalize_phone(number), "+919847012345", number)
+
+	def test_other_countries_and_empty(self):
+		self.assertEqual(normalize_phone("+1 (415) 555-0100"), "+14155550100")
+		self.assertIsNone(normalize_phone(""))
+		self.assertIsNone(normalize_phone("n/a"))
+
+	def test_variants_include_national_forms(self):
+		self.assertEqual(
+			phone_variants("+919847012345"),
+			["+919847012345", "919847012345", "9847012345", "09847012345", "+91 9847012345", "+91-9847012345"],
+		)
@@ -0,0 +1,36 @@
+# Copyright (c) 2026, sj and Contributors
+# See license.txt
+
+import random
+import numpy as np
+from frappe.tests.utils import FrappeTestCase
+from petcare.utils.quantile_sketch import QuantileSketch
+
+
+class TestQuantileSketch(FrappeTestCase):
+	def test_quantiles_within_relative_accuracy(self):
+		rng = random.Random(7)
+		values = [rng.lognormvariate(8, 1) for _ in range(5000)]
+		sketch = QuantileSketch(0.01)
+		for value in values:
+			sketch.add(value)
+		for q in (0.5, 0.9, 0.99):
+			exact = np.percentile(values, q * 100, method="lower")
+			self.assertAlmostEqual(sketch.quantile(q), exact, delta=exact * 0.011)
+
+	def test_remove_undoes_add(self):
+		sketch = QuantileSketch().add(100).add(200).add(300)
+		sketch.remove(300).add(5000)
+		self.assertEqual(sketch.count, 3)
+		self.assertAlmostEqual(sketch.quantile(1), 5000, delta=50)
+		# Removing a value that was never added changes nothing
+		sketch.remove(42)
+		self.assertEqual(sketch.count, 3)
+
+	def test_merge_and_round_trip(self):
+		left = QuantileSketch().add(10).add(20)
+		right = QuantileSketch().add(30).add(0)
+		merged = QuantileSketch.from_dict(left.merge(right).to_dict())
+		self.assertEqual(merged.count, 4)
+		self.assertEqual(merged.quantile(0), 0)
+		self.assertAlmostEqual(merged.quantile(1), 30, delta=0.3)
@@ -0,0 +1,38 @@
+# Copyright (c) 2026, sj and Contributors
+# See license.txt
+
+from datetime import date
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days
+from petcare.utils.recurrence import next_occurrence, occurrences_between
+
+
+class TestRecurrence(FrappeTestCase):
+	def test_weekly_matches_stepping(self):
+		start = date(2023, 1, 4)
+		today = date(2026, 3, 10)
+		stepped = []
+		service_date = start
+		while service_date <= add_days(today, 30):
+			if service_date > today:
+				stepped.append(service_date)
+			service_date = add_days(service_date, 7)
+		self.assertEqual(occurrences_between(start, "Weekly", today, add_days(today, 30)), stepped)
+
+	def test_monthly_does_not_drift(self):
+		start = date(2026, 1, 31)
+		self.assertEqual(
+			occurrences_between(start, "Monthly", date(2026, 1, 31), date(2026, 5, 31)),
+			[date(2026, 2, 28), date(2026, 3, 31), date(2026, 4, 30), date(2026, 5, 31)],
+		)
+
+	def test_future_start_and_unknown_frequency(self):
+		self.assertEqual(next_occurrence(date(2026, 6, 1), "Biweekly", date(2026, 3, 1)), date(2026, 6, 1))
+		self.assertIsNone(next_occurrence(date(2026, 1, 1), "Yearly", date(2026, 3, 1)))
+
+	def test_custom_rule(self):
+		# First Saturday of every month
+		self.assertEqual(
+			occurrences_between(date(2026, 1, 1), "Monthly", date(2026, 2, 7), date(2026, 4, 30), "FREQ=MONTHLY;BYDAY=1SA"),
+			[date(2026, 3, 7), date(2026, 4, 4)],
+		)
@@ -0,0 +1,42 @@
+# Copyright (c) 2026, sj and Contributors
+# See license.txt
+
+import itertools
+from frappe.tests.utils import FrappeTestCase
+from petcare.utils.route_optimizer import make_synthetic_day, simulate_route, solve_route, benchmark
+
+
+class TestRouteOptimizer(FrappeTestCase):
+	def test_visits_every_stop_once(self):
+		durations, windows, service_seconds = make_synthetic_day(10, seed=1)
+		result = solve_route(durations, windows, service_seconds)
+		self.assertEqual(sorted(result["order"]), list(range(1, 11)))
+
+	def test_respects_time_windows(self):
+		# Stop 2 is closest but only opens in the afternoon
+		durations = [
+			[0, 900, 300],
+			[900, 0, 900],
+			[300, 900, 0],
+		]
+		windows = [None, (9 * 3600, 10 * 3600), (14 * 3600, 15 * 3600)]
+		result = solve_route(durations, windows, [0, 3600, 3600])
+		self.assertEqual(result["order"], [1, 2])
+		self.assertTrue(all(stop["late_seconds"] == 0 for stop in result["stops"]))
+
+	def test_close_to_optimal_on_small_days(self):
+		for seed in range(5):
+			durations, windows, service_seconds = make_synthetic_day(6, seed=seed)
+			result = solve_route(durations, windows, service_seconds)
+			optimal = min(
+				simulate_route(list(order), durations, windows, service_seconds, result["departure"])[0]
+				for order in itertools.permutations(range(1, 7))
+			)
+			self.assertLessEqual(result["cost"], optimal * 1.2)
+
+	def test_benchmark_summary(self):
+		summary = benchmark(days=5, stops=8)
+		self.assertEqual(summary["days"], 5)
+		self.assertEqual(summary["stops_per_day"], 8)
+		self.assertLessEqual(summary["mean_ms"], summary["max_ms"])
+		self.assertLessEqual(summary["p95_ms"], summary["max_ms"])
@@ -0,0 +1,78 @@
+# Copyright (c) 2026, sj and Contributors
+# See license.txt
+
+from unittest.mock import patch
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from petcare.utils import travel_estimator
+from petcare.utils.travel_estimator import (
+	TravelEstimator, cache_leg, get_estimator, haversine_meters, normalize_location,
+	DEFAULT_ROAD_FACTOR, MIN_CALIBRATION_SAMPLES
+)
+
+TEST_TRUCKSTORE = "_Test Estimator Truckstore"
+
+
+class TestTravelEstimator(FrappeTestCase):
+	def test_haversine_known_distance(self):
+		# One degree of latitude is ~111.2 km
+		self.assertAlmostEqual(haversine_meters("10.0,76.0", "11.0,76.0") / 1000, 111.2, delta=0.5)
+
+	def test_uses_defaults_without_enough_samples(self):
+		estimator = TravelEstimator([{"haversine_meters": 1000, "distance_meters": 2000, "duration_seconds": 200}])
+		self.assertEqual(estimator.road_factor, DEFAULT_ROAD_FACTOR)
+		self.assertEqual(estimator.sample_count, 0)
+
+	def test_fit_and_bounds(self):
+		samples = [
+			{"haversine_meters": h, "distance_meters": h * f, "duration_seconds": h * f * 0.1}
+			for h, f in [(1000, 1.3), (2000, 1.5), (5000, 1.4), (8000, 1.35), (12000, 1.45)]
+		]
+		estimator = TravelEstimator(samples)
+		self.assertAlmostEqual(estimator.road_factor, 1.41, delta=0.02)
+		self.assertAlmostEqual(estimator.seconds_per_meter, 0.1)
+
+		leg = estimator.estimate_leg("10.0,76.3", "10.05,76.35")
+		self.assertLess(leg["distance_meters_low"], leg["distance_meters"])
+		self.assertGreater(leg["distance_meters_high"], leg["distance_meters"])
+		self.assertGreaterEqual(leg["distance_meters_low"], leg["haversine_meters"])
+
+	def test_normalize_location(self):
+		self.assertEqual(normalize_location("10.0123456, 76.98765"), "10.0123,76.9877")
+		self.assertIsNone(normalize_location("not a place"))
+
+
+class TestEstimatorCache(FrappeTestCase):
+	"""The fitted estimator is reused until a new leg is cached."""
+
+	def setUp(self):
+		self.delete_legs()
+
+	def tearDown(self):
+		self.delete_legs()
+
+	def delete_legs(self):
+		frappe.db.delete("Travel Leg Cache", {"truckstore": TEST_TRUCKSTORE})
+		frappe.db.commit()
+		travel_estimator.clear_estimator_cache()
+
+	def cache_legs(self, count):
+		for i in range(count):
+			distance = 1000 * (i + 1)
+			leg = {"distance_meters": distance * 1.4, "duration_seconds": distance * 0.1}
+			cache_leg(TEST_TRUCKSTORE, "10.0,76.3", f"10.0,{76.3 + 0.009 * (i + 1)}", leg)
+		frappe.db.commit()
+
+	def test_reuses_fit_until_a_leg_is_cached(self):
+		self.cache_legs(MIN_CALIBRATION_SAMPLES)
+		with patch.object(travel_estimator, "fit_estimator", wraps=travel_estimator.fit_estimator) as fit:
+			first = get_estimator(TEST_TRUCKSTORE)
+			second = get_estimator(TEST_TRUCKSTORE)
+			self.assertEqual(fit.call_count, 1)
+			self.assertEqual(second.sample_count, MIN_CALIBRATION_SAMPLES)
+			self.assertEqual(second.road_factor, first.road_factor)
+
+			self.cache_legs(1)
+			refitted = get_estimator(TEST_TRUCKSTORE)
+			self.assertEqual(fit.call_count, 2)
+			self.assertEqual(refitted.sample_count, MIN_CALIBRATION_SAMPLES + 1)
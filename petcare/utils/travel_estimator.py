@@ -0,0 +1,349 @@
+"""
+Offline travel estimation for service requests.
+
+Road distance and duration are predicted from the straight-line (haversine)
+distance between two points, scaled by a per-truckstore road factor that is
+calibrated from Directions results stored in the Travel Leg Cache.
+"""
+
+import math
+import time
+import frappe
+from frappe.utils import now_datetime, add_days
+from petcare.utils.directions import get_directions_data
+
+EARTH_RADIUS_METERS = 6371008.8
+
+# Used until enough legs have been cached to calibrate a truckstore
+DEFAULT_ROAD_FACTOR = 1.35
+DEFAULT_SECONDS_PER_METER = 0.09  # roughly 40 km/h in city traffic
+DEFAULT_FACTOR_STDDEV = 0.25
+
+MIN_CALIBRATION_SAMPLES = 5
+MAX_CALIBRATION_SAMPLES = 500
+LEG_CACHE_MAX_AGE_DAYS = 90
+COORDINATE_PRECISION = 4  # ~11 m, so the same address maps to the same cache key
+Z_SCORE_95 = 1.96
+
+# Fitted estimators per truckstore, refitted at most this often or when a leg is cached
+ESTIMATOR_CACHE_KEY = "petcare:travel_estimator"
+ESTIMATOR_CACHE_TTL = 6 * 60 * 60
+ESTIMATOR_PARAMS = ["road_factor", "factor_stddev", "seconds_per_meter", "sample_count"]
+
+
+def parse_coordinates(location):
+    """
+    Parse a "lat,lng" string into a (lat, lng) tuple of floats.
+
+    Returns:
+        tuple: (lat, lng) or None if the string is not a coordinate pair
+    """
+    if not location:
+        return None
+    try:
+        lat, lng = map(float, str(location).split(","))
+    except (ValueError, TypeError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+def normalize_location(location):
+    """Round a "lat,lng" string so nearby lookups share a cache entry."""
+    coordinates = parse_coordinates(location)
+    if not coordinates:
+        return None
+    lat, lng = coordinates
+    return f"{round(lat, COORDINATE_PRECISION)},{round(lng, COORDINATE_PRECISION)}"
+
+
+def haversine_meters(origin, destination):
+    """
+    Great-circle distance in meters between two "lat,lng" strings.
+    """
+    lat1, lng1 = parse_coordinates(origin)
+    lat2, lng2 = parse_coordinates(destination)
+
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    d_phi = math.radians(lat2 - lat1)
+    d_lambda = math.radians(lng2 - lng1)
+
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * math.asin(math.sqrt(a))
+
+
+class TravelEstimator:
+    """
+    Predicts road distance and duration from haversine distance.
+
+    The road factor is the ratio of road to straight-line distance, fitted as a
+    least-squares line through the origin over cached legs. The spread of the
+    per-leg ratios gives the confidence bounds of each estimate.
+    """
+
+    def __init__(self, samples=None):
+        self.road_factor = DEFAULT_ROAD_FACTOR
+        self.factor_stddev = DEFAULT_FACTOR_STDDEV
+        self.seconds_per_meter = DEFAULT_SECONDS_PER_METER
+        self.sample_count = 0
+        if samples:
+            self.fit(samples)
+
+    def fit(self, samples):
+        """
+        Calibrate the estimator from cached legs.
+
+        Args:
+            samples (list): Dicts with haversine_meters, distance_meters and duration_seconds
+
+        Returns:
+            TravelEstimator: self, to allow chaining
+        """
+        samples = [
+            s for s in samples
+            if (s.get("haversine_meters") or 0) > 0 and (s.get("distance_meters") or 0) > 0
+        ]
+        if len(samples) < MIN_CALIBRATION_SAMPLES:
+            return self
+
+        sum_hh = sum(s["haversine_meters"] ** 2 for s in samples)
+        sum_hr = sum(s["haversine_meters"] * s["distance_meters"] for s in samples)
+        self.road_factor = max(1.0, sum_hr / sum_hh)
+
+        ratios = [s["distance_meters"] / s["haversine_meters"] for s in samples]
+        mean_ratio = sum(ratios) / len(ratios)
+        variance = sum((r - mean_ratio) ** 2 for r in ratios) / (len(ratios) - 1)
+        self.factor_stddev = math.sqrt(variance)
+
+        total_road = sum(s["distance_meters"] for s in samples)
+        total_duration = sum(s.get("duration_seconds") or 0 for s in samples)
+        if total_road and total_duration:
+            self.seconds_per_meter = total_duration / total_road
+
+        self.sample_count = len(samples)
+        return self
+
+    def estimate_leg(self, origin, destination):
+        """
+        Estimate a single leg between two "lat,lng" strings.
+
+        Returns:
+            dict: Estimated distance/duration with low and high bounds
+        """
+        straight = haversine_meters(origin, destination)
+        margin = Z_SCORE_95 * self.factor_stddev
+        low_factor = max(1.0, self.road_factor - margin)
+        high_factor = self.road_factor + margin
+
+        distance = straight * self.road_factor
+        return {
+            "distance_meters": distance,
+            "distance_meters_low": straight * low_factor,
+            "distance_meters_high": straight * high_factor,
+            "duration_seconds": distance * self.seconds_per_meter,
+            "duration_seconds_low": straight * low_factor * self.seconds_per_meter,
+            "duration_seconds_high": straight * high_factor * self.seconds_per_meter,
+            "haversine_meters": straight,
+        }
+
+
+def fit_estimator(truckstore=None):
+    """
+    Build an estimator calibrated for a truckstore.
+
+    Falls back to legs from every truckstore, and then to the defaults,
+    when too few legs have been cached for the truckstore itself.
+    """
+    fields = ["haversine_meters", "distance_meters", "duration_seconds"]
+    samples = []
+    if truckstore:
+        samples = frappe.get_all(
+            "Travel Leg Cache",
+            filters={"truckstore": truckstore},
+            fields=fields,
+            order_by="fetched_on desc",
+            limit=MAX_CALIBRATION_SAMPLES
+        )
+    if len(samples) < MIN_CALIBRATION_SAMPLES:
+        samples = frappe.get_all(
+            "Travel Leg Cache",
+            fields=fields,
+            order_by="fetched_on desc",
+            limit=MAX_CALIBRATION_SAMPLES
+        )
+    return TravelEstimator(samples)
+
+
+def get_estimator(truckstore=None):
+    """
+    The calibrated estimator for a truckstore, from the cache when it was
+    fitted less than ESTIMATOR_CACHE_TTL ago and no leg has been cached since.
+    """
+    cache = frappe.cache()
+    cached = cache.hget(ESTIMATOR_CACHE_KEY, truckstore or "")
+    if cached and time.time() - cached["fitted_at"] < ESTIMATOR_CACHE_TTL:
+        estimator = TravelEstimator()
+        for param in ESTIMATOR_PARAMS:
+            setattr(estimator, param, cached[param])
+        return estimator
+
+    estimator = fit_estimator(truckstore)
+    cache.hset(ESTIMATOR_CACHE_KEY, truckstore or "", {
+        "fitted_at": time.time(),
+        **{param: getattr(estimator, param) for param in ESTIMATOR_PARAMS}
+    })
+    return estimator
+
+
+def clear_estimator_cache():
+    """Drop every cached estimator, so the next quote refits from the new legs."""
+    frappe.cache().delete_value(ESTIMATOR_CACHE_KEY)
+
+
+def get_cached_leg(origin, destination):
+    """
+    Look up a fresh Directions result for a leg.
+
+    Returns:
+        dict: Cached leg or None if the leg was never fetched or has expired
+    """
+    origin = normalize_location(origin)
+    destination = normalize_location(destination)
+    if not origin or not destination:
+        return None
+
+    cached = frappe.get_all(
+        "Travel Leg Cache",
+        filters={
+            "origin": origin,
+            "destination": destination,
+            "fetched_on": [">=", add_days(now_datetime(), -LEG_CACHE_MAX_AGE_DAYS)]
+        },
+        fields=["distance_meters", "duration_seconds", "duration_in_traffic_seconds"],
+        order_by="fetched_on desc",
+        limit=1
+    )
+    return cached[0] if cached else None
+
+
+def get_cached_legs(locations):
+    """
+    Load every fresh cached leg between the given points in one query.
+
+    Args:
+        locations (list): "lat,lng" strings
+
+    Returns:
+        dict: {(origin, destination): leg} keyed by normalized locations
+    """
+    keys = list({normalize_location(location) for location in locations} - {None})
+    if not keys:
+        return {}
+
+    rows = frappe.get_all(
+        "Travel Leg Cache",
+        filters={
+            "origin": ["in", keys],
+            "destination": ["in", keys],
+            "fetched_on": [">=", add_days(now_datetime(), -LEG_CACHE_MAX_AGE_DAYS)]
+        },
+        fields=["origin", "destination", "distance_meters", "duration_seconds", "duration_in_traffic_seconds"],
+        order_by="fetched_on asc"
+    )
+    # Later rows overwrite earlier ones, so the freshest fetch wins
+    return {(row.origin, row.destination): row for row in rows}
+
+
+def cache_leg(truckstore, origin, destination, result, source="Directions"):
+    """
+    Store a Directions result so later quotes and calibrations can reuse it.
+
+    Args:
+        truckstore (str): Truckstore the leg starts or ends at
+        origin (str): "lat,lng" of the start point
+        destination (str): "lat,lng" of the end point
+        result (dict): distance_meters, duration_seconds, duration_in_traffic_seconds
+        source (str): Which Google API produced the result
+    """
+    origin = normalize_location(origin)
+    destination = normalize_location(destination)
+    if not origin or not destination:
+        return
+
+    frappe.get_doc({
+        "doctype": "Travel Leg Cache",
+        "truckstore": truckstore,
+        "origin": origin,
+        "destination": destination,
+        "source": source,
+        "fetched_on": now_datetime(),
+        "haversine_meters": round(haversine_meters(origin, destination)),
+        "distance_meters": result["distance_meters"],
+        "duration_seconds": result["duration_seconds"],
+        "duration_in_traffic_seconds": result.get("duration_in_traffic_seconds") or result["duration_seconds"]
+    }).insert(ignore_permissions=True)
+
+
+def get_round_trip(api_key, truckstore, locations):
+    """
+    Exact round trip over the given stops, fetching only legs missing from the cache.
+
+    Returns:
+        dict: Totals in the same shape as directions.calculate_round_trip
+    """
+    totals = {
+        "total_distance_meters": 0,
+        "total_duration_seconds": 0,
+        "total_duration_in_traffic_seconds": 0
+    }
+    for origin, destination in zip(locations, locations[1:]):
+        leg = get_cached_leg(origin, destination)
+        if not leg:
+            leg = get_directions_data(api_key, origin, destination)
+            cache_leg(truckstore, origin, destination, leg)
+        totals["total_distance_meters"] += leg["distance_meters"]
+        totals["total_duration_seconds"] += leg["duration_seconds"]
+        totals["total_duration_in_traffic_seconds"] += leg.get("duration_in_traffic_seconds") or leg["duration_seconds"]
+    return totals
+
+
+def estimate_round_trip(truckstore, locations, estimator=None):
+    """
+    Instant round-trip estimate without calling any Google API.
+
+    Cached legs are used as-is; the rest are predicted by the estimator.
+
+    Returns:
+        dict: Totals with low/high bounds and the number of estimated legs
+    """
+    estimator = estimator or get_estimator(truckstore)
+    totals = {
+        "total_distance_meters": 0,
+        "total_distance_meters_low": 0,
+        "total_distance_meters_high": 0,
+        "total_duration_seconds": 0,
+        "total_duration_seconds_low": 0,
+        "total_duration_seconds_high": 0,
+        "estimated_legs": 0,
+        "calibration_samples": estimator.sample_count
+    }
+    for origin, destination in zip(locations, locations[1:]):
+        leg = get_cached_leg(origin, destination)
+        if leg:
+            distance, duration = leg["distance_meters"], leg["duration_seconds"]
+            totals["total_distance_meters"] += distance
+            totals["total_distance_meters_low"] += distance
+            totals["total_distance_meters_high"] += distance
+            totals["total_duration_seconds"] += duration
+            totals["total_duration_seconds_low"] += duration
+            totals["total_duration_seconds_high"] += duration
+            continue
+
+        estimate = estimator.estimate_leg(origin, destination)
+        totals["estimated_legs"] += 1
+        for key in ("distance_meters", "duration_seconds"):
+            for suffix in ("", "_low", "_high"):
+                totals[f"total_{key}{suffix}"] += estimate[f"{key}{suffix}"]
+    return totals